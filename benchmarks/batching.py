@@ -0,0 +1,49 @@
+"""Throughput of batched short-clip decoding in lambda_transcriptor.
+
+Transcribes the same short clips one by one with MODEL.transcribe, as a job per
+invocation does, and together with transcribe_batch, as a 'jobs' event does.
+A random model decodes up to the token limit on every clip, so both paths do
+the same number of decoder steps.
+
+    python benchmarks/batching.py --dims tiny --clips 8 --seconds 10
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from common import DIMS, import_transcriptor, random_checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--dims', choices=DIMS, default='tiny')
+    parser.add_argument('--clips', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    lambda_transcriptor = import_transcriptor(random_checkpoint(args.dims))
+    model = lambda_transcriptor.MODEL
+    rng = np.random.default_rng(0)
+    samples = int(args.seconds * lambda_transcriptor.SAMPLE_RATE)
+    clips = [rng.uniform(-0.3, 0.3, samples).astype(np.float32)
+             for _ in range(args.clips)]
+
+    start = time.perf_counter()
+    for clip in clips:
+        model.transcribe(clip, **lambda_transcriptor.DECODE_OPTIONS)
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lambda_transcriptor.transcribe_batch(clips, model, vad=False)
+    batched = time.perf_counter() - start
+
+    print(json.dumps({'clips': args.clips,
+                      'sequential_seconds': round(sequential, 2),
+                      'batched_seconds': round(batched, 2),
+                      'speedup': round(sequential / batched, 2)}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
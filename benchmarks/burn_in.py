@@ -0,0 +1,73 @@
+"""Encode time of the burn-in of lambda_add_subtitles.
+
+A synthetic video (lavfi test pattern and tone) is subtitled with the single
+ffmpeg process of add_subtitles for every encoding profile, and then with
+add_subtitles_parallel for every segment count, using as many workers as
+segments and the default profile.
+
+    python benchmarks/burn_in.py --seconds 120 --segments 1 2 4 8
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from common import REPO, quiet_stderr, synthetic_video
+
+sys.path.insert(0, REPO)
+import lambda_add_subtitles  # noqa: E402
+
+
+def synthetic_subtitles(path, seconds):
+    cues = [(start, start + 2.5, f'Subtitle number {i}')
+            for i, start in enumerate(range(0, seconds, 3))]
+    return lambda_add_subtitles.write_srt(cues, path)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    with quiet_stderr():
+        function(*args, **kwargs)
+    return round(time.perf_counter() - start, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--seconds', type=int, default=60)
+    parser.add_argument('--size', default='1280x720')
+    parser.add_argument('--segments', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--profiles', nargs='+',
+                        default=list(lambda_add_subtitles.ENCODING_PROFILES))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        lambda_add_subtitles.tmp_folder = folder
+        synthetic_video(os.path.join(folder, 'video.mp4'), args.seconds, args.size)
+        synthetic_subtitles(os.path.join(folder, 'video.srt'), args.seconds)
+
+        results = {'cpus': lambda_add_subtitles.cpu_count(),
+                   'video_seconds': args.seconds,
+                   'profiles': {},
+                   'segments': {}}
+        for profile in args.profiles:
+            results['profiles'][profile] = timed(
+                lambda_add_subtitles.add_subtitles,
+                'video.mp4', 'video.srt', 'video_sub.mp4', profile)
+
+        baseline = timed(lambda_add_subtitles.add_subtitles,
+                         'video.mp4', 'video.srt', 'video_sub.mp4')
+        results['single_process_seconds'] = baseline
+        for count in args.segments:
+            seconds = timed(lambda_add_subtitles.add_subtitles_parallel,
+                            'video.mp4', 'video.srt', 'video_sub.mp4',
+                            workers=count,
+                            segment_seconds=args.seconds / count)
+            results['segments'][count] = {'seconds': seconds,
+                                          'speedup': round(baseline / seconds, 2)}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
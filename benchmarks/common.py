@@ -0,0 +1,116 @@
+"""Helpers shared by the benchmark scripts."""
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import threading
+import time
+
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_BUCKET = 'cperalesg-whisper-model'
+MODEL_KEY = 'benchmark.pt'
+
+# Same shapes as the official checkpoints, without downloading them
+DIMS = {
+    'tiny': dict(n_audio_state=384, n_audio_head=6, n_audio_layer=4,
+                 n_text_state=384, n_text_head=6, n_text_layer=4),
+    'base': dict(n_audio_state=512, n_audio_head=8, n_audio_layer=6,
+                 n_text_state=512, n_text_head=8, n_text_layer=6),
+    'small': dict(n_audio_state=768, n_audio_head=12, n_audio_layer=12,
+                  n_text_state=768, n_text_head=12, n_text_layer=12),
+    'medium': dict(n_audio_state=1024, n_audio_head=16, n_audio_layer=24,
+                   n_text_state=1024, n_text_head=16, n_text_layer=24),
+}
+
+
+class PeakRSS(threading.Thread):
+    """Samples the RSS of this process until stopped.
+
+    With children=True the RSS of its child processes (ffmpeg) is added.
+    """
+    def __init__(self, interval=0.005, children=False):
+        import psutil
+        super().__init__(daemon=True)
+        self.process = psutil.Process()
+        self.interval = interval
+        self.children = children
+        self.peak = self.rss()
+        self.running = True
+
+    def rss(self):
+        import psutil
+        rss = self.process.memory_info().rss
+        if self.children:
+            for child in self.process.children(recursive=True):
+                try:
+                    rss += child.memory_info().rss
+                except psutil.Error:
+                    pass
+        return rss
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, self.rss())
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.join()
+        self.peak = max(self.peak, self.rss())
+        return self.peak
+
+
+def synthetic_video(path, seconds, size, fps=30):
+    """lavfi test pattern with a 440 Hz tone, a keyframe every 2 seconds."""
+    subprocess.run(['ffmpeg', '-loglevel', 'error', '-y',
+                    '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={fps}',
+                    '-f', 'lavfi', '-i', 'sine=frequency=440',
+                    '-t', str(seconds), '-g', str(2 * fps),
+                    '-c:v', 'libx264', '-c:a', 'aac', '-shortest', path],
+                   check=True)
+
+
+@contextlib.contextmanager
+def quiet_stderr():
+    # ffmpeg output would hide the results
+    with open(os.devnull, 'w') as devnull:
+        stderr = os.dup(2)
+        os.dup2(devnull.fileno(), 2)
+        try:
+            yield
+        finally:
+            os.dup2(stderr, 2)
+            os.close(stderr)
+
+
+def random_checkpoint(name):
+    """Bytes of a randomly initialised fp16 checkpoint with the dims of name."""
+    import torch
+    from whisper.model import ModelDimensions, Whisper
+
+    dims = ModelDimensions(n_mels=80, n_audio_ctx=1500, n_vocab=51865,
+                           n_text_ctx=448, **DIMS[name])
+    model = Whisper(dims).half()
+    buffer = io.BytesIO()
+    torch.save({"dims": dims.__dict__,
+                "model_state_dict": model.state_dict()}, buffer)
+    return buffer.getvalue()
+
+
+def import_transcriptor(checkpoint, **environ):
+    """Import lambda_transcriptor with checkpoint served from a mocked S3."""
+    import boto3
+    from moto import mock_aws
+
+    if REPO not in sys.path:
+        sys.path.insert(0, REPO)
+    os.environ.update({'model': MODEL_KEY, 'model_cache_dir': '',
+                       'model_preload': 'init'}, **environ)
+    with mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=MODEL_BUCKET)
+        s3.put_object(Bucket=MODEL_BUCKET, Key=MODEL_KEY, Body=checkpoint)
+        import lambda_transcriptor
+    return lambda_transcriptor
@@ -0,0 +1,150 @@
+"""I/O of a transcription request, in sequence and overlapped.
+
+Against a moto server in another process, with --latency-ms added to every S3
+request of the transcriptor to stand for the round trip to S3, it times:
+
+    cold start  download of --audio-mb of audio, then the load of the model
+                from the model cache (before), or the download while the
+                model loads (prefetch_model)
+    publish     TXT and SRT of --segments written to files and uploaded one
+                after the other, then the cache copies and the status (before),
+                or publish_transcription
+
+    python benchmarks/io_overlap.py --dims base --latency-ms 50 --segments 2000
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from common import DIMS, MODEL_BUCKET, MODEL_KEY, REPO, random_checkpoint
+
+
+def sequential_cold_start(lambda_transcriptor, audio_key, folder):
+    lambda_transcriptor.receive_audio(audio_key, folder)
+    lambda_transcriptor.get_loaded_model()
+
+
+def overlapped_cold_start(lambda_transcriptor, audio_key, folder):
+    lambda_transcriptor.prefetch_model(lambda_transcriptor.MODEL_NAME)
+    lambda_transcriptor.receive_audio(audio_key, folder)
+    lambda_transcriptor.get_loaded_model()
+
+
+def sequential_publish(lambda_transcriptor, iid, transcription, cache_prefix, folder):
+    # publish_transcription before the outputs were uploaded from memory
+    t = lambda_transcriptor
+    txt_key, srt_key = t.output_keys(iid)
+    text_file = t.save_text(transcription['text'], os.path.join(folder, f'{iid}.txt'))
+    srt_file = t.save_transcription(transcription['segments'],
+                                    os.path.join(folder, f'{iid}.srt'))
+    t.s3_client.upload_file(text_file, t.AWS_BUCKET_NAME, txt_key,
+                            Config=t.s3_io.TRANSFER_CONFIG)
+    t.s3_client.upload_file(srt_file, t.AWS_BUCKET_NAME, srt_key,
+                            Config=t.s3_io.TRANSFER_CONFIG)
+    t.save_cached_results(cache_prefix, txt_key, srt_key)
+    t.write_status(iid, 'done', progress=1.0, started=time.time())
+
+
+def overlapped_publish(lambda_transcriptor, iid, transcription, cache_prefix, folder):
+    lambda_transcriptor.publish_transcription(iid, transcription, cache_prefix,
+                                              time.time())
+
+
+def median_seconds(function, repeats, before=None):
+    times = []
+    for _ in range(repeats):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return round(float(np.median(times)), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--dims', choices=DIMS, default='base')
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--audio-mb', type=int, default=32)
+    parser.add_argument('--segments', type=int, default=2000)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    import boto3
+
+    # In its own process, a threaded server would take the GIL from the model load
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = subprocess.Popen([sys.executable, '-m', 'moto.server', '-p', str(port)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.environ.update({'AWS_ENDPOINT_URL': f'http://127.0.0.1:{port}',
+                       'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                       'AWS_DEFAULT_REGION': 'us-east-1', 'model': MODEL_KEY,
+                       'model_preload': 'lazy', 'warmup': 'false'})
+    # The model is read from the local cache, only the audio goes through moto
+    model_cache_dir = tempfile.mkdtemp()
+    os.environ['model_cache_dir'] = model_cache_dir
+    try:
+        s3 = boto3.client('s3')
+        for _ in range(100):
+            try:
+                s3.list_buckets()
+                break
+            except Exception:
+                time.sleep(0.1)
+        s3.create_bucket(Bucket=MODEL_BUCKET)
+        s3.put_object(Bucket=MODEL_BUCKET, Key=MODEL_KEY, Body=random_checkpoint(args.dims))
+        if REPO not in sys.path:
+            sys.path.insert(0, REPO)
+        import lambda_transcriptor
+
+        bucket = lambda_transcriptor.AWS_BUCKET_NAME
+        s3.create_bucket(Bucket=bucket)
+        audio_key = 'audio/benchmark.mp3'
+        s3.put_object(Bucket=bucket, Key=audio_key, Body=os.urandom(args.audio_mb << 20))
+        lambda_transcriptor.s3_client.meta.events.register(
+            'before-send.s3', lambda **kwargs: time.sleep(args.latency_ms / 1000))
+
+        segments = [{'start': i * 2.0, 'end': i * 2.0 + 1.5, 'text': f'Segment {i}'}
+                    for i in range(args.segments)]
+        transcription = {'segments': segments,
+                         'text': ' '.join(segment['text'] for segment in segments)}
+        cache_prefix = 'processed/cache/benchmark/base'
+
+        lambda_transcriptor.get_loaded_model()
+
+        def unload():
+            lambda_transcriptor.MODEL = None
+
+        report = {'latency_ms': args.latency_ms, 'audio_mb': args.audio_mb,
+                  'segments': args.segments}
+        with tempfile.TemporaryDirectory() as folder:
+            for name, cold_start, publish in (
+                    ('before', sequential_cold_start, sequential_publish),
+                    ('overlapped', overlapped_cold_start, overlapped_publish)):
+                report[name] = {
+                    'cold_start_seconds': median_seconds(
+                        lambda: cold_start(lambda_transcriptor, audio_key, folder),
+                        args.repeats, before=unload),
+                    'publish_seconds': median_seconds(
+                        lambda: publish(lambda_transcriptor, 'benchmark', transcription,
+                                        cache_prefix, folder),
+                        args.repeats)}
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(model_cache_dir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Cold start benchmark for the model loading of lambda_transcriptor.
+
+Every variant runs in a fresh process against a mocked S3 bucket, and reports
+the time spent in get_loaded_model, without the warm up, together with the
+peak RSS growth caused by the load.
+
+    python benchmarks/model_load.py                      # random 'base' model
+    python benchmarks/model_load.py --dims medium
+    python benchmarks/model_load.py --checkpoint models/medium.pt
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import MODEL_BUCKET, MODEL_KEY, REPO, DIMS, PeakRSS, random_checkpoint
+
+
+def run_child(checkpoint_file):
+    # Heavy imports are done before measuring, they are not part of the model load
+    import boto3
+    import torch
+    import whisper
+    from moto import mock_aws
+
+    sys.path.insert(0, REPO)
+    # model_preload=lazy, the model is only loaded by get_loaded_model
+    import lambda_transcriptor
+    with mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=MODEL_BUCKET)
+        with open(checkpoint_file, 'rb') as f:
+            s3.put_object(Bucket=MODEL_BUCKET, Key=MODEL_KEY, Body=f.read())
+
+        monitor = PeakRSS()
+        baseline = monitor.peak
+        monitor.start()
+        start = time.perf_counter()
+        lambda_transcriptor.get_loaded_model()
+        duration = time.perf_counter() - start
+        peak = monitor.stop()
+
+    print(json.dumps({'seconds': round(duration, 3),
+                      'peak_rss_mb': round((peak - baseline) / 2 ** 20, 1),
+                      'torch': torch.__version__,
+                      'whisper': whisper.__version__}))
+
+
+def run_variant(checkpoint_file, cache_dir):
+    env = dict(os.environ, model=MODEL_KEY, model_cache_dir=cache_dir,
+               model_preload='lazy', warmup='false')
+    output = subprocess.run([sys.executable, __file__, '--child', checkpoint_file],
+                            env=env, check=True, capture_output=True, text=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--dims', choices=DIMS, default='base')
+    parser.add_argument('--checkpoint', help='Use this checkpoint file instead')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args.child)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint_file = args.checkpoint
+        if checkpoint_file is None:
+            checkpoint_file = os.path.join(tmp, MODEL_KEY)
+            with open(checkpoint_file, 'wb') as f:
+                f.write(random_checkpoint(args.dims))
+
+        cache_dir = os.path.join(tmp, 'cache')
+        results = {
+            'checkpoint_mb': round(os.path.getsize(checkpoint_file) / 2 ** 20, 1),
+            'in_memory': run_variant(checkpoint_file, ''),
+            'mmap_cache_miss': run_variant(checkpoint_file, cache_dir),
+            'mmap_cache_hit': run_variant(checkpoint_file, cache_dir),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""End to end benchmark of the extract -> transcribe -> burn-in pipeline.
+
+Synthetic videos of every length (lavfi test pattern and tone) go through the
+stages against a mocked S3 bucket:
+
+    extract_audio       lambda_extract_audio.lambda_handler
+    get_transcription   with a randomly initialised Whisper, no download
+    save_transcription  SRT of the segments
+    add_subtitles       lambda_add_subtitles.lambda_handler
+
+Every stage runs --repeats times per length. The JSON report has, per length
+and stage, the latency percentiles in seconds, the throughput in media seconds
+per second and the peak RSS (with ffmpeg children) in MB. Save it with
+--output and compare reports between commits.
+
+    python benchmarks/pipeline.py --lengths 10 30 60 --repeats 3 --output base.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from common import (DIMS, REPO, PeakRSS, import_transcriptor, quiet_stderr,
+                    random_checkpoint, synthetic_video)
+
+BUCKET = 'cperalesg-video-subtitler'
+
+
+def measure(function, *args, **kwargs):
+    """Run function, returns its result, the seconds and the peak RSS."""
+    monitor = PeakRSS(children=True)
+    monitor.start()
+    start = time.perf_counter()
+    try:
+        # The handlers print a metrics line and ffmpeg its progress
+        with quiet_stderr(), contextlib.redirect_stdout(io.StringIO()):
+            result = function(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        peak = monitor.stop()
+    return result, seconds, peak
+
+
+def summary(seconds, peaks, media_seconds):
+    seconds = np.array(seconds)
+    return {'runs': len(seconds),
+            'p50_seconds': round(float(np.percentile(seconds, 50)), 4),
+            'p90_seconds': round(float(np.percentile(seconds, 90)), 4),
+            'p99_seconds': round(float(np.percentile(seconds, 99)), 4),
+            'media_seconds_per_second': round(media_seconds / float(np.median(seconds)), 2),
+            'peak_rss_mb': round(max(peaks) / 2 ** 20, 1)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO,
+                              check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--lengths', type=int, nargs='+', default=[10, 30, 60],
+                        help='Video lengths in seconds')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--size', default='640x360')
+    parser.add_argument('--dims', choices=DIMS, default='tiny')
+    parser.add_argument('--audio-format', choices=['mp3', 'pcm'], default='pcm')
+    parser.add_argument('--profile', default='fast')
+    parser.add_argument('--output', help='Also write the report to this file')
+    args = parser.parse_args()
+
+    import boto3
+    from moto import mock_aws
+
+    lambda_transcriptor = import_transcriptor(random_checkpoint(args.dims),
+                                              warmup='false', result_cache='false')
+    with mock_aws():
+        # Imported in the mock so their clients get its credentials
+        import lambda_extract_audio
+        import lambda_add_subtitles
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET)
+
+        report = {'commit': git_commit(),
+                  'model': args.dims,
+                  'audio_format': args.audio_format,
+                  'profile': args.profile,
+                  'lengths': {}}
+        with tempfile.TemporaryDirectory() as folder:
+            for length in args.lengths:
+                video_key = f'video/bench_{length}.mp4'
+                video_file = os.path.join(folder, f'bench_{length}.mp4')
+                synthetic_video(video_file, length, args.size)
+                s3.upload_file(video_file, BUCKET, video_key)
+
+                stages = {name: ([], []) for name in (
+                    'extract_audio', 'get_transcription', 'save_transcription',
+                    'add_subtitles')}
+
+                def record(name, seconds, peak):
+                    stages[name][0].append(seconds)
+                    stages[name][1].append(peak)
+
+                for _ in range(args.repeats):
+                    response, *timing = measure(
+                        lambda_extract_audio.lambda_handler,
+                        {'body': {'key': video_key, 'uid': 'bench',
+                                  'bucket': BUCKET, 'format': args.audio_format}},
+                        None)
+                    record('extract_audio', *timing)
+
+                    audio_file = os.path.join(
+                        folder, os.path.basename(response['body']['key']))
+                    s3.download_file(BUCKET, response['body']['key'], audio_file)
+                    transcription, *timing = measure(
+                        lambda_transcriptor.get_transcription, audio_file,
+                        lambda_transcriptor.MODEL, workers=1, vad=False)
+                    record('get_transcription', *timing)
+
+                    srt_file = os.path.join(folder, f'bench_{length}.srt')
+                    _, *timing = measure(lambda_transcriptor.save_transcription,
+                                         transcription['segments'], srt_file)
+                    record('save_transcription', *timing)
+
+                    srt_key = f'processed/srt/bench_{length}.srt'
+                    s3.upload_file(srt_file, BUCKET, srt_key)
+                    _, *timing = measure(
+                        lambda_add_subtitles.lambda_handler,
+                        {'body': {'video': {'key': video_key},
+                                  'srt': {'key': srt_key},
+                                  'bucket': BUCKET, 'profile': args.profile}},
+                        None)
+                    record('add_subtitles', *timing)
+
+                report['lengths'][length] = {
+                    name: summary(seconds, peaks, length)
+                    for name, (seconds, peaks) in stages.items()}
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    if REPO not in sys.path:
+        sys.path.insert(0, REPO)
+    main()
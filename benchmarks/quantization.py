@@ -0,0 +1,102 @@
+"""Speed, size and WER of the int8 quantized model against the fp32 one.
+
+No clip is bundled with the repository (media files are ignored), so pass a
+short speech clip with --audio and, if available, its transcript with
+--reference. Without a reference, the WER of the int8 model is measured
+against the fp32 transcription. Without --audio, a synthetic fixture is used,
+which is only meaningful for the speed.
+
+    python benchmarks/quantization.py --checkpoint models/small.pt \\
+        --audio clip.mp3 --reference clip.txt
+"""
+import argparse
+import io
+import json
+import re
+import time
+
+from common import DIMS, import_transcriptor, random_checkpoint
+from vad import fixture
+
+
+def words(text):
+    return re.findall(r"[\w']+", text.lower())
+
+
+def word_error_rate(reference, hypothesis):
+    reference, hypothesis = words(reference), words(hypothesis)
+    distances = list(range(len(hypothesis) + 1))
+    for i, reference_word in enumerate(reference, start=1):
+        previous, distances[0] = distances[0], i
+        for j, hypothesis_word in enumerate(hypothesis, start=1):
+            previous, distances[j] = distances[j], min(
+                distances[j] + 1,
+                distances[j - 1] + 1,
+                previous + (reference_word != hypothesis_word))
+    return distances[-1] / max(1, len(reference))
+
+
+def model_size_mb(model):
+    import torch
+    buffer = io.BytesIO()
+    torch.save(model, buffer)
+    return len(buffer.getvalue()) / 2 ** 20
+
+
+def benchmark(lambda_transcriptor, model, audio):
+    # A first short run keeps one-off initialisation out of the timing
+    lambda_transcriptor.get_transcription(audio[:16000], model, workers=1)
+    start = time.perf_counter()
+    transcription = lambda_transcriptor.get_transcription(audio, model, workers=1)
+    seconds = time.perf_counter() - start
+    return {'seconds': round(seconds, 2),
+            'realtime_factor': round(seconds * 16000 / len(audio), 3),
+            'model_mb': round(model_size_mb(model), 1)}, transcription['text']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--dims', choices=DIMS, default='tiny')
+    parser.add_argument('--checkpoint', help='Use this checkpoint file instead')
+    parser.add_argument('--audio', help='Speech clip to transcribe')
+    parser.add_argument('--reference', help='Text file with the transcript')
+    args = parser.parse_args()
+
+    if args.checkpoint:
+        with open(args.checkpoint, 'rb') as f:
+            checkpoint = f.read()
+    else:
+        checkpoint = random_checkpoint(args.dims)
+    lambda_transcriptor = import_transcriptor(checkpoint)
+
+    if args.audio:
+        audio = lambda_transcriptor.load_audio(args.audio)
+    else:
+        audio = fixture(minutes=1)
+
+    fp32_model = lambda_transcriptor.load_model_bytes(checkpoint)
+    fp32, fp32_text = benchmark(lambda_transcriptor, fp32_model, audio)
+    del fp32_model
+    int8_model = lambda_transcriptor.quantize_model(
+        lambda_transcriptor.load_model_bytes(checkpoint))
+    int8, int8_text = benchmark(lambda_transcriptor, int8_model, audio)
+
+    if args.reference:
+        with open(args.reference) as f:
+            reference = f.read()
+        fp32['wer'] = round(word_error_rate(reference, fp32_text), 4)
+        int8['wer'] = round(word_error_rate(reference, int8_text), 4)
+        wer_delta = int8['wer'] - fp32['wer']
+    else:
+        wer_delta = word_error_rate(fp32_text, int8_text)
+
+    print(json.dumps({'audio_seconds': round(len(audio) / 16000, 1),
+                      'fp32': fp32,
+                      'int8': int8,
+                      'wer_delta': round(wer_delta, 4),
+                      'speedup': round(fp32['seconds'] / int8['seconds'], 2)},
+                     indent=2))
+
+
+if __name__ == '__main__':
+    main()
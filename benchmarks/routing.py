@@ -0,0 +1,75 @@
+"""Transcription speed of every model size, for duration based routing.
+
+Each size transcribes --seconds of audio with one worker, --repeats times, and
+its speed is the audio seconds transcribed per second (median). The speeds are
+printed as the 'model_speeds' environment variable of the transcriptor, along
+with the plan it would pick for a few durations and --target.
+
+Random weights of the official shapes are used unless --checkpoint-dir holds
+<size>.pt files. Random models decode tokens until the window is full, so
+their speeds are a lower bound. Run it with the memory of the function.
+
+    python benchmarks/routing.py --sizes tiny base small --seconds 60
+    python benchmarks/routing.py --checkpoint-dir models/ --target 120
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from common import DIMS, import_transcriptor, random_checkpoint
+
+
+def checkpoint(size, checkpoint_dir):
+    if checkpoint_dir:
+        with open(os.path.join(checkpoint_dir, f'{size}.pt'), 'rb') as f:
+            return f.read()
+    return random_checkpoint(size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', nargs='+', choices=DIMS, default=list(DIMS))
+    parser.add_argument('--seconds', type=float, default=60)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--checkpoint-dir')
+    parser.add_argument('--target', type=float, default=300,
+                        help='target_latency_seconds of the plans')
+    parser.add_argument('--durations', type=float, nargs='+',
+                        default=[30, 600, 3600, 7200])
+    args = parser.parse_args()
+
+    lambda_transcriptor = import_transcriptor(
+        checkpoint(args.sizes[0], args.checkpoint_dir), warmup='false')
+    samples = int(args.seconds * lambda_transcriptor.SAMPLE_RATE)
+    audio = np.random.default_rng(0).uniform(-0.3, 0.3, samples).astype(np.float32)
+
+    speeds = {}
+    for size in args.sizes:
+        model = lambda_transcriptor.load_model_bytes(checkpoint(size, args.checkpoint_dir))
+        lambda_transcriptor.get_transcription(audio[:lambda_transcriptor.SAMPLE_RATE],
+                                              model, workers=1, vad=False)
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            lambda_transcriptor.get_transcription(audio, model, workers=1, vad=False)
+            times.append(time.perf_counter() - start)
+        speeds[size] = round(args.seconds / float(np.median(times)), 2)
+        del model
+
+    lambda_transcriptor.MODEL_SPEEDS.update(speeds)
+    models = [f'{size}.pt' for size in args.sizes]
+    plans = {duration: lambda_transcriptor.plan_transcription(
+                duration, models, args.target)
+             for duration in args.durations}
+    print(json.dumps({'audio_seconds': args.seconds,
+                      'model_speeds': json.dumps(speeds),
+                      'target_latency_seconds': args.target,
+                      'transcribe_workers': lambda_transcriptor.TRANSCRIBE_WORKERS,
+                      'plans': plans}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
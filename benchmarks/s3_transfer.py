@@ -0,0 +1,107 @@
+"""Benchmark of large S3 transfers with the default and the tuned settings.
+
+A file of --size-mb random bytes is uploaded and downloaded --repeats times
+against a moto server on localhost, once with boto3's default client and
+TransferConfig and once with the ones of s3_io. The server keeps everything in
+memory, so the numbers show the effect of the part size and of the parts in
+flight, not those of the network to S3. Run it in a Lambda or an EC2 instance
+with a real --bucket for those.
+
+    python benchmarks/s3_transfer.py --size-mb 256 --repeats 3
+    python benchmarks/s3_transfer.py --bucket my-bucket --memory-mb 3008
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from common import REPO
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def measure(client, config, bucket, source, repeats):
+    """Median seconds of the upload and download of source."""
+    key = f'benchmark/{os.path.basename(source)}'
+    target = source + '.download'
+    uploads, downloads = [], []
+    for _ in range(repeats):
+        uploads.append(timed(client.upload_file, source, bucket, key, Config=config))
+        downloads.append(timed(client.download_file, bucket, key, target, Config=config))
+    os.remove(target)
+    client.delete_object(Bucket=bucket, Key=key)
+    return float(np.median(uploads)), float(np.median(downloads))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--memory-mb', type=int, default=2048,
+                        help='Lambda memory the tuned concurrency is sized for')
+    parser.add_argument('--bucket', help='Real bucket to use instead of a moto server')
+    args = parser.parse_args()
+
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+
+    import s3_io
+
+    server = None
+    bucket = args.bucket
+    endpoint = {}
+    if bucket is None:
+        from moto.server import ThreadedMotoServer
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = ThreadedMotoServer(port=0, verbose=False)
+        server.start()
+        host, port = server.get_host_and_port()
+        endpoint = {'endpoint_url': f'http://{host}:{port}',
+                    'aws_access_key_id': 'testing', 'aws_secret_access_key': 'testing'}
+        bucket = 'benchmark'
+
+    candidates = {
+        'default': (boto3.client('s3', region_name='us-east-1', **endpoint),
+                    TransferConfig()),
+        'tuned': (boto3.client('s3', region_name='us-east-1', config=s3_io.CLIENT_CONFIG,
+                               **endpoint),
+                  s3_io.transfer_config(memory_mb=args.memory_mb)),
+    }
+    if server is not None:
+        candidates['default'][0].create_bucket(Bucket=bucket)
+
+    report = {'size_mb': args.size_mb, 'memory_mb': args.memory_mb}
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            source = os.path.join(folder, 'large.bin')
+            with open(source, 'wb') as f:
+                for _ in range(args.size_mb):
+                    f.write(os.urandom(s3_io.MB))
+            for name, (client, config) in candidates.items():
+                upload, download = measure(client, config, bucket, source, args.repeats)
+                report[name] = {
+                    'chunk_mb': config.multipart_chunksize // s3_io.MB,
+                    'max_concurrency': config.max_concurrency,
+                    'upload_seconds': round(upload, 3),
+                    'download_seconds': round(download, 3),
+                    'upload_mb_per_second': round(args.size_mb / upload, 1),
+                    'download_mb_per_second': round(args.size_mb / download, 1)}
+    finally:
+        if server is not None:
+            server.stop()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    if REPO not in sys.path:
+        sys.path.insert(0, REPO)
+    main()
@@ -0,0 +1,74 @@
+"""SRT serialization of long transcriptions, per segment and vectorized.
+
+--segments synthetic Whisper segments are turned into an SRT document
+--repeats times with the f-string per segment of the transcriptor before
+subtitles.py, and with subtitles.serialize (SRT and WebVTT). The median
+seconds and segments per second are printed.
+
+    python benchmarks/serialization.py --segments 100000
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from common import REPO
+
+
+def seconds_to_hh_mm_seconds(total_seconds):
+    # Before subtitles.py, without the zero-padding of the milliseconds
+    hours, remainder = divmod(total_seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    miliseconds = (seconds - int(seconds)) * 1000
+    return f"{int(hours):02}:{int(minutes):02}:{int(seconds):02},{int(miliseconds)}"
+
+
+def per_segment(segments):
+    return ''.join(f"{idx}\n"
+                   f"{seconds_to_hh_mm_seconds(float(entry['start']))} --> "
+                   f"{seconds_to_hh_mm_seconds(float(entry['end']))}\n"
+                   f"{entry['text']}\n\n"
+                   for idx, entry in enumerate(segments, start=1))
+
+
+def synthetic_segments(n, seed=0):
+    rng = np.random.default_rng(seed)
+    starts = np.cumsum(rng.uniform(0.5, 4, n))
+    ends = starts + rng.uniform(0.3, 3, n)
+    return [{'id': i, 'start': float(start), 'end': float(end),
+             'text': f' Segment {i} of the synthetic transcription.'}
+            for i, (start, end) in enumerate(zip(starts, ends))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--segments', type=int, default=100000)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    if REPO not in sys.path:
+        sys.path.insert(0, REPO)
+    import subtitles
+
+    segments = synthetic_segments(args.segments)
+    candidates = {'per_segment': per_segment,
+                  'vectorized_srt': subtitles.serialize,
+                  'vectorized_vtt': lambda segments: subtitles.serialize(segments, 'vtt')}
+    report = {'segments': args.segments}
+    for name, serialize in candidates.items():
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            document = serialize(segments)
+            times.append(time.perf_counter() - start)
+        seconds = float(np.median(times))
+        report[name] = {'seconds': round(seconds, 4),
+                        'segments_per_second': round(args.segments / seconds),
+                        'mb': round(len(document.encode()) / 2 ** 20, 2)}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
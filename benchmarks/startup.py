@@ -0,0 +1,86 @@
+"""Cold start of lambda_transcriptor with each model_preload mode.
+
+Every mode runs in a fresh process with the checkpoint in a mocked S3. From
+the start of the import, it times the import itself, a request rejected by
+validation, a warm up request and a first get_transcription, and reports
+whether torch had been imported when the first response was sent.
+
+    python benchmarks/startup.py --dims base --seconds 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import DIMS, MODEL_BUCKET, MODEL_KEY, REPO, random_checkpoint
+
+
+def run_child(checkpoint_path, seconds):
+    import boto3
+    import numpy as np
+    from moto import mock_aws
+
+    with open(checkpoint_path, 'rb') as f:
+        checkpoint = f.read()
+    sys.path.insert(0, REPO)
+    os.environ.update({'model': MODEL_KEY, 'model_cache_dir': ''})
+
+    with mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=MODEL_BUCKET)
+        s3.put_object(Bucket=MODEL_BUCKET, Key=MODEL_KEY, Body=checkpoint)
+
+        start = time.perf_counter()
+        import lambda_transcriptor
+        timings = {'import': time.perf_counter() - start}
+        lambda_transcriptor.lambda_handler({'body': {}}, {})
+        timings['validation_response'] = time.perf_counter() - start
+        torch_imported = 'torch' in sys.modules
+        response = lambda_transcriptor.lambda_handler({'body': {'warmup': True}}, {})
+        timings['warmup_response'] = time.perf_counter() - start
+
+        samples = int(seconds * lambda_transcriptor.SAMPLE_RATE)
+        audio = np.random.default_rng(0).uniform(-0.3, 0.3, samples).astype(np.float32)
+        lambda_transcriptor.get_transcription(
+            audio, lambda_transcriptor.get_loaded_model(), workers=1, vad=False)
+        timings['first_transcription'] = time.perf_counter() - start
+
+    print(json.dumps({'seconds_since_import': {name: round(value, 3)
+                                               for name, value in timings.items()},
+                      'torch_at_first_response': torch_imported,
+                      'warmup_model': response['body']['model'],
+                      'init_timings': lambda_transcriptor.INIT_TIMINGS}))
+
+
+def run_mode(checkpoint_path, seconds, mode):
+    env = dict(os.environ, model_preload=mode)
+    output = subprocess.run([sys.executable, __file__, '--child', checkpoint_path,
+                             '--seconds', str(seconds)],
+                            env=env, check=True, capture_output=True, text=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--dims', choices=DIMS, default='base')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--modes', nargs='+', default=['init', 'background', 'lazy'])
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args.child, args.seconds)
+
+    # The checkpoint is built here, the children must not import torch first
+    with tempfile.NamedTemporaryFile(suffix='.pt') as f:
+        f.write(random_checkpoint(args.dims))
+        f.flush()
+        print(json.dumps({mode: run_mode(f.name, args.seconds, mode)
+                          for mode in args.modes}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Peak memory of transcriptions of growing length, whole file and streamed.
+
+For every --minutes, an MP3 tone of that length is transcribed once loaded
+whole and once streamed from the ffmpeg pipe in 30 s windows, each in a
+fresh process. The RSS of the process and its ffmpeg is sampled during the
+transcription, and its growth over the RSS with the model loaded is what the
+transcription took.
+
+    python benchmarks/streaming.py --dims tiny --minutes 5 10 20
+"""
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import DIMS, PeakRSS, import_transcriptor, random_checkpoint
+
+MB = 1024 * 1024
+
+
+def run_child(checkpoint_path, audio_file, stream):
+    with open(checkpoint_path, 'rb') as f:
+        lambda_transcriptor = import_transcriptor(f.read(), warmup='false')
+    gc.collect()
+    # The peak of the import is not the transcription's, RSS is sampled instead
+    sampler = PeakRSS(children=True)
+    model_mb = sampler.rss() / MB
+    sampler.start()
+    start = time.perf_counter()
+    transcription = lambda_transcriptor.get_transcription(
+        audio_file, lambda_transcriptor.MODEL, workers=1, vad=False, stream=stream)
+    seconds = time.perf_counter() - start
+    peak_mb = sampler.stop() / MB
+    print(json.dumps({'seconds': round(seconds, 1),
+                      'segments': len(transcription['segments']),
+                      'model_rss_mb': round(model_mb),
+                      'peak_rss_mb': round(peak_mb),
+                      'transcription_mb': round(peak_mb - model_mb)}))
+
+
+def run(checkpoint_path, audio_file, stream):
+    command = [sys.executable, __file__, '--child', checkpoint_path, audio_file]
+    if stream:
+        command.append('--stream')
+    output = subprocess.run(command, check=True, capture_output=True, text=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--dims', choices=DIMS, default='tiny')
+    parser.add_argument('--minutes', type=float, nargs='+', default=[5, 10, 20])
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    parser.add_argument('--stream', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(*args.child, args.stream)
+
+    report = {}
+    with tempfile.TemporaryDirectory() as folder:
+        checkpoint_path = os.path.join(folder, 'model.pt')
+        with open(checkpoint_path, 'wb') as f:
+            f.write(random_checkpoint(args.dims))
+        for minutes in args.minutes:
+            audio_file = os.path.join(folder, f'{minutes}.mp3')
+            subprocess.run(['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi',
+                            '-i', 'sine=frequency=440:sample_rate=16000',
+                            '-t', str(minutes * 60), '-ac', '1', audio_file],
+                           check=True)
+            report[f'{minutes} min'] = {'whole_file': run(checkpoint_path, audio_file, False),
+                                        'streamed': run(checkpoint_path, audio_file, True)}
+            os.remove(audio_file)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Sweep of torch intra-op and inter-op threads for every Lambda memory tier.
+
+Lambda gives a function one vCPU per 1769 MB of memory, up to 6 at 10240 MB.
+For every tier that fits on this machine, a fresh process is pinned to that
+many CPUs, the way the cgroup quota limits the function, and transcribes
+--seconds of audio with every thread setting. The fastest setting of each tier
+is printed as the 'thread_settings' environment variable of the transcriptor,
+and written to --output.
+
+    python benchmarks/threads.py --dims base --seconds 30
+    python benchmarks/threads.py --cpus 2 4 --threads 1 2 3 4 6 8
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from common import DIMS, import_transcriptor, random_checkpoint
+
+MB_PER_VCPU = 1769
+MAX_MEMORY_MB = 10240
+
+
+def memory_tier(cpus):
+    """Smallest memory, in MB, with cpus vCPUs."""
+    return min(cpus * MB_PER_VCPU, MAX_MEMORY_MB)
+
+
+def run_child(dims, seconds, cpus, threads, interop_threads, repeats):
+    os.sched_setaffinity(0, sorted(os.sched_getaffinity(0))[:cpus])
+    lambda_transcriptor = import_transcriptor(
+        random_checkpoint(dims), warmup='false', cpus=str(cpus),
+        torch_interop_threads=str(interop_threads))
+    import torch
+
+    lambda_transcriptor.configure_threads()
+    samples = int(seconds * lambda_transcriptor.SAMPLE_RATE)
+    audio = np.random.default_rng(0).uniform(-0.3, 0.3, samples).astype(np.float32)
+    results = {}
+    for count in threads:
+        torch.set_num_threads(count)
+        lambda_transcriptor.get_transcription(audio[:lambda_transcriptor.SAMPLE_RATE],
+                                              lambda_transcriptor.MODEL,
+                                              workers=1, vad=False)
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            lambda_transcriptor.get_transcription(audio, lambda_transcriptor.MODEL,
+                                                  workers=1, vad=False)
+            times.append(time.perf_counter() - start)
+        results[count] = round(float(np.median(times)), 3)
+    print(json.dumps(results))
+
+
+def run_tier(args, cpus, interop_threads):
+    # set_num_interop_threads only works once per process
+    threads = args.threads or sorted({1, max(1, cpus // 2), cpus, cpus + 1, 2 * cpus})
+    command = [sys.executable, __file__, '--child', '--dims', args.dims,
+               '--seconds', str(args.seconds), '--repeats', str(args.repeats),
+               '--cpus', str(cpus), '--interop-threads', str(interop_threads),
+               '--threads', *map(str, threads)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True)
+    return {int(count): seconds for count, seconds in
+            json.loads(output.stdout.strip().splitlines()[-1]).items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--dims', choices=DIMS, default='base')
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--cpus', type=int, nargs='+',
+                        help='vCPUs of the tiers, all that fit by default')
+    parser.add_argument('--threads', type=int, nargs='+',
+                        help='intra-op threads to try, around the vCPUs by default')
+    parser.add_argument('--interop-threads', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--output', default='thread_settings.json')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args.dims, args.seconds, args.cpus[0], args.threads,
+                         args.interop_threads[0], args.repeats)
+
+    available = len(os.sched_getaffinity(0))
+    tiers = args.cpus or range(1, min(available, 6) + 1)
+    sweep, settings = {}, {}
+    for cpus in tiers:
+        if cpus > available:
+            print(f'Skipping {cpus} vCPUs, only {available} here', file=sys.stderr)
+            continue
+        tier = memory_tier(cpus)
+        sweep[tier] = {'cpus': cpus}
+        best = None
+        for interop_threads in args.interop_threads:
+            results = run_tier(args, cpus, interop_threads)
+            sweep[tier][f'interop_{interop_threads}'] = results
+            for threads, seconds in results.items():
+                if best is None or seconds < best[0]:
+                    best = (seconds, threads, interop_threads)
+        settings[str(tier)] = {'threads': best[1], 'interop_threads': best[2]}
+
+    with open(args.output, 'w') as f:
+        json.dump(settings, f)
+    print(json.dumps({'audio_seconds': args.seconds, 'sweep_seconds': sweep,
+                      'thread_settings': json.dumps(settings)}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Wall-clock saved by the voice activity detection pass of lambda_transcriptor.
+
+The fixture alternates speech-like bursts (harmonics modulated at syllable
+rate) with dead air and a steady music bed, and is transcribed with and
+without the VAD pass.
+
+    python benchmarks/vad.py                       # random 'tiny' model
+    python benchmarks/vad.py --checkpoint models/small.pt --audio talk.mp3
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from common import DIMS, import_transcriptor, random_checkpoint
+
+
+SAMPLE_RATE = 16000
+
+
+def speech_like(seconds, rng):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    pitch = 120 + 30 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t + rng.uniform(0, 6)), 0, None)
+    return 0.1 * voice * syllables
+
+
+def fixture(minutes, seed=0):
+    """Audio where roughly 40% of the time is speech."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(20 * SAMPLE_RATE) / SAMPLE_RATE
+    music = 0.02 * sum(np.sin(2 * np.pi * f * t) for f in (220, 277, 330))
+    pieces, seconds = [music], 20
+    while seconds < minutes * 60:
+        speech = rng.uniform(5, 20)
+        pause = rng.uniform(3, 25)
+        pieces += [speech_like(speech, rng), np.zeros(int(pause * SAMPLE_RATE))]
+        seconds += speech + pause
+    audio = np.concatenate(pieces)
+    # Background noise all along, like in a real recording
+    return (audio + rng.normal(0, 1e-3, len(audio))).astype(np.float32)
+
+
+def timed_transcription(lambda_transcriptor, audio, vad):
+    start = time.perf_counter()
+    transcription = lambda_transcriptor.get_transcription(
+        audio, lambda_transcriptor.MODEL, workers=1, vad=vad)
+    return time.perf_counter() - start, len(transcription['segments'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--dims', choices=DIMS, default='tiny')
+    parser.add_argument('--checkpoint', help='Use this checkpoint file instead')
+    parser.add_argument('--audio', help='Use this audio file instead')
+    parser.add_argument('--minutes', type=float, default=5)
+    args = parser.parse_args()
+
+    if args.checkpoint:
+        with open(args.checkpoint, 'rb') as f:
+            checkpoint = f.read()
+    else:
+        checkpoint = random_checkpoint(args.dims)
+    lambda_transcriptor = import_transcriptor(checkpoint)
+
+    if args.audio:
+        audio = lambda_transcriptor.load_audio(args.audio)
+    else:
+        audio = fixture(args.minutes)
+    audio_seconds = len(audio) / SAMPLE_RATE
+
+    start = time.perf_counter()
+    regions = lambda_transcriptor.detect_speech(audio)
+    vad_seconds = time.perf_counter() - start
+    speech_seconds = sum(end - start for start, end in regions) / SAMPLE_RATE
+
+    without_vad, segments_without_vad = timed_transcription(
+        lambda_transcriptor, audio, vad=False)
+    with_vad, segments_with_vad = timed_transcription(
+        lambda_transcriptor, audio, vad=True)
+
+    print(json.dumps({
+        'audio_seconds': round(audio_seconds, 1),
+        'speech_seconds': round(speech_seconds, 1),
+        'vad_pass_seconds': round(vad_seconds, 3),
+        'seconds_without_vad': round(without_vad, 2),
+        'seconds_with_vad': round(with_vad, 2),
+        'segments_without_vad': segments_without_vad,
+        'segments_with_vad': segments_with_vad,
+        'saved_seconds_per_audio_hour':
+            round((without_vad - with_vad) * 3600 / audio_seconds, 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""First request latency of lambda_transcriptor with and without init warm up.
+
+Every variant runs in a fresh process: it imports lambda_transcriptor (model
+load, plus the warm up when enabled) and then times two get_transcription calls
+on the same clip. The phases of the warm up are reported as well.
+
+    python benchmarks/warmup.py --dims base --seconds 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from common import DIMS, import_transcriptor, random_checkpoint
+
+
+def run_child(dims, seconds):
+    import numpy as np
+
+    checkpoint = random_checkpoint(dims)
+    start = time.perf_counter()
+    lambda_transcriptor = import_transcriptor(checkpoint)
+    init = time.perf_counter() - start
+
+    samples = int(seconds * lambda_transcriptor.SAMPLE_RATE)
+    audio = np.random.default_rng(0).uniform(-0.3, 0.3, samples).astype(np.float32)
+    requests = []
+    for _ in range(2):
+        start = time.perf_counter()
+        lambda_transcriptor.get_transcription(audio, lambda_transcriptor.MODEL,
+                                              workers=1, vad=False)
+        requests.append(round(time.perf_counter() - start, 3))
+
+    print(json.dumps({'init_seconds': round(init, 3),
+                      'first_request_seconds': requests[0],
+                      'second_request_seconds': requests[1],
+                      'init_timings': lambda_transcriptor.INIT_TIMINGS}))
+
+
+def run_variant(dims, seconds, warmup):
+    env = dict(os.environ, warmup=str(warmup).lower())
+    output = subprocess.run([sys.executable, __file__, '--child',
+                             '--dims', dims, '--seconds', str(seconds)],
+                            env=env, check=True, capture_output=True, text=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--dims', choices=DIMS, default='base')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args.dims, args.seconds)
+
+    results = {'cold': run_variant(args.dims, args.seconds, False),
+               'warm_up': run_variant(args.dims, args.seconds, True)}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
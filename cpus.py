@@ -0,0 +1,163 @@
+"""CPUs available to the function and the thread settings derived from them.
+
+Lambda gives a function a share of the host through a cgroup CPU quota, which
+neither os.cpu_count() nor torch take into account, so torch starts a thread
+per host core and they fight over a couple of vCPUs. available() is the
+smallest of the affinity mask and the quota, unless the 'cpus' environment
+variable sets it.
+
+thread_settings() turns it into intra-op and inter-op threads for torch. The
+OpenMP, MKL and BLAS runtimes read their thread counts once, when torch is
+imported, so configure_environment() has to run before that.
+"""
+import json
+import logging
+import os
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+TASK_DIR = '/proc/self/task'
+# Environment variables read by the threading runtimes when they are loaded
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                    'NUMEXPR_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS')
+
+
+def environ_int(name, default):
+    """Integer environment variable, default if unset or not an integer."""
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        logging.error("Invalid %s=%r, using %d instead", name, os.environ[name], default)
+        return default
+
+
+# CPUs kept for ffmpeg decoding next to the inference, 0 to share them all
+DECODE_CPUS = environ_int('decode_cpus', 0)
+
+
+def quota(root=CGROUP_ROOT):
+    """CPUs of the cgroup quota of this process, None without a quota."""
+    try:
+        # cgroup v2
+        with open(os.path.join(root, 'cpu.max')) as f:
+            limit, period = f.read().split()
+    except OSError:
+        try:
+            # cgroup v1
+            with open(os.path.join(root, 'cpu', 'cpu.cfs_quota_us')) as f:
+                limit = f.read().strip()
+            with open(os.path.join(root, 'cpu', 'cpu.cfs_period_us')) as f:
+                period = f.read().strip()
+        except OSError:
+            return None
+    if limit in ('max', '-1'):
+        return None
+    return int(limit) / int(period)
+
+
+def affinity():
+    """CPUs this process may run on, in order."""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def available():
+    """CPUs the function can keep busy, the affinity mask capped by the quota."""
+    cpus = len(affinity())
+    if 'cpus' in os.environ:
+        return max(1, environ_int('cpus', cpus))
+    cpu_quota = quota()
+    if cpu_quota is not None:
+        cpus = min(cpus, max(1, round(cpu_quota)))
+    return cpus
+
+
+def split(decode_cpus=DECODE_CPUS):
+    """Affinity mask split in (inference CPUs, decoding CPUs).
+
+    The last decode_cpus CPUs are kept for ffmpeg, as long as one is left for
+    the inference. Otherwise both get every CPU.
+    """
+    cpus = affinity()[:available()]
+    if decode_cpus <= 0 or decode_cpus >= len(cpus):
+        return cpus, cpus
+    return cpus[:-decode_cpus], cpus[-decode_cpus:]
+
+
+def memory_mb():
+    return environ_int('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', 0)
+
+
+def tuned_settings(memory=None):
+    """Settings of the largest memory tier of 'thread_settings' that fits.
+
+    'thread_settings' is the JSON written by benchmarks/threads.py, with the
+    memory tiers in MB as keys.
+    """
+    try:
+        tiers = json.loads(os.environ.get('thread_settings', '{}'))
+        memory = memory_mb() if memory is None else memory
+        fitting = [int(tier) for tier in tiers if int(tier) <= memory]
+        return dict(tiers[str(max(fitting))]) if fitting else {}
+    except (TypeError, ValueError, AttributeError) as e:
+        logging.error("Invalid thread_settings, using the CPUs instead, %s", e)
+        return {}
+
+
+def thread_settings(memory=None):
+    """{'threads', 'interop_threads'} for torch, from the tuned tiers or the CPUs.
+
+    Without a tuned tier, torch gets a thread per CPU left by the decoding and
+    a single inter-op thread, since Whisper runs one operator at a time. The
+    'torch_threads' and 'torch_interop_threads' variables override both.
+    """
+    settings = {'threads': len(split()[0]), 'interop_threads': 1}
+    settings.update(tuned_settings(memory))
+    for key, variable in (('threads', 'torch_threads'),
+                          ('interop_threads', 'torch_interop_threads')):
+        settings[key] = environ_int(variable, settings[key])
+    return settings
+
+
+def configure_environment(threads):
+    """Thread counts of the OpenMP, MKL and BLAS runtimes, unless already set."""
+    for variable in THREAD_VARIABLES:
+        os.environ.setdefault(variable, str(threads))
+
+
+def configure_torch(settings):
+    import torch
+
+    torch.set_num_threads(settings['threads'])
+    try:
+        torch.set_num_interop_threads(settings['interop_threads'])
+    except RuntimeError as e:
+        # Only possible before torch runs any inter-op parallel work
+        logging.warning("Inter-op threads not set, %s", str(e))
+
+
+def pin_process(cpus, task_dir=TASK_DIR, pid=0):
+    """Run every thread of a process, this one by default, on cpus only.
+
+    The affinity of a pid is that of its main thread only, so each thread is
+    pinned by its id. Threads started later inherit it from the one starting
+    them.
+    """
+    try:
+        threads = [int(tid) for tid in os.listdir(task_dir)]
+    except OSError:
+        threads = [pid]
+    for tid in threads:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except AttributeError:
+            return
+        except OSError:
+            # The thread has exited
+            continue
+
+
+def pin(cpus, pid):
+    """Run the subprocess pid on cpus only, right after starting it."""
+    pin_process(cpus, os.path.join('/proc', str(pid), 'task'), pid)
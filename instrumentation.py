@@ -0,0 +1,136 @@
+"""Timings and resource usage of a lambda invocation, as one CloudWatch EMF line.
+
+    @instrumentation.instrument('transcriptor')
+    def lambda_handler(event, context):
+        with instrumentation.timer('download'):
+            ...
+        instrumentation.add('bytes_downloaded', size, 'Bytes')
+
+When the handler returns or raises, a single JSON line in the CloudWatch
+Embedded Metric Format is printed to stdout. Every metric has the function
+name as dimension. Outside an instrumented handler, timer and add do nothing,
+so the instrumented functions can still be called on their own. Inside
+paused(), they do nothing either, for work that is not the invocation's.
+"""
+import contextlib
+import functools
+import json
+import os
+import resource
+import threading
+import time
+
+
+NAMESPACE = os.environ.get('metrics_namespace', 'VideoSubtitler')
+
+_current = None
+_invocations = 0
+# Threads inside paused()
+_paused = threading.local()
+
+
+class Invocation:
+    def __init__(self, function):
+        self.function = function
+        self.metrics = {}
+        self.properties = {}
+        self.start = time.perf_counter()
+
+    def add(self, name, value, unit='Count'):
+        if name in self.metrics:
+            self.metrics[name][0] += value
+        else:
+            self.metrics[name] = [value, unit]
+
+    def record(self):
+        self.add('duration', (time.perf_counter() - self.start) * 1000, 'Milliseconds')
+        # ru_maxrss is in KiB on Linux. Children are the ffmpeg processes
+        self.add('peak_rss', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                 'Megabytes')
+        self.add('peak_rss_children',
+                 resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+                 'Megabytes')
+        if self.metrics.get('audio_seconds') and self.metrics.get('inference'):
+            self.add('audio_seconds_per_second',
+                     self.metrics['audio_seconds'][0]
+                     / (self.metrics['inference'][0] / 1000), 'None')
+
+        metrics = {name: round(value, 3) for name, (value, _) in self.metrics.items()}
+        return dict(self.properties, **metrics,
+                    Function=self.function,
+                    _aws={'Timestamp': int(time.time() * 1000),
+                          'CloudWatchMetrics': [{
+                              'Namespace': NAMESPACE,
+                              'Dimensions': [['Function']],
+                              'Metrics': [{'Name': name, 'Unit': unit}
+                                          for name, (_, unit) in self.metrics.items()]}]})
+
+
+def instrument(function):
+    """Decorate a lambda handler to emit the metrics of every invocation."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            global _current, _invocations
+            invocation = _current = Invocation(function)
+            invocation.properties['cold_start'] = _invocations == 0
+            _invocations += 1
+            status = None
+            try:
+                response = handler(event, context)
+                if isinstance(response, dict):
+                    status = response.get('statusCode')
+                return response
+            finally:
+                _current = None
+                invocation.properties['status_code'] = status
+                emit(invocation)
+        return wrapper
+    return decorator
+
+
+def emit(invocation):
+    # Lambda sends stdout to CloudWatch as is, logging would add a prefix
+    print(json.dumps(invocation.record()), flush=True)
+
+
+def cold_start():
+    """Whether this is the first invocation handled by the process."""
+    return _current is not None and _current.properties['cold_start']
+
+
+def add(name, value, unit='Count'):
+    if _current is not None and not getattr(_paused, 'active', False):
+        _current.add(name, value, unit)
+
+
+@contextlib.contextmanager
+def paused():
+    """Metrics added by this thread meanwhile are not the invocation's."""
+    previous = getattr(_paused, 'active', False)
+    _paused.active = True
+    try:
+        yield
+    finally:
+        _paused.active = previous
+
+
+def set_property(name, value):
+    if _current is not None:
+        _current.properties[name] = value
+
+
+@contextlib.contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, (time.perf_counter() - start) * 1000, 'Milliseconds')
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
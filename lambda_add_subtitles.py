@@ -1,15 +1,50 @@
 import json
 import subprocess
-import boto3
 import os
 import logging
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import cpus
+import instrumentation
+import media
+import s3_io
+import subtitles
+import workspace
 
 
-s3 = boto3.client('s3')
+s3 = s3_io.client('s3')
 AWS_BUCKET_NAME = os.environ.get("bucket_name", "cperalesg-video-subtitler")
 tmp_folder = '/tmp'
+# Burn-in splits the video at keyframes in segments of about this length,
+# encoded by this many ffmpeg processes at once
+BURN_WORKERS = int(os.environ.get('burn_workers', 1))
+SEGMENT_SECONDS = float(os.environ.get('segment_seconds', 60))
 
+# libx264 settings of every encoding profile, the body can pick one by name
+ENCODING_PROFILES = {
+    'fast': {'preset': 'veryfast', 'crf': 26},
+    'balanced': {'preset': 'medium', 'crf': 23},
+    'quality': {'preset': 'slow', 'crf': 20},
+}
+ENCODING_PROFILE = os.environ.get('encoding_profile', 'balanced')
+# libvpx-vp9 settings of the same profiles, WebM only takes VP8, VP9 and AV1
+VP9_PROFILES = {
+    'fast': {'cpu_used': 5, 'crf': 36},
+    'balanced': {'cpu_used': 3, 'crf': 32},
+    'quality': {'cpu_used': 1, 'crf': 28},
+}
 
+# Subtitle codec for each container when subtitles are muxed as a track
+SUBTITLE_CODECS = {
+    '.mp4': 'mov_text',
+    '.m4v': 'mov_text',
+    '.mov': 'mov_text',
+    '.mkv': 'srt',
+    '.webm': 'webvtt',
+}
+
+
+@instrumentation.instrument('add_subtitles')
 def lambda_handler(event, context):
     try:
         body = json.loads(event['body'])
@@ -17,21 +52,29 @@ def lambda_handler(event, context):
         body = event['body']
 
     bucket_name = body.get('bucket', AWS_BUCKET_NAME)
-    os.makedirs(tmp_folder, exist_ok=True)
-
-    video_file = download_file(bucket_name, body['video']['key'])
-    srt_file = download_file(bucket_name, body['srt']['key'])
-
-    filename, file_extension = os.path.splitext(video_file)
-    output_file = filename + '_sub' + file_extension
-    output_file = add_subtitles(video_file, srt_file, output_file)
-   
-    final_key = os.path.join('video_sub', output_file)
-    logging.warning("Uploading %s to %s", os.path.join(tmp_folder, output_file),
-                    final_key)
-    response = s3.upload_file(os.path.join(tmp_folder, output_file),
-                              bucket_name,
-                              final_key)
+    # 'burn' renders the subtitles in the frames, 'soft' adds a subtitle track
+    mode = body.get('mode', 'burn')
+    file_extension = os.path.splitext(body['video']['key'])[1].lower()
+    if mode not in ('burn', 'soft'):
+        return {
+            'statusCode': 400,
+            'body': {'message': "Mode should be 'burn' or 'soft'"}
+        }
+    profile = body.get('profile', ENCODING_PROFILE)
+    if profile not in ENCODING_PROFILES:
+        return {
+            'statusCode': 400,
+            'body': {'message': f"Profile should be one of {list(ENCODING_PROFILES)}"}
+        }
+    if mode == 'soft' and file_extension not in SUBTITLE_CODECS:
+        return {
+            'statusCode': 400,
+            'body': {'message': f"Soft subtitles are not supported for {file_extension} videos"}
+        }
+    instrumentation.set_property('mode', mode)
+    with workspace.request_folder('add_subtitles') as folder:
+        final_key = subtitle_video(bucket_name, body['video']['key'],
+                                   body['srt']['key'], folder, mode, profile)
 
     params = {
             "Bucket": bucket_name,
@@ -48,21 +91,252 @@ def lambda_handler(event, context):
     }
 
 
-def download_file(bucket, key):
+def subtitle_video(bucket_name, video_key, srt_key, folder, mode, profile):
+    """Subtitle the video in folder and upload it, returns its key."""
+    with instrumentation.timer('download'):
+        video_file = os.path.join(folder, download_file(bucket_name, video_key, folder))
+        srt_file = os.path.join(folder, download_file(bucket_name, srt_key, folder))
+    instrumentation.add('bytes_downloaded', sum(
+        instrumentation.file_size(f) for f in (video_file, srt_file)), 'Bytes')
+
+    filename, file_extension = os.path.splitext(video_file)
+    output_file = filename + '_sub' + file_extension
+    with instrumentation.timer('ffmpeg'):
+        if mode == 'soft':
+            output_file = mux_subtitles(video_file, srt_file, output_file)
+        elif BURN_WORKERS > 1:
+            output_file = add_subtitles_parallel(video_file, srt_file, output_file,
+                                                 profile=profile)
+        else:
+            output_file = add_subtitles(video_file, srt_file, output_file, profile)
+    output_file = os.path.join(folder, output_file)
+
+    final_key = os.path.join('video_sub', os.path.basename(output_file))
+    logging.warning("Uploading %s to %s", output_file, final_key)
+    with instrumentation.timer('upload'):
+        s3.upload_file(output_file,
+                       bucket_name,
+                       final_key,
+                       Config=s3_io.TRANSFER_CONFIG)
+    instrumentation.add('bytes_uploaded', instrumentation.file_size(output_file), 'Bytes')
+    return final_key
+
+
+def download_file(bucket, key, folder=tmp_folder):
     filename = key.split('/')[-1]
-    logging.warning("Downloading %s", os.path.join(tmp_folder, filename))
-    s3.download_file(bucket, key, os.path.join(tmp_folder, filename))
+    logging.warning("Downloading %s", os.path.join(folder, filename))
+    workspace.download(s3, bucket, key, os.path.join(folder, filename))
     return filename
 
 
-def add_subtitles(video_file, subtitle_file, output_file):
+def add_subtitles(video_file, subtitle_file, output_file, profile=ENCODING_PROFILE):
+    video_path = os.path.join(tmp_folder, video_file)
     command = [
         "ffmpeg",
         "-y",                                                           # Overwrite if the file exists 
-        "-i", os.path.join(tmp_folder, video_file),                     # Input video
+        "-i", video_path,                                               # Input video
         "-vf", f"subtitles={os.path.join(tmp_folder, subtitle_file)}",  # Add subtitles filter
+        *encoder_args(profile, probe_video(video_path), cpu_count(),    # Video encoding settings
+                      os.path.splitext(output_file)[1]),
+        "-c:a", "copy",                                                 # Audio is copied untouched
+        os.path.join(tmp_folder, output_file)                           # Output video with subtitles
+    ]
+    logging.warning("Running %s", ' '.join(command))
+    subprocess.run(command, check=True)
+    return output_file
+
+
+def cpu_count():
+    # CPUs this process may keep busy, which can be less than the host has
+    return cpus.available()
+
+
+def probe_video(video_path):
+    """Bitrate and size of the first video stream, empty if unknown."""
+    info = media.probe(video_path)
+    streams = info.get('streams', [])
+    video = next(iter(media.streams(info, 'video')), None)
+    if video is None:
+        return {}
+    bitrate = video.get('bit_rate')
+    if bitrate is None and 'bit_rate' in info.get('format', {}):
+        # Containers like MKV only have the overall bitrate
+        bitrate = int(info['format']['bit_rate']) - sum(
+            int(s.get('bit_rate', 0)) for s in streams if s is not video)
+    return {'width': video.get('width'),
+            'height': video.get('height'),
+            'bitrate': int(bitrate) if bitrate else None}
+
+
+def encoder_args(profile, video_info, threads, extension='.mp4'):
+    if extension.lower() == '.webm':
+        return vp9_encoder_args(profile, video_info, threads)
+    settings = ENCODING_PROFILES[profile]
+    args = ["-c:v", "libx264",
+            "-preset", settings['preset'],
+            "-crf", str(settings['crf']),
+            "-threads", str(threads)]
+    if video_info.get('bitrate'):
+        # The burned video should not be heavier than the source
+        args += ["-maxrate", str(video_info['bitrate']),
+                 "-bufsize", str(2 * video_info['bitrate'])]
+    return args
+
+
+def vp9_encoder_args(profile, video_info, threads):
+    settings = VP9_PROFILES[profile]
+    # Constant quality, capped at the source bitrate when it is known
+    return ["-c:v", "libvpx-vp9",
+            "-deadline", "good",
+            "-cpu-used", str(settings['cpu_used']),
+            "-crf", str(settings['crf']),
+            "-b:v", str(video_info.get('bitrate') or 0),
+            "-row-mt", "1",
+            "-threads", str(threads)]
+
+
+def mux_subtitles(video_file, subtitle_file, output_file):
+    # Streams are copied, so the video is not decoded nor encoded again
+    codec = SUBTITLE_CODECS[os.path.splitext(output_file)[1].lower()]
+    command = [
+        "ffmpeg",
+        "-y",                                                           # Overwrite if the file exists
+        "-i", os.path.join(tmp_folder, video_file),                     # Input video
+        "-i", os.path.join(tmp_folder, subtitle_file),                  # Input subtitles
+        "-map", "0:v", "-map", "0:a?", "-map", "1:s",                   # Video, audio if any and subtitles
+        "-c", "copy",                                                   # Copy video and audio as they are
+        "-c:s", codec,                                                  # Subtitle codec of the container
         os.path.join(tmp_folder, output_file)                           # Output video with subtitles
     ]
     logging.warning("Running %s", ' '.join(command))
     subprocess.run(command, check=True)
     return output_file
+
+
+def parse_srt(subtitle_file):
+    """List of (start, end, text) cues of an SRT file, times in seconds."""
+    with open(subtitle_file, encoding='utf-8-sig') as f:
+        blocks = f.read().replace('\r\n', '\n').strip().split('\n\n')
+    cues = []
+    for block in blocks:
+        lines = block.strip().split('\n')
+        if len(lines) < 2 or '-->' not in lines[1]:
+            continue
+        start, end = (srt_time_to_seconds(t) for t in lines[1].split('-->'))
+        cues.append((start, end, '\n'.join(lines[2:])))
+    return cues
+
+
+def srt_time_to_seconds(timestamp):
+    hours, minutes, seconds = timestamp.strip().replace(',', '.').split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def write_srt(cues, subtitle_file):
+    segments = [{'start': start, 'end': end, 'text': text}
+                for start, end, text in cues]
+    with open(subtitle_file, 'w', encoding='utf-8') as f:
+        f.write(subtitles.serialize(segments))
+    return subtitle_file
+
+
+def slice_cues(cues, start, end):
+    """Cues shown between start and end, shifted to start at zero."""
+    return [(max(cue_start, start) - start, min(cue_end, end) - start, text)
+            for cue_start, cue_end, text in cues
+            if cue_start < end and cue_end > start]
+
+
+def split_video(video_path, segments_folder, segment_seconds=SEGMENT_SECONDS):
+    """Split the video stream at keyframes, without encoding.
+
+    Returns a list of (segment path, start, end), times in seconds.
+    """
+    extension = os.path.splitext(video_path)[1]
+    segment_list = os.path.join(segments_folder, 'segments.csv')
+    command = [
+        "ffmpeg",
+        "-y",
+        "-i", video_path,
+        "-map", "0:v:0",                                                # Only video, audio is copied at the end
+        "-c", "copy",
+        "-f", "segment",
+        "-segment_time", str(segment_seconds),                          # Cut at the next keyframe after this
+        "-reset_timestamps", "1",
+        "-segment_list", segment_list,
+        "-segment_list_type", "csv",
+        os.path.join(segments_folder, f"segment_%04d{extension}")
+    ]
+    logging.warning("Running %s", ' '.join(command))
+    subprocess.run(command, check=True)
+
+    segments = []
+    with open(segment_list) as f:
+        for line in f:
+            name, start, end = line.strip().rsplit(',', 2)
+            segments.append((os.path.join(segments_folder, name),
+                             float(start), float(end)))
+    return segments
+
+
+def burn_segment(segment_path, subtitle_file, output_path, video_args=()):
+    command = ["ffmpeg", "-y", "-i", segment_path]
+    if subtitle_file is not None:
+        command += ["-vf", f"subtitles={subtitle_file}"]
+    command += [*video_args, "-an", output_path]
+    subprocess.run(command, check=True)
+    return output_path
+
+
+def add_subtitles_parallel(video_file, subtitle_file, output_file,
+                           workers=None, segment_seconds=None,
+                           profile=ENCODING_PROFILE):
+    """Burn subtitles encoding keyframe aligned segments in parallel."""
+    workers = workers or BURN_WORKERS
+    segment_seconds = segment_seconds or SEGMENT_SECONDS
+    video_path = os.path.join(tmp_folder, video_file)
+    # Workers share the CPUs, audio is copied from the source when joining
+    video_args = encoder_args(profile, probe_video(video_path),
+                              max(1, cpu_count() // workers),
+                              os.path.splitext(video_file)[1])
+    segments_folder = os.path.join(tmp_folder,
+                                   os.path.splitext(output_file)[0] + '_segments')
+    shutil.rmtree(segments_folder, ignore_errors=True)
+    os.makedirs(segments_folder)
+
+    try:
+        segments = split_video(video_path, segments_folder, segment_seconds)
+        cues = parse_srt(os.path.join(tmp_folder, subtitle_file))
+        jobs = []
+        for idx, (segment_path, start, end) in enumerate(segments):
+            segment_cues = slice_cues(cues, start, end)
+            segment_srt = None
+            if segment_cues:
+                segment_srt = write_srt(segment_cues, os.path.join(
+                    segments_folder, f"segment_{idx:04}.srt"))
+            jobs.append((segment_path, segment_srt, os.path.join(
+                segments_folder, f"burned_{idx:04}{os.path.splitext(video_file)[1]}"),
+                video_args))
+
+        logging.warning("Burning %d segments with %d workers", len(jobs), workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            burned = list(executor.map(lambda job: burn_segment(*job), jobs))
+
+        concat_list = os.path.join(segments_folder, 'concat.txt')
+        with open(concat_list, 'w') as f:
+            f.writelines(f"file '{path}'\n" for path in burned)
+        command = [
+            "ffmpeg",
+            "-y",
+            "-f", "concat", "-safe", "0", "-i", concat_list,            # Burned video segments
+            "-i", video_path,                                           # Original audio
+            "-map", "0:v", "-map", "1:a?",
+            "-c", "copy",
+            os.path.join(tmp_folder, output_file)
+        ]
+        logging.warning("Running %s", ' '.join(command))
+        subprocess.run(command, check=True)
+    finally:
+        shutil.rmtree(segments_folder, ignore_errors=True)
+
+    return output_file
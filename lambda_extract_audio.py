@@ -1,18 +1,37 @@
 import json
 import subprocess
-import boto3
 import os
 import logging
-import shutil
+from botocore.exceptions import BotoCoreError, ClientError
+import instrumentation
+import media
+import s3_io
+import workspace
 
 
-s3 = boto3.client('s3')
+s3 = s3_io.client('s3')
 AWS_BUCKET_NAME = os.environ.get("bucket_name", "cperalesg-video-subtitler")
 
+# ffmpeg output options for each audio format. 'pcm' is raw 16 kHz mono
+# s16le, which the transcriptor reads with no decoding nor resampling
+AUDIO_FORMATS = {
+    'mp3': ['-q:a', '0', '-map', 'a', '-f', 'mp3'],
+    'pcm': ['-map', 'a', '-ac', '1', '-ar', '16000',
+            '-acodec', 'pcm_s16le', '-f', 's16le'],
+}
+
+# Read the video over HTTP and upload the audio from ffmpeg's stdout, so the
+# video never touches the disk. It can also be requested in the body
+STREAM = os.environ.get('stream', 'false').lower() in ('1', 'true')
+# Probe the video with ffprobe before extracting its audio. Videos without
+# audio or longer than MAX_DURATION_SECONDS are rejected without a download
+PREFLIGHT = os.environ.get('preflight', 'true').lower() in ('1', 'true')
+MAX_DURATION_SECONDS = float(os.environ.get('max_duration_seconds', 4 * 3600))
+
 tmp_folder = '/tmp/'
-shutil.rmtree(tmp_folder, ignore_errors=True)
 
 
+@instrumentation.instrument('extract_audio')
 def lambda_handler(event, context):
     logging.warning("Event: %s", event)
     try:
@@ -23,32 +42,156 @@ def lambda_handler(event, context):
     
     bucket_name = body.get('bucket', AWS_BUCKET_NAME)
     uid = body.get('uid', '')
+    audio_format = body.get('format', 'mp3')
+    if audio_format not in AUDIO_FORMATS:
+        return {
+            'statusCode': 400,
+            'body': {'message': f"Audio format should be one of {list(AUDIO_FORMATS)}"}
+        }
     
-    video_file = download_video(bucket_name, body['key'])
+    metadata = {}
+    if PREFLIGHT:
+        with instrumentation.timer('preflight'):
+            metadata = preflight(bucket_name, body['key'])
+        error = preflight_error(metadata)
+        if error is not None:
+            logging.warning("Video %s rejected: %s", body['key'], error)
+            return {
+                'statusCode': 400,
+                'body': {'message': error, 'metadata': metadata}
+            }
+
+    if body.get('stream', STREAM):
+        video_file = body['key'].split('/')[-1]
+        audio_file = video_file.split('.')[0] + '.' + audio_format
+        final_key = os.path.join('audio', uid, audio_file)
+        # ffmpeg, download and upload overlap, they are timed together
+        with instrumentation.timer('stream'):
+            stream_audio(bucket_name, body['key'], final_key, audio_format)
+    else:
+        # Both files are removed with the folder when the request ends
+        with workspace.request_folder('extract_audio') as folder:
+            with instrumentation.timer('download'):
+                video_file = download_video(bucket_name, body['key'], folder)
+            instrumentation.add('bytes_downloaded', instrumentation.file_size(
+                os.path.join(folder, video_file)), 'Bytes')
 
-    audio_file = video_file.split('.')[0] + '.mp3'
-    extract_audio(os.path.join(tmp_folder, video_file),
-                  os.path.join(tmp_folder, audio_file))
-   
-    final_key = os.path.join('audio', uid, audio_file)
-    s3.upload_file(os.path.join(tmp_folder, audio_file),
-                   bucket_name,
-                   final_key)
+            audio_file = video_file.split('.')[0] + '.' + audio_format
+            with instrumentation.timer('ffmpeg'):
+                extract_audio(os.path.join(folder, video_file),
+                              os.path.join(folder, audio_file))
+
+            final_key = os.path.join('audio', uid, audio_file)
+            with instrumentation.timer('upload'):
+                s3.upload_file(os.path.join(folder, audio_file),
+                               bucket_name,
+                               final_key,
+                               Config=s3_io.TRANSFER_CONFIG)
+            instrumentation.add('bytes_uploaded', instrumentation.file_size(
+                os.path.join(folder, audio_file)), 'Bytes')
+    instrumentation.set_property('format', audio_format)
+    if metadata:
+        write_metadata(bucket_name, final_key, metadata)
 
     return {
         'statusCode': 200,
         'body': {'key': final_key,
-                 'bucket': bucket_name}
+                 'bucket': bucket_name,
+                 'metadata': metadata}
     }
 
 
-def download_video(bucket, key):
-    os.makedirs(tmp_folder, exist_ok=True)
+def probe_media(source):
+    """Duration, container, codecs and audio streams of a video, empty if unknown."""
+    info = media.probe(source)
+    if not info:
+        return {}
+
+    container = info.get('format', {})
+    video = media.streams(info, 'video')
+    audio = media.streams(info, 'audio')
+    duration = container.get('duration')
+    return {'duration': float(duration) if duration else None,
+            'size': int(container['size']) if 'size' in container else None,
+            'format': container.get('format_name'),
+            'video_codec': video[0].get('codec_name') if video else None,
+            'audio_codec': audio[0].get('codec_name') if audio else None,
+            'audio_streams': len(audio),
+            'has_audio': bool(audio)}
+
+
+def preflight(bucket, key):
+    # ffprobe only reads the headers it needs, with ranged GETs
+    try:
+        url = s3.generate_presigned_url('get_object',
+                                        Params={'Bucket': bucket, 'Key': key},
+                                        ExpiresIn=3600)
+    except BotoCoreError as e:
+        logging.warning("Video %s could not be probed: %s", key, e)
+        return {}
+    return probe_media(url)
+
+
+def preflight_error(metadata):
+    if not metadata:
+        # Not probed, the extraction itself will tell
+        return None
+    if not metadata['has_audio']:
+        return "The video has no audio stream"
+    if metadata['duration'] and metadata['duration'] > MAX_DURATION_SECONDS:
+        return (f"The video lasts {metadata['duration']:.0f} s, "
+                f"the limit is {MAX_DURATION_SECONDS:.0f} s")
+    return None
+
+
+def metadata_key(audio_key):
+    # Read by the transcriptor to choose its model
+    return os.path.splitext(audio_key)[0] + '.json'
+
+
+def write_metadata(bucket, audio_key, metadata):
+    try:
+        s3.put_object(Bucket=bucket, Key=metadata_key(audio_key),
+                      Body=json.dumps(metadata).encode(),
+                      ContentType='application/json')
+    except (BotoCoreError, ClientError) as e:
+        logging.warning("Metadata of %s not written: %s", audio_key, e)
+
+
+def download_video(bucket, key, folder=tmp_folder):
+    os.makedirs(folder, exist_ok=True)
     video_file = key.split('/')[-1]
-    s3.download_file(bucket, key, os.path.join(tmp_folder, video_file))
+    workspace.download(s3, bucket, key, os.path.join(folder, video_file))
     return video_file
 
 
 def extract_audio(video_file, audio_file):
-    subprocess.run(['ffmpeg', '-i', video_file, '-q:a', '0', '-map', 'a', '-y', audio_file],
+    audio_format = os.path.splitext(audio_file)[1][1:]
+    subprocess.run(['ffmpeg', '-i', video_file, *AUDIO_FORMATS[audio_format], '-y', audio_file],
                    check=True)
+
+
+def stream_audio(bucket, key, audio_key, audio_format='mp3'):
+    # ffmpeg reads the video with ranged GETs through a presigned URL, while
+    # its output is sent to S3 as a multipart upload
+    url = s3.generate_presigned_url('get_object',
+                                    Params={'Bucket': bucket, 'Key': key},
+                                    ExpiresIn=3600)
+    command = ['ffmpeg', '-reconnect', '1', '-i', url,
+               *AUDIO_FORMATS[audio_format], 'pipe:1']
+    logging.warning("Streaming audio of %s to %s", key, audio_key)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    try:
+        s3.upload_fileobj(process.stdout, bucket, audio_key,
+                          Config=s3_io.TRANSFER_CONFIG)
+    except Exception:
+        process.kill()
+        raise
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+
+    if returncode != 0:
+        # The upload finished with whatever ffmpeg wrote before failing
+        s3.delete_object(Bucket=bucket, Key=audio_key)
+        raise subprocess.CalledProcessError(returncode, command[:3])
@@ -1,17 +1,29 @@
+import email.utils
 import json
+import time
 import subprocess
-import boto3
 import os
 from botocore.exceptions import ClientError
 import logging
+from concurrent.futures import ThreadPoolExecutor
+import instrumentation
+import s3_io
 
 
-s3 = boto3.client('s3')
+s3 = s3_io.client('s3')
 AWS_BUCKET_NAME = os.environ.get("bucket_name", "cperalesg-video-subtitler")
 tmp_folder = '/tmp/'
+# Written by the transcriptor, one JSON manifest per IID
+STATUS_PREFIX = 'processed/status/'
+# Largest number of IIDs accepted in a single poll
+MAX_POLL_IIDS = int(os.environ.get('max_poll_iids', 100))
+# A job whose manifest is not done nor updated for this long was killed, by the
+# transcriptor's timeout or memory limit. Set it to that Lambda timeout
+JOB_TIMEOUT_SECONDS = float(os.environ.get('job_timeout_seconds', 900))
 
 
 def check_file_exists(bucket_name: str, file_key: str) -> bool:
+    instrumentation.add('s3_requests', 1)
     try:
         s3.head_object(Bucket=bucket_name, Key=file_key)
         return True
@@ -24,8 +36,57 @@ def check_file_exists(bucket_name: str, file_key: str) -> bool:
             raise e
 
 
+def get_status(bucket_name: str, iid: str, etag: str = None):
+    """Read the status manifest of iid with a single (conditional) GET.
+
+    Returns (status, etag, modified). status is None when there is no
+    manifest, and 'not modified' when it still matches etag. modified is
+    the epoch of its last write, None if unknown.
+    """
+    params = {"Bucket": bucket_name, "Key": f"{STATUS_PREFIX}{iid}.json"}
+    if etag:
+        params["IfNoneMatch"] = etag
+    instrumentation.add('s3_requests', 1)
+    try:
+        response = s3.get_object(**params)
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code in ('304', 'NotModified'):
+            headers = e.response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+            modified = headers.get('last-modified')
+            if modified is not None:
+                modified = email.utils.parsedate_to_datetime(modified).timestamp()
+            return 'not modified', etag, modified
+        if code in ('404', 'NoSuchKey'):
+            return None, None, None
+        raise e
+    return (json.loads(response['Body'].read()), response['ETag'],
+            response['LastModified'].timestamp())
+
+
+def write_status(bucket_name: str, iid: str, state: str, **fields):
+    status = dict(fields, IID=iid, state=state, updated=time.time())
+    s3.put_object(Bucket=bucket_name,
+                  Key=f"{STATUS_PREFIX}{iid}.json",
+                  Body=json.dumps(status).encode(),
+                  ContentType='application/json',
+                  CacheControl='no-cache')
+
+
 def start(event):
-    client = boto3.client('lambda')
+    try:
+        body = json.loads(event['body'])
+    except:
+        body = event.get('body') or {}
+    if 'IID' in body:
+        # Pollers get an answer before the transcriptor has even started
+        try:
+            write_status(body.get('bucket', AWS_BUCKET_NAME), body['IID'],
+                         'queued', progress=0.0, queued=time.time())
+        except Exception as e:
+            logging.error("Status of IID %s not written, %s", body['IID'], str(e))
+
+    client = s3_io.client('lambda')
     client.invoke(
         FunctionName='transcriptor-lambda',
         InvocationType='Event',  # Asynchronous invocation
@@ -44,7 +105,95 @@ def poll(event):
         body = event['body']
 
     bucket_name = body.get('bucket', AWS_BUCKET_NAME)
-    iid = body['IID']
+    if 'IIDs' in body:
+        return poll_many(bucket_name, body['IIDs'], body.get('etags', {}))
+    if not valid_etag(body.get('etag')):
+        return {"statusCode": 400,
+                "body": {"message": "'etag' should be the etag of the last answer"}}
+    return poll_iid(bucket_name, body['IID'], body.get('etag'))
+
+
+def valid_etag(etag) -> bool:
+    # Anything else fails the validation of IfNoneMatch in botocore
+    return etag is None or isinstance(etag, str)
+
+
+def poll_many(bucket_name: str, iids: list, etags: dict):
+    if (not isinstance(iids, list) or len(iids) > MAX_POLL_IIDS or
+            not all(isinstance(iid, str) for iid in iids)):
+        return {"statusCode": 400,
+                "body": {"message": f"'IIDs' should be a list of at most "
+                                    f"{MAX_POLL_IIDS} IIDs"}}
+    if not isinstance(etags, dict) or not all(map(valid_etag, etags.values())):
+        return {"statusCode": 400,
+                "body": {"message": "'etags' should map IIDs to their etag"}}
+    instrumentation.add('iids', len(iids))
+    with ThreadPoolExecutor(max_workers=max(1, min(len(iids), 16))) as executor:
+        responses = executor.map(
+            lambda iid: poll_iid(bucket_name, iid, etags.get(iid)), iids)
+        results = dict(zip(iids, responses))
+    return {"statusCode": 200,
+            "body": {"results": results}}
+
+
+def poll_iid(bucket_name: str, iid: str, etag: str = None):
+    status, etag, modified = get_status(bucket_name, iid, etag)
+    if status is None:
+        # Jobs started before the status manifest existed
+        return poll_outputs(bucket_name, iid)
+    state = status['state'] if isinstance(status, dict) else None
+    if state not in ('done', 'error') and job_failed(bucket_name, iid, state, modified):
+        logging.warning("IID %s stopped without finishing", iid)
+        return {"statusCode": 500,
+                "body": {"message": "Error in the Transcriptor",
+                         "status": status if isinstance(status, dict) else None,
+                         "etag": etag}}
+    if status == 'not modified':
+        return {"statusCode": 304,
+                "body": {"message": "Not modified", "etag": etag}}
+
+    if status['state'] == 'done':
+        logging.warning("SRT with IID %s file exists", iid)
+        body = {name: with_url(status[name]) for name in ('text', 'subtitles')}
+        return {"statusCode": 200,
+                "body": dict(body, status=status, etag=etag)}
+    elif status['state'] == 'error':
+        logging.warning("IID %s results in an error", iid)
+        return {"statusCode": 500,
+                "body": {"message": "Error in the Transcriptor",
+                         "status": status, "etag": etag}}
+    else:
+        logging.warning("Still waiting for IID %s", iid)
+        body = {"message": "Still waiting...", "status": status, "etag": etag}
+        if 'partial' in status:
+            # Subtitles decoded so far, to preview before the job finishes
+            body['partial'] = with_url(status['partial'])
+        return {"statusCode": 202,
+                "body": body}
+
+
+def job_failed(bucket_name: str, iid: str, state: str = None,
+               modified: float = None) -> bool:
+    """Whether an unfinished job died without writing 'error' to its manifest.
+
+    That is, when its manifest was last written more than JOB_TIMEOUT_SECONDS
+    ago, or when a queued job has the error file of a failed invocation. state
+    is None for a manifest not modified since the last poll.
+    """
+    if modified is not None and time.time() - modified > JOB_TIMEOUT_SECONDS:
+        return True
+    # A running job writes its own errors, the extra request is only for queued
+    return state == 'queued' and check_file_exists(
+        bucket_name=bucket_name, file_key=f"processed/error/{iid}.error")
+
+
+def with_url(location: dict) -> dict:
+    params = {"Bucket": location['bucket'], "Key": location['key']}
+    return dict(location, url=s3.generate_presigned_url("get_object",
+                                                        Params=params))
+
+
+def poll_outputs(bucket_name: str, iid: str):
     s3_output_key_srt = f"processed/srt/{iid}.srt"
     check = check_file_exists(bucket_name=bucket_name,
                               file_key=s3_output_key_srt)
@@ -91,9 +240,11 @@ def poll(event):
             }
 
 
+@instrumentation.instrument('get_subtitles')
 def lambda_handler(event, context):
     path = event.get('rawPath', '')
     logging.warning("Event: %s", event)
+    instrumentation.set_property('path', path)
     
     if path == '/start':
         return start(event)
@@ -1,33 +1,130 @@
 import time
 import os
 import logging
-import whisper
-from whisper.model import ModelDimensions, Whisper
 import boto3
 import io
 import pickle
-import torch
 import gc
-import psutil
 import json
-import shutil
+import hashlib
+import contextlib
+import math
+import re
+from botocore.exceptions import ClientError
+import uuid
+import multiprocessing
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cpus
+import instrumentation
+import media
+import s3_io
+import subtitles
+import workspace
+
+
+def setting(name, default, parse=float):
+    """Environment variable name parsed, or default if it is unset or invalid.
+
+    A typo in the configuration is logged instead of failing the import, which
+    would fail every invocation of the container.
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        return parse(value)
+    except (TypeError, ValueError) as e:
+        logging.error("Invalid %s=%r, using %r instead, %s", name, value, default, e)
+        return default
 
 
 MODEL_NAME = os.environ.get('model', 'medium.pt')
 logging.warning('Model %s selected', MODEL_NAME)
+# Local folder (or EFS mount) where checkpoints are cached. Empty to disable
+MODEL_CACHE_DIR = os.environ.get('model_cache_dir',
+                                 os.path.join(workspace.CACHE_DIR, 'models'))
+# 'fp32' or 'int8', which quantizes the Linear layers for CPU inference
+MODEL_FORMAT = os.environ.get('model_format', 'fp32')
+# Long audio is split in windows transcribed by this many processes
+TRANSCRIBE_WORKERS = setting('transcribe_workers', 1, int)
+CHUNK_SECONDS = setting('chunk_seconds', 600.0)
+CHUNK_OVERLAP_SECONDS = setting('chunk_overlap_seconds', 5.0)
+# Energy based voice activity detection, to skip silence before transcribing
+VAD = os.environ.get('vad', 'false').lower() in ('1', 'true')
+VAD_THRESHOLD_DB = setting('vad_threshold_db', 15.0)
+# Publish a partial SRT and the progress while transcribing 30 s windows
+PARTIAL_RESULTS = os.environ.get('partial_results', 'false').lower() in ('1', 'true')
+STREAM_WINDOW_SECONDS = setting('stream_window_seconds', 30.0)
+# Decode audio files from an ffmpeg pipe in those windows, instead of loading
+# them whole, so memory does not grow with the length of the audio
+STREAM_AUDIO = os.environ.get('stream_audio', 'false').lower() in ('1', 'true')
+# A partial SRT is uploaded at most every PARTIAL_FLUSH_SECONDS, and only
+# when it grew by PARTIAL_FLUSH_BYTES since the last upload
+PARTIAL_FLUSH_SECONDS = setting('partial_flush_seconds', 15.0)
+PARTIAL_FLUSH_BYTES = setting('partial_flush_bytes', 2048, int)
+# When the model is loaded: 'init' while the module is imported, 'background'
+# in a thread started at import, so requests that do not need it answer at
+# once and a job downloads its audio meanwhile, or 'lazy' on the first job
+MODEL_PRELOAD = os.environ.get('model_preload', 'background')
+# Run synthetic audio through the model once loaded, so the first job is warm
+WARMUP = os.environ.get('warmup', 'true').lower() in ('1', 'true')
+WARMUP_SECONDS = setting('warmup_seconds', 2.0)
+# torch threads sized to the CPUs of the function, see cpus.py. With
+# decode_cpus, ffmpeg decodes on CPUs of its own and the inference on the rest
+INFERENCE_CPUS, DECODE_CPUS = cpus.split()
+THREADS = cpus.thread_settings()
+cpus.configure_environment(THREADS['threads'])
+if DECODE_CPUS != INFERENCE_CPUS:
+    # The whole process, so the OpenMP threads of the inference inherit it
+    cpus.pin_process(INFERENCE_CPUS)
+# Clips of up to 30 s sent together in 'jobs' are decoded in batches this big
+BATCH_SIZE = setting('batch_size', 8, int)
+# Reuse the outputs of identical audio transcribed with the same options
+RESULT_CACHE = os.environ.get('result_cache', 'true').lower() in ('1', 'true')
+# Models a job can be routed to from its duration, e.g. 'medium.pt,base.pt,tiny.pt'.
+# The most accurate one that transcribes it in TARGET_LATENCY_SECONDS with at
+# most TRANSCRIBE_WORKERS is used. Empty to always use MODEL_NAME
+ROUTE_MODELS = [m for m in os.environ.get('route_models', '').split(',') if m]
+TARGET_LATENCY_SECONDS = setting('target_latency_seconds', 300.0)
+# Audio seconds one worker transcribes per second with each model size,
+# measure them for the function memory with benchmarks/routing.py
+MODEL_SPEEDS = dict({'tiny': 16.0, 'base': 8.0, 'small': 3.0, 'medium': 1.0,
+                     'large': 0.5},
+                    **setting('model_speeds', {},
+                              lambda value: dict(json.loads(value))))
+
+DECODE_OPTIONS = {
+    # 'language': 'es',
+    'temperature': 0.0,
+    'fp16': False,
+    'word_timestamps': False,
+}
+# whisper.audio.SAMPLE_RATE and N_SAMPLES, without importing torch
+SAMPLE_RATE = 16000
+N_SAMPLES = 30 * SAMPLE_RATE
+# One JSON manifest per job with its state, progress, output keys and timing
+STATUS_PREFIX = 'processed/status/'
 
 
 # AWS S3 Configuration
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 AWS_BUCKET_NAME = os.getenv("AWS_BUCKET_NAME", "cperalesg-video-subtitler")
-s3_client = boto3.client("s3", region_name=AWS_REGION)
+s3_client = s3_io.client("s3", region_name=AWS_REGION)
 
 
 def memory_usage():
+    import psutil
     return psutil.Process().memory_info().rss / (1024 * 1024)  # Convert bytes to MB
 
 
 def load_model_bytes(checkpoint_file):
+    import torch
+    from whisper.model import ModelDimensions, Whisper
+
     with io.BytesIO(checkpoint_file) as fp:
         checkpoint = torch.load(fp, map_location='cpu')
     
@@ -42,6 +139,120 @@ def load_model_pickle(pickle_file):
     return pickle.load(pickle_file)
 
 
+def load_model_file(model_path):
+    import torch
+    # Tensors are backed by the page cache instead of being copied in memory.
+    # The file is a whole pickled model written by prepare_model_file
+    return torch.load(model_path, map_location='cpu', mmap=True,
+                      weights_only=False)
+
+
+def quantize_model(model):
+    import torch
+    import whisper
+    # Whisper subclasses nn.Linear only to cast the weights to the input
+    # dtype, a no-op in fp32, but quantize_dynamic just swaps exact nn.Linear
+    for module in model.modules():
+        if isinstance(module, whisper.model.Linear):
+            module.__class__ = torch.nn.Linear
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear},
+                                                  dtype=torch.qint8)
+
+
+def prepare_model_file(downloaded_file, model_path, model_format=MODEL_FORMAT):
+    # Official checkpoints are stored in fp16, but the model runs in fp32 on
+    # CPU. Converting once here lets every later load map the file directly
+    import torch
+    from whisper.model import ModelDimensions, Whisper
+
+    try:
+        checkpoint = torch.load(downloaded_file, map_location='cpu', mmap=True)
+    except RuntimeError:
+        # Checkpoints in the legacy (non-zip) format cannot be mapped
+        checkpoint = torch.load(downloaded_file, map_location='cpu')
+
+    dims = ModelDimensions(**checkpoint["dims"])
+    model = Whisper(dims)
+    model.load_state_dict(checkpoint["model_state_dict"])
+    del checkpoint
+    if model_format == 'int8':
+        model = quantize_model(model)
+
+    partial_path = f"{model_path}.{uuid.uuid4().hex}.part"
+    try:
+        torch.save(model, partial_path)
+        os.replace(partial_path, model_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return model_path
+
+
+def get_cached_model_path(s3, s3_bucket, file_name, cache_dir=MODEL_CACHE_DIR,
+                          model_format=MODEL_FORMAT):
+    import whisper
+
+    head = s3.head_object(Bucket=s3_bucket, Key=file_name)
+    etag = head['ETag'].strip('"')
+    size = head['ContentLength']
+
+    # The ETag versions the file, so a new upload never reuses a stale copy
+    stem, extension = os.path.splitext(os.path.basename(file_name))
+    suffix = '' if model_format == 'fp32' else f".{model_format}"
+    model_path = os.path.join(cache_dir, f"{stem}-{etag}{suffix}{extension}")
+    info_path = model_path + '.json'
+    try:
+        with open(info_path) as f:
+            info = json.load(f)
+        if (info['etag'] == etag and info['size'] == size and
+                info['whisper'] == whisper.__version__ and
+                os.path.getsize(model_path) == info['cached_size']):
+            logging.warning('Model %s found in cache %s', file_name, model_path)
+            return model_path
+    except (OSError, ValueError, KeyError):
+        pass
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # The download, and the fp32 copy of an fp16 checkpoint, twice its size
+    workspace.ensure_space(3 * size, cache_dir)
+    # Unique names, as several containers may share the same EFS cache
+    downloaded_file = f"{model_path}.{uuid.uuid4().hex}.download"
+    logging.warning('Downloading model %s to %s', file_name, downloaded_file)
+    try:
+        s3.download_file(s3_bucket, file_name, downloaded_file,
+                         Config=s3_io.TRANSFER_CONFIG)
+        if os.path.getsize(downloaded_file) != size:
+            raise IOError(f"Model {file_name} download is incomplete")
+        prepare_model_file(downloaded_file, model_path, model_format)
+    finally:
+        # Also when the disk is full, so the in-memory loader gets the space
+        if os.path.exists(downloaded_file):
+            os.remove(downloaded_file)
+
+    with open(info_path, 'w') as f:
+        json.dump({'etag': etag,
+                   'size': size,
+                   'whisper': whisper.__version__,
+                   'cached_size': os.path.getsize(model_path)}, f)
+    remove_stale_models(cache_dir, stem, extension, etag)
+
+    return model_path
+
+
+def remove_stale_models(cache_dir, stem, extension, etag):
+    # Any format of older versions of the same checkpoint. The ETag is an MD5,
+    # with the part count of multipart uploads, so 'tiny' never matches the
+    # files of 'tiny-test' or 'large' those of 'large-v3'
+    pattern = re.compile(rf"{re.escape(stem)}-([0-9a-f]{{32}}(?:-\d+)?)"
+                         rf"(?:\.\w+)?{re.escape(extension)}(?:\.json)?")
+    for file_name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, file_name)
+        match = pattern.fullmatch(file_name)
+        if match and match.group(1) != etag:
+            logging.warning('Removing stale cached model %s', path)
+            os.remove(path)
+
+
 def get_session(context='aws'):
     if context == 'local':
         session = boto3.Session(region_name='us-east-1')
@@ -55,13 +266,31 @@ def load_model_from_s3(s3_bucket='cperalesg-whisper-model',
                        model_name=MODEL_NAME,
                        context='aws'):
     session = get_session(context)
-    s3 = session.client('s3')
+    s3 = session.client('s3', config=s3_io.CLIENT_CONFIG)
     file_name = os.path.join(file_prefix, model_name)
+
+    if model_name[-3:] == '.pt' and MODEL_CACHE_DIR:
+        try:
+            model_path = get_cached_model_path(s3, s3_bucket, file_name)
+        except OSError as e:
+            # Usually an ephemeral storage too small for the cached copies
+            logging.warning('Model %s not cached, loading it in memory, %s',
+                            model_name, str(e))
+        else:
+            # Memory-mapped for as long as the container lives, with the info
+            # that makes it a cache hit
+            workspace.protect(model_path)
+            workspace.protect(model_path + '.json')
+            logging.warning('Loading model %s from %s', model_name, model_path)
+            return load_model_file(model_path)
+
     obj = s3.get_object(Bucket=s3_bucket, Key=file_name)
 
     logging.warning('Loading model %s', model_name)
     
-    if model_name[-3:] == '.pt':
+    if model_name[-3:] == '.pt' and MODEL_FORMAT == 'int8':
+        return quantize_model(load_model_bytes(obj['Body'].read()))
+    elif model_name[-3:] == '.pt':
         return load_model_bytes(obj['Body'].read())
     else:
         return load_model_pickle(obj['Body'])
@@ -76,10 +305,109 @@ def get_model():
         raise e
 
 
-MODEL = get_model()
-logging.warning("Model loaded!")
+# Seconds spent in every phase of the cold start, returned by warm up requests
+INIT_TIMINGS = {}
+# MODEL_NAME, loaded once by get_loaded_model. Routed models are loaded on
+# first use, and all of them kept for the next invocations
+MODEL = None
+MODELS = {}
+# One lock per model name, so a small routed model never waits for MODEL_NAME
+_model_locks = {}
+_locks_lock = threading.Lock()
+_threads_lock = threading.Lock()
+_loader = None
+_load_reported = False
+_threads_configured = False
+
+
+def model_lock(model_name):
+    with _locks_lock:
+        return _model_locks.setdefault(model_name, threading.Lock())
+
+
+def configure_threads():
+    """Apply THREADS to torch, once."""
+    global _threads_configured
+    with _threads_lock:
+        if not _threads_configured:
+            cpus.configure_torch(THREADS)
+            logging.warning("Threads: %s, inference CPUs: %s, decoding CPUs: %s",
+                            THREADS, INFERENCE_CPUS, DECODE_CPUS)
+            _threads_configured = True
+
+
+def get_loaded_model():
+    """The model of MODEL_NAME, loaded and warmed up by the first caller.
+
+    Other callers wait for the load in progress. If it fails, the next call
+    tries again, so a request gets the error instead of a crashed init.
+    """
+    global MODEL
+    with model_lock(MODEL_NAME):
+        if MODEL is None:
+            configure_threads()
+            start = time.perf_counter()
+            model = get_model()
+            INIT_TIMINGS['model_load'] = round(time.perf_counter() - start, 3)
+            logging.warning("Model loaded!")
+            if WARMUP:
+                try:
+                    INIT_TIMINGS.update(warm_up(model))
+                except Exception as e:
+                    # A cold first request is better than no model
+                    logging.error("Warm up failed, %s", str(e))
+            MODEL = model
+    return MODEL
 
 
+def load_model_in_background():
+    """Start loading the model in a thread, unless it is loaded or loading."""
+    global _loader
+    if MODEL is not None or (_loader is not None and _loader.is_alive()):
+        return _loader
+
+    def load():
+        try:
+            get_loaded_model()
+        except Exception as e:
+            logging.error("Model %s not loaded in the background, %s",
+                          MODEL_NAME, str(e))
+
+    _loader = threading.Thread(target=load, name='model-loader', daemon=True)
+    _loader.start()
+    return _loader
+
+
+def prefetch_model(model_name):
+    """Start loading model_name in a thread while the request does its I/O.
+
+    A failed load is only logged, get_routed_model raises it again when the
+    model is needed.
+    """
+    if model_name == MODEL_NAME:
+        return load_model_in_background()
+
+    def load():
+        try:
+            get_routed_model(model_name)
+        except Exception as e:
+            logging.error("Model %s not prefetched, %s", model_name, str(e))
+
+    thread = threading.Thread(target=load, name='model-prefetch', daemon=True)
+    thread.start()
+    return thread
+
+
+def report_model_load():
+    # Once per container, in the first invocation after the load
+    global _load_reported
+    if not _load_reported and 'model_load' in INIT_TIMINGS:
+        instrumentation.add('model_load', INIT_TIMINGS['model_load'] * 1000,
+                            'Milliseconds')
+        _load_reported = True
+
+
+@instrumentation.instrument('transcriptor')
 def lambda_handler(event, context):
     try:
         message = json.loads(event['body'])
@@ -87,14 +415,27 @@ def lambda_handler(event, context):
         message = event['body']
     logging.warning("Body: %s", message)
 
+    report_model_load()
     if message.get('warmup', False):
         logging.warning("Warm up!")
+        # Answers at once while the model loads, unless asked to wait for it
+        if MODEL is None and not message.get('wait', False):
+            load_model_in_background()
+        elif 'transcription' not in INIT_TIMINGS:
+            INIT_TIMINGS.update(warm_up(get_loaded_model()))
         return {"statusCode": 200,
-                "body": {"message": "Warming up the transcriptor"}}
+                "body": {"message": "Warming up the transcriptor",
+                         "model": 'loading' if MODEL is None else 'ready',
+                         "timings": dict(INIT_TIMINGS)}}
+
+    with workspace.request_folder('transcriptor') as output_folder:
+        return transcribe_request(message, output_folder)
+
 
-    output_folder = '/tmp/'
-    shutil.rmtree(output_folder, ignore_errors=True)
-    os.makedirs(output_folder, exist_ok=True)
+def transcribe_request(message, output_folder):
+    if 'jobs' in message:
+        instrumentation.add('jobs', len(message['jobs']))
+        return transcribe_jobs(message['jobs'], output_folder)
 
     try:
         iid = message['IID']
@@ -102,43 +443,387 @@ def lambda_handler(event, context):
         return {"statusCode": 400,
                 "error": "\'IID\' key should be included in the body"}
 
+    started = time.time()
+    write_status(iid, 'running', progress=0.0, started=started)
+    try:
+        return transcribe_iid(message, iid, started, output_folder)
+    except Exception as e:
+        # Otherwise the job would poll as running forever
+        write_status(iid, 'error', started=started, error=str(e))
+        raise e
+
+
+def transcribe_iid(message, iid, started, output_folder):
+    if not ROUTE_MODELS:
+        # The model loads while the audio is downloaded
+        prefetch_model(MODEL_NAME)
+
     # Save the audio file
-    audio_file = os.path.join(output_folder,
-                                "received_audio.mp3")
     try:
-        s3_client.download_file(AWS_BUCKET_NAME,
-                                message['audio'],
-                                audio_file)
+        audio_file = receive_audio(message['audio'], output_folder)
     except KeyError:
+        write_status(iid, 'error', started=started,
+                     error="'audio' key should be in JSON body")
         return {"error": '\'audio\' key should be in JSON body',
                 "statusCode": 400}
     except Exception as e:
+            write_status(iid, 'error', started=started, error=str(e))
             return {"error": str(e),
                     "statusCode": 500}
 
+    plan = plan_job(message, audio_file)
+    if ROUTE_MODELS:
+        # The routed model loads while the cache is looked up
+        prefetch_model(plan['model'])
+    cache_prefix, response = get_cached_response(iid, audio_file, started, plan)
+    if response is not None:
+        return response
+
     # Transcript audio
     logging.warning(f"Processing audio {message['audio']} with ID {iid}...")
     start = time.perf_counter()
-    transcription = get_transcription(audio_file, MODEL)
+    partial = None
+    if PARTIAL_RESULTS:
+        partial = PartialResults(iid, f"processed/partial/{iid}.srt", started)
+    # Only what is left of a load started at init
+    with instrumentation.timer('model_wait'):
+        model = get_routed_model(plan['model'])
+    report_model_load()
+    with instrumentation.timer('inference'):
+        transcription = get_transcription(audio_file, model, plan['workers'],
+                                          progress=partial,
+                                          chunk_seconds=plan['chunk_seconds'])
     duration = time.perf_counter() - start
     logging.warning("Transcription finished! Process lasts %.2f seconds", duration)
     gc.collect()
     logging.info('Memory usage after transcription and gc: %.2f', memory_usage())
 
-    text_file = os.path.join(output_folder, f"{iid}.txt") 
-    text_file = save_text(transcription['text'], text_file)
-    # Upload back to S3
-    s3_output_key_txt = f"processed/text/{iid}.txt"
-    s3_client.upload_file(text_file, AWS_BUCKET_NAME, s3_output_key_txt)
+    response = publish_transcription(iid, transcription, cache_prefix, started,
+                                     transcription_seconds=round(duration, 3))
+    if partial is not None:
+        partial.remove()
+    return response
+
+
+def receive_audio(audio_key, folder):
+    audio_file = os.path.join(folder,
+                              "received_audio" + os.path.splitext(audio_key)[1])
+    with instrumentation.timer('download'):
+        workspace.download(s3_client, AWS_BUCKET_NAME, audio_key, audio_file)
+    instrumentation.add('bytes_downloaded', instrumentation.file_size(audio_file),
+                        'Bytes')
+    return audio_file
+
+
+def get_cached_response(iid, audio_file, started, plan=None, batched=False):
+    """Return the result cache prefix of audio_file and, on a hit, the response."""
+    if not RESULT_CACHE:
+        return None, None
+    s3_output_key_txt, s3_output_key_srt = output_keys(iid)
+    cache_prefix = get_cache_prefix(audio_file, plan, batched)
+    if not copy_cached_results(cache_prefix, s3_output_key_txt, s3_output_key_srt):
+        return cache_prefix, None
+    logging.warning("Audio with ID %s found in cache %s", iid, cache_prefix)
+    response = transcription_response(s3_output_key_txt, s3_output_key_srt)
+    write_status(iid, 'done', progress=1.0, started=started, cached=True,
+                 **response['body'])
+    return cache_prefix, response
+
+
+def output_keys(iid):
+    return f"processed/text/{iid}.txt", f"processed/srt/{iid}.srt"
 
-    srt_file = os.path.join(output_folder, f"{iid}.srt")
-    srt_file = save_transcription(transcription['segments'], srt_file)
 
-    # Upload back to S3
-    s3_output_key_srt = f"processed/srt/{iid}.srt"
-    s3_client.upload_file(srt_file, AWS_BUCKET_NAME, s3_output_key_srt)
+def publish_transcription(iid, transcription, cache_prefix, started, **timing):
+    """Upload the text and SRT of a transcription and mark the job as done.
+
+    Both outputs are uploaded at once from memory, so neither waits for the
+    other (or for its retries). The result cache is then filled while the
+    status manifest is written.
+    """
+    s3_output_key_txt, s3_output_key_srt = output_keys(iid)
+    with instrumentation.timer('srt_write'):
+        outputs = {s3_output_key_txt: (transcription['text'].encode(),
+                                       'text/plain; charset=utf-8'),
+                   s3_output_key_srt: (subtitles.serialize(transcription['segments'])
+                                       .encode(), subtitles.CONTENT_TYPES['srt'])}
+
+    with instrumentation.timer('upload'):
+        put_objects(outputs)
+    instrumentation.add('bytes_uploaded',
+                        sum(len(body) for body, _ in outputs.values()), 'Bytes')
     logging.warning('SRT file uploaded to %s', s3_output_key_srt)
 
+    response = transcription_response(s3_output_key_txt, s3_output_key_srt)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        cached = None
+        if cache_prefix is not None:
+            cached = executor.submit(save_cached_results, cache_prefix,
+                                     s3_output_key_txt, s3_output_key_srt)
+        write_status(iid, 'done', progress=1.0, started=started,
+                     **timing, **response['body'])
+    if cached is not None:
+        cached.result()
+    return response
+
+
+def put_objects(outputs):
+    """Upload {key: (body, content type)} to AWS_BUCKET_NAME in parallel."""
+    with ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+        futures = [executor.submit(s3_client.put_object, Bucket=AWS_BUCKET_NAME,
+                                   Key=key, Body=body, ContentType=content_type)
+                   for key, (body, content_type) in outputs.items()]
+    for future in futures:
+        future.result()
+
+
+def transcribe_jobs(jobs, output_folder, batch_size=BATCH_SIZE):
+    """Transcribe a list of {'IID', 'audio'} jobs in a single invocation.
+
+    Clips that fit in one 30 s Whisper window are decoded together, batch_size
+    at a time. Longer audio goes through get_transcription. Every job gets its
+    own outputs, status manifest and response, and a failing job does not stop
+    the others.
+    """
+    responses = [None] * len(jobs)
+    short = []
+    # The model loads while the audio files are downloaded
+    prefetch_model(MODEL_NAME)
+    for index, job in enumerate(jobs):
+        if not isinstance(job, dict) or 'IID' not in job or 'audio' not in job:
+            responses[index] = {"statusCode": 400,
+                                "error": "Every job needs \'IID\' and \'audio\' keys"}
+            continue
+        iid = job['IID']
+        started = time.time()
+        write_status(iid, 'running', progress=0.0, started=started)
+        folder = os.path.join(output_folder, str(index))
+        try:
+            os.makedirs(folder, exist_ok=True)
+            audio_file = receive_audio(job['audio'], folder)
+            audio = load_short_audio(audio_file)
+            batched = audio is not None
+            cache_prefix, responses[index] = get_cached_response(
+                iid, audio_file, started, batched=batched)
+            if responses[index] is not None:
+                continue
+            if batched:
+                short.append((index, iid, audio, cache_prefix, started))
+                continue
+            # Streamed from the file, like a single job
+            partial = None
+            if PARTIAL_RESULTS:
+                partial = PartialResults(iid, f"processed/partial/{iid}.srt", started)
+            start = time.perf_counter()
+            with instrumentation.timer('inference'):
+                transcription = get_transcription(audio_file, get_loaded_model(),
+                                                  progress=partial)
+            responses[index] = publish_transcription(
+                iid, transcription, cache_prefix, started,
+                transcription_seconds=round(time.perf_counter() - start, 3))
+            if partial is not None:
+                partial.remove()
+        except Exception as e:
+            logging.error("Job with ID %s failed, %s", iid, str(e))
+            write_status(iid, 'error', started=started, error=str(e))
+            responses[index] = {"statusCode": 500, "error": str(e)}
+
+    for first in range(0, len(short), batch_size):
+        batch = short[first:first + batch_size]
+        start = time.perf_counter()
+        try:
+            with instrumentation.timer('inference'):
+                transcriptions = transcribe_batch([job[2] for job in batch],
+                                                  get_loaded_model())
+        except Exception as e:
+            logging.error("Batch of %d clips failed, %s", len(batch), str(e))
+            transcriptions = [e] * len(batch)
+        duration = round(time.perf_counter() - start, 3)
+        logging.warning("Batch of %d clips transcribed in %.2f seconds",
+                        len(batch), duration)
+
+        for (index, iid, _, cache_prefix, started), transcription in zip(
+                batch, transcriptions):
+            try:
+                if isinstance(transcription, Exception):
+                    raise transcription
+                responses[index] = publish_transcription(
+                    iid, transcription, cache_prefix, started,
+                    transcription_seconds=duration, batch_size=len(batch))
+            except Exception as e:
+                logging.error("Job with ID %s failed, %s", iid, str(e))
+                write_status(iid, 'error', started=started, error=str(e))
+                responses[index] = {"statusCode": 500, "error": str(e)}
+
+    return {"statusCode": 200,
+            "body": {"jobs": [dict(response, IID=job.get('IID'))
+                              if isinstance(job, dict) else response
+                              for job, response in zip(jobs, responses)]}}
+
+
+def load_short_audio(audio_file):
+    """The samples of audio_file if it fits in one Whisper window, else None.
+
+    Longer audio is not decoded here, its duration comes from the file size
+    or headers.
+    """
+    duration = audio_duration(audio_file)
+    if duration is not None and duration > N_SAMPLES / SAMPLE_RATE + 1:
+        return None
+    audio = load_audio(audio_file)
+    return audio if len(audio) <= N_SAMPLES else None
+
+
+def write_status(iid, state, **fields):
+    """Write processed/status/{iid}.json, the only object polled by clients.
+
+    state is 'queued', 'running', 'done' or 'error'. Failing to write it is
+    logged and ignored, since the outputs themselves are still uploaded.
+    """
+    status = dict(fields, IID=iid, state=state, updated=time.time())
+    try:
+        s3_client.put_object(Bucket=AWS_BUCKET_NAME,
+                             Key=f"{STATUS_PREFIX}{iid}.json",
+                             Body=json.dumps(status).encode(),
+                             ContentType='application/json',
+                             CacheControl='no-cache')
+    except Exception as e:
+        logging.error("Status of IID %s not written, %s", iid, str(e))
+
+
+class PartialResults:
+    """Progress callback of get_transcription that publishes partial results.
+
+    The SRT of the segments decoded so far is uploaded to key, and the status
+    manifest gets the progress and the partial key. Both are throttled by time
+    and by the number of new SRT bytes.
+    """
+    def __init__(self, iid, key, started, flush_seconds=PARTIAL_FLUSH_SECONDS,
+                 flush_bytes=PARTIAL_FLUSH_BYTES):
+        self.iid = iid
+        self.key = key
+        self.started = started
+        self.flush_seconds = flush_seconds
+        self.flush_bytes = flush_bytes
+        self.srt = io.StringIO()
+        self.n_segments = 0
+        self.uploaded_bytes = 0
+        self.uploaded_segments = 0
+        self.last_flush = time.monotonic()
+
+    def __call__(self, segments, progress):
+        self.srt.write(subtitles.serialize(segments, first_index=self.n_segments + 1))
+        self.n_segments += len(segments)
+        if time.monotonic() - self.last_flush < self.flush_seconds:
+            return
+        self.last_flush = time.monotonic()
+
+        partial = {}
+        if self.srt.tell() - self.uploaded_bytes >= self.flush_bytes:
+            try:
+                s3_client.put_object(Bucket=AWS_BUCKET_NAME, Key=self.key,
+                                     Body=self.srt.getvalue().encode(),
+                                     ContentType=subtitles.CONTENT_TYPES['srt'])
+                self.uploaded_bytes = self.srt.tell()
+                self.uploaded_segments = self.n_segments
+            except Exception as e:
+                logging.error("Partial SRT of IID %s not uploaded, %s",
+                              self.iid, str(e))
+        if self.uploaded_bytes:
+            partial = {'partial': {'key': self.key, 'bucket': AWS_BUCKET_NAME,
+                                   'segments': self.uploaded_segments}}
+        if progress is not None:
+            # Unknown while a compressed file is streamed
+            partial['progress'] = round(progress, 3)
+        write_status(self.iid, 'running', started=self.started, **partial)
+
+    def remove(self):
+        if self.uploaded_bytes:
+            try:
+                s3_client.delete_object(Bucket=AWS_BUCKET_NAME, Key=self.key)
+            except Exception as e:
+                logging.error("Partial SRT %s not removed, %s", self.key, str(e))
+
+
+def default_plan():
+    return {'model': MODEL_NAME, 'workers': TRANSCRIBE_WORKERS,
+            'chunk_seconds': CHUNK_SECONDS}
+
+
+def model_speed(model_name):
+    """Audio seconds per second of one worker, from the size in the model name."""
+    stem = os.path.splitext(os.path.basename(model_name))[0]
+    for size in sorted(MODEL_SPEEDS, key=len, reverse=True):
+        if stem.startswith(size):
+            return MODEL_SPEEDS[size]
+    raise ValueError(f"Unknown speed of model {model_name}, set it in model_speeds")
+
+
+def plan_transcription(duration, models=None, target=TARGET_LATENCY_SECONDS,
+                       max_workers=TRANSCRIBE_WORKERS):
+    """Model, workers and chunk length to transcribe duration seconds of audio.
+
+    The most accurate model that makes the target with the fewest workers is
+    picked. If none does, the fastest one with every worker.
+    """
+    models = ROUTE_MODELS if models is None else models
+    if not models or not duration:
+        return default_plan()
+    for model in sorted(models, key=model_speed):
+        workers = max(1, math.ceil(duration / (model_speed(model) * target)))
+        if workers <= max_workers:
+            break
+    else:
+        workers = max_workers
+    # One window per worker, the parallel transcription splits evenly
+    chunk_seconds = CHUNK_SECONDS
+    if workers > 1:
+        chunk_seconds = min(CHUNK_SECONDS, math.ceil(duration / workers))
+    return {'model': model, 'workers': workers, 'chunk_seconds': chunk_seconds}
+
+
+def read_metadata(audio_key):
+    """The preflight metadata lambda_extract_audio writes next to the audio."""
+    try:
+        obj = s3_client.get_object(Bucket=AWS_BUCKET_NAME,
+                                   Key=os.path.splitext(audio_key)[0] + '.json')
+        return json.loads(obj['Body'].read())
+    except (ClientError, ValueError):
+        return {}
+
+
+def audio_duration(audio_file):
+    """Seconds of audio_file, from its size or headers, None if unknown."""
+    if audio_file.endswith('.pcm'):
+        return os.path.getsize(audio_file) / 2 / SAMPLE_RATE
+    # The transcription decodes it anyway, only the headers are read here
+    return media.duration(audio_file)
+
+
+def plan_job(message, audio_file):
+    """The transcription plan of a job, from its preflight duration if known."""
+    if not ROUTE_MODELS:
+        return default_plan()
+    metadata = message.get('metadata') or read_metadata(message['audio'])
+    duration = metadata.get('duration') or audio_duration(audio_file)
+    plan = plan_transcription(duration)
+    logging.warning("Transcribing %s s of audio with %s", duration, plan)
+    instrumentation.set_property('model', plan['model'])
+    instrumentation.add('workers', plan['workers'])
+    return plan
+
+
+def get_routed_model(model_name):
+    if model_name == MODEL_NAME:
+        return get_loaded_model()
+    with model_lock(model_name):
+        if model_name not in MODELS:
+            configure_threads()
+            MODELS[model_name] = load_model_from_s3(model_name=model_name)
+    return MODELS[model_name]
+
+
+def transcription_response(s3_output_key_txt, s3_output_key_srt):
     return {
         'statusCode': 200,
         'body': {
@@ -154,17 +839,74 @@ def lambda_handler(event, context):
     }
 
 
+def transcription_options(plan=None, batched=False):
+    """Everything besides the audio that changes the transcription.
+
+    batched is for clips decoded together by transcribe_batch, which neither
+    streams nor splits them.
+    """
+    plan = plan or default_plan()
+    options = dict(DECODE_OPTIONS,
+                   model=plan['model'],
+                   model_format=MODEL_FORMAT,
+                   vad=VAD)
+    if VAD:
+        options['vad_threshold_db'] = VAD_THRESHOLD_DB
+    if batched:
+        options['batched'] = True
+    elif STREAM_AUDIO:
+        options['stream_window_seconds'] = STREAM_WINDOW_SECONDS
+    elif plan['workers'] > 1:
+        options['chunk_seconds'] = plan['chunk_seconds']
+        options['chunk_overlap_seconds'] = CHUNK_OVERLAP_SECONDS
+    elif PARTIAL_RESULTS:
+        # Decoded in windows, not as a whole
+        options['partial_results'] = True
+        options['stream_window_seconds'] = STREAM_WINDOW_SECONDS
+    return options
+
+
+def get_cache_prefix(audio_file, plan=None, batched=False):
+    sha256 = hashlib.sha256()
+    with open(audio_file, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+    options = transcription_options(plan, batched)
+    sha256.update(json.dumps(options, sort_keys=True).encode())
+    model = os.path.splitext(os.path.basename(options['model']))[0]
+    return f"processed/cache/{sha256.hexdigest()}/{model}"
+
+
+def copy_cached_results(cache_prefix, s3_output_key_txt, s3_output_key_srt):
+    # The SRT is cached last, so the text is there whenever the SRT is
+    try:
+        s3_client.copy_object(Bucket=AWS_BUCKET_NAME, Key=s3_output_key_srt,
+                              CopySource={'Bucket': AWS_BUCKET_NAME,
+                                          'Key': f"{cache_prefix}/transcription.srt"})
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return False
+        raise e
+    s3_client.copy_object(Bucket=AWS_BUCKET_NAME, Key=s3_output_key_txt,
+                          CopySource={'Bucket': AWS_BUCKET_NAME,
+                                      'Key': f"{cache_prefix}/transcription.txt"})
+    return True
+
+
+def save_cached_results(cache_prefix, s3_output_key_txt, s3_output_key_srt):
+    try:
+        for key, extension in ((s3_output_key_txt, 'txt'), (s3_output_key_srt, 'srt')):
+            s3_client.copy_object(Bucket=AWS_BUCKET_NAME,
+                                  Key=f"{cache_prefix}/transcription.{extension}",
+                                  CopySource={'Bucket': AWS_BUCKET_NAME, 'Key': key})
+    except ClientError as e:
+        # The outputs are already uploaded, a cache miss next time is fine
+        logging.error("Results not cached in %s, %s", cache_prefix, str(e))
 
-def save_transcription(data, srt_file):
+
+def save_transcription(data, srt_file, format='srt'):
     with open(srt_file, "w") as f:
-        for idx, entry in enumerate(data, start=1):
-            f.write(f"{idx}\n")
-            start = float(entry['start'])
-            start_formatted = seconds_to_hh_mm_seconds(start)
-            end = float(entry['end'])
-            end_formatted = seconds_to_hh_mm_seconds(end)
-            f.write(f"{start_formatted} --> {end_formatted}\n")
-            f.write(f"{entry['text']}\n\n")
+        f.write(subtitles.serialize(data, format))
 
     return srt_file
 
@@ -177,26 +919,53 @@ def save_text(data, text_file):
 
 
 def seconds_to_hh_mm_seconds(total_seconds):
-    # Convert seconds to hours, minutes, and seconds
-    hours, remainder = divmod(total_seconds, 3600)
-    minutes, seconds = divmod(remainder, 60)
-    miliseconds = (seconds - int(seconds)) * 1000
-    # Return the formatted time as HH:MM:seconds
-    return f"{int(hours):02}:{int(minutes):02}:{int(seconds):02},{int(miliseconds)}"
+    # HH:MM:SS,mmm of the SRT format
+    return subtitles.timestamps([total_seconds])[0]
+
+
+def get_transcription(audio, MODEL, workers=TRANSCRIBE_WORKERS, vad=VAD,
+                      progress=None, chunk_seconds=None, stream=STREAM_AUDIO):
+    """Transcribe audio, a file path or 16 kHz samples.
+
+    With a progress callback and a single worker, the audio is transcribed in
+    windows of STREAM_WINDOW_SECONDS, and progress(new_segments, fraction) is
+    called after each of them with timestamps in the original timeline.
 
+    With stream, a file is decoded and transcribed in those windows as well,
+    without loading it whole (see stream_audio). workers is then ignored.
+    """
+    import torch
 
-def get_transcription(audio, MODEL):
     logging.warning('Transcribiendo...')
-    logging.warning('Número de threads: %s',
-                    whisper.torch.get_num_threads())
+    logging.warning('Número de threads: %s', torch.get_num_threads())
     logging.info('Memory usage before gc and transcription: %.2f', memory_usage())
     gc.collect()
     logging.info('Memory usage after gc and before transcription: %.2f', memory_usage())
-    transcription = MODEL.transcribe(audio,
-                    # language='es',
-                    temperature=0.0,
-                    fp16=False,
-                    word_timestamps=False)
+    if isinstance(audio, str) and stream:
+        transcription = collect_windows(iter_stream_transcription(audio, MODEL, vad),
+                                        progress)
+        vad = False
+    else:
+        if isinstance(audio, str):
+            audio = load_audio(audio)
+        instrumentation.add('audio_seconds', len(audio) / SAMPLE_RATE, 'Seconds')
+        timeline = None
+        if vad:
+            audio, timeline = remove_silence(audio, detect_speech(audio))
+
+        if len(audio) == 0:
+            transcription = {'segments': [], 'text': ''}
+        elif workers > 1:
+            transcription = transcribe_parallel(audio, MODEL, workers, chunk_seconds)
+        elif progress is not None:
+            transcription = collect_windows(iter_transcription(audio, MODEL),
+                                            progress, timeline)
+        else:
+            transcription = MODEL.transcribe(audio, **DECODE_OPTIONS)
+
+    if vad:
+        transcription['segments'] = remap_segments(transcription['segments'],
+                                                   timeline)
     logging.info('Memory usage after transcription: %.2f', memory_usage())
     
     segments = transcription['segments']
@@ -213,6 +982,516 @@ def get_transcription(audio, MODEL):
             'text': text}
 
 
+def transcribe_batch(audios, MODEL, vad=VAD):
+    """Transcribe clips of up to 30 s with one batched Whisper decode.
+
+    The mel spectrograms of all clips go through the encoder and the greedy
+    decoder together. Returns the same {'segments', 'text'} dicts as
+    get_transcription, and an empty transcription for the clips Whisper
+    considers silent.
+    """
+    import torch
+    import whisper
+
+    audios = list(audios)
+    instrumentation.add('audio_seconds', sum(map(len, audios)) / SAMPLE_RATE,
+                        'Seconds')
+    timelines = [None] * len(audios)
+    if vad:
+        for i, audio in enumerate(audios):
+            audios[i], timelines[i] = remove_silence(audio, detect_speech(audio))
+    voiced = [i for i, audio in enumerate(audios) if len(audio) > 0]
+    transcriptions = [{'segments': [], 'text': ''} for _ in audios]
+    if not voiced:
+        return transcriptions
+
+    mel = torch.stack([
+        whisper.log_mel_spectrogram(whisper.pad_or_trim(
+            torch.from_numpy(np.asarray(audios[i], dtype=np.float32))),
+            MODEL.dims.n_mels)
+        for i in voiced]).to(MODEL.device)
+    options = whisper.DecodingOptions(task=DECODE_OPTIONS.get('task', 'transcribe'),
+                                      language=DECODE_OPTIONS.get('language'),
+                                      temperature=0.0,
+                                      fp16=DECODE_OPTIONS.get('fp16', False))
+    with torch.no_grad():
+        results = whisper.decode(MODEL, mel, options)
+
+    for i, result in zip(voiced, results):
+        # Same rule as whisper.transcribe to skip silent windows
+        if result.no_speech_prob > 0.6 and result.avg_logprob < -1.0:
+            continue
+        tokenizer = whisper.tokenizer.get_tokenizer(
+            MODEL.is_multilingual, num_languages=MODEL.num_languages,
+            language=result.language, task=options.task)
+        segments = token_segments(result.tokens, tokenizer,
+                                  len(audios[i]) / SAMPLE_RATE)
+        if vad:
+            segments = remap_segments(segments, timelines[i])
+        transcriptions[i] = {
+            'segments': [dict(s, text=remove_beginning_whitespace(s['text']))
+                         for s in segments],
+            'text': remove_beginning_whitespace(''.join(s['text'] for s in segments))}
+    return transcriptions
+
+
+def token_segments(tokens, tokenizer, duration):
+    """Segments delimited by the timestamp tokens of a decoded window."""
+    segments = []
+    start = None
+    text_tokens = []
+    for token in tokens:
+        if token < tokenizer.timestamp_begin:
+            text_tokens.append(token)
+            continue
+        seconds = min((token - tokenizer.timestamp_begin) * 0.02, duration)
+        if start is not None and text_tokens:
+            segments.append({'start': start, 'end': seconds,
+                             'text': tokenizer.decode(text_tokens)})
+            start, text_tokens = None, []
+        else:
+            start = seconds
+    if text_tokens:
+        segments.append({'start': start or 0.0, 'end': duration,
+                         'text': tokenizer.decode(text_tokens)})
+    return segments
+
+
+def iter_transcription(audio, MODEL, window_seconds=STREAM_WINDOW_SECONDS):
+    """Transcribe audio window by window, cutting at silences.
+
+    Yields the segments of every window, shifted to the full audio, and the
+    fraction of the audio done. The text of the previous window is the prompt
+    of the next one, as Whisper does between its own 30 s windows.
+    """
+    prompt = None
+    for start, end in split_windows(audio, window_seconds):
+        result = MODEL.transcribe(audio[start:end], initial_prompt=prompt,
+                                  **DECODE_OPTIONS)
+        offset = start / SAMPLE_RATE
+        segments = [dict(s, start=s['start'] + offset, end=s['end'] + offset)
+                    for s in result['segments']]
+        prompt = result['text'] or prompt
+        yield segments, end / len(audio)
+
+
+def iter_stream_transcription(audio_file, MODEL, vad=VAD,
+                              window_seconds=STREAM_WINDOW_SECONDS):
+    """iter_transcription of a file decoded window by window by stream_audio.
+
+    Only the samples and the mel spectrogram of one window are in memory. The
+    text of each window is still the prompt of the next one. With vad, the
+    silence of every window is removed before transcribing it, against the
+    noise floor and peak of the audio heard so far. The fraction
+    done is None unless the file is PCM, whose length is known upfront.
+    """
+    total = os.path.getsize(audio_file) // 2 if audio_file.endswith('.pcm') else None
+    prompt = None
+    noise_floor = peak = None
+    for start, audio in stream_audio(audio_file, window_seconds):
+        end = start + len(audio)
+        instrumentation.add('audio_seconds', len(audio) / SAMPLE_RATE, 'Seconds')
+        timeline = None
+        if vad:
+            # Levels of all the audio so far, a quiet window is not mistaken
+            # for steady speech once louder speech has been heard
+            window_floor, window_peak = audio_levels(audio)
+            if window_floor is not None:
+                noise_floor = min(window_floor, noise_floor or window_floor)
+                peak = max(window_peak, peak or window_peak)
+            levels = (noise_floor, peak) if noise_floor is not None else None
+            audio, timeline = remove_silence(audio, detect_speech(audio, levels=levels))
+        segments = []
+        if len(audio):
+            result = MODEL.transcribe(audio, initial_prompt=prompt, **DECODE_OPTIONS)
+            segments = result['segments']
+            if timeline is not None:
+                segments = remap_segments(segments, timeline)
+            prompt = result['text'] or prompt
+        offset = start / SAMPLE_RATE
+        segments = [dict(s, start=s['start'] + offset, end=s['end'] + offset)
+                    for s in segments]
+        del audio
+        yield segments, min(1.0, end / total) if total else None
+
+
+def collect_windows(windows, progress=None, timeline=None):
+    """Transcription of the (segments, fraction) windows of iter_transcription.
+
+    Every window is passed to progress with its timestamps remapped through
+    the VAD timeline, when there is one. The returned segments are not.
+    """
+    segments = []
+    for window_segments, fraction in windows:
+        segments.extend(window_segments)
+        if progress is not None:
+            if timeline is not None:
+                window_segments = remap_segments(window_segments, timeline)
+            progress([dict(s, text=remove_beginning_whitespace(s['text']))
+                      for s in window_segments], fraction)
+    return {'segments': segments, 'text': ''.join(s['text'] for s in segments)}
+
+
+def frame_energy_db(audio, frame_seconds=0.03):
+    frame = int(frame_seconds * SAMPLE_RATE)
+    n_frames = len(audio) // frame
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    return 10 * np.log10(np.square(frames).mean(axis=1) + 1e-10)
+
+
+def audio_levels(audio, frame_seconds=0.03):
+    """Noise floor and peak of audio in dB, as detect_speech estimates them.
+
+    The noise floor is the 10th percentile of the audible frame energies,
+    digital silence left out. Both are None when nothing is audible.
+    """
+    energy_db = frame_energy_db(audio, frame_seconds)
+    audible = energy_db[energy_db > -70]
+    if len(audible) == 0:
+        return None, None
+    return float(np.percentile(audible, 10)), float(audible.max())
+
+
+def detect_speech(audio, threshold_db=VAD_THRESHOLD_DB, frame_seconds=0.03,
+                  min_silence_seconds=1.0, padding_seconds=0.3, levels=None):
+    """Speech regions of audio, as a list of (start, end) sample indexes.
+
+    A frame is speech when its energy is threshold_db above the noise floor,
+    estimated as the 10th percentile of the audible frame energies. Regions are padded
+    and pauses shorter than min_silence_seconds are not removed. levels, the
+    (noise floor, peak) of the audio heard before, replaces the estimate.
+    """
+    frame = int(frame_seconds * SAMPLE_RATE)
+    energy_db = frame_energy_db(audio, frame_seconds)
+    n_frames = len(energy_db)
+    if n_frames == 0:
+        return []
+    noise_floor, peak = levels or audio_levels(audio, frame_seconds)
+    if noise_floor is None:
+        return []
+    if peak - noise_floor < threshold_db:
+        # Steady level all along, there are no pauses to skip
+        return [(0, len(audio))]
+    speech = energy_db > noise_floor + threshold_db
+
+    # Pad the speech frames, which also closes short pauses between them
+    padding = int((padding_seconds + min_silence_seconds / 2) / frame_seconds)
+    speech = np.convolve(speech, np.ones(2 * padding + 1), mode='same') > 0
+    # and shrink back what was not a short pause
+    shrink = int(min_silence_seconds / 2 / frame_seconds)
+    if shrink:
+        speech = np.convolve(~speech, np.ones(2 * shrink + 1), mode='same') == 0
+
+    changes = np.flatnonzero(np.diff(speech.astype(np.int8))) + 1
+    bounds = np.concatenate(([0], changes, [n_frames]))
+    regions = [(int(start) * frame, int(end) * frame)
+               for start, end in zip(bounds[:-1], bounds[1:]) if speech[start]]
+    if regions and regions[-1][1] == n_frames * frame:
+        regions[-1] = (regions[-1][0], len(audio))
+    return regions
+
+
+def remove_silence(audio, regions):
+    """Concatenate the speech regions of audio.
+
+    Returns the shortened audio and its timeline, an array with the start of
+    every region in the shortened audio and in the original one.
+    """
+    if not regions:
+        return audio[:0], np.zeros((0, 2), dtype=np.int64)
+    starts, ends = np.array(regions, dtype=np.int64).T
+    timeline = np.stack([np.concatenate(([0], np.cumsum(ends - starts)[:-1])),
+                         starts], axis=1)
+    logging.warning('Speech detected in %.1f of %.1f seconds',
+                    (ends - starts).sum() / SAMPLE_RATE, len(audio) / SAMPLE_RATE)
+    return np.concatenate([audio[s:e] for s, e in regions]), timeline
+
+
+def remap_times(times, timeline, side='right'):
+    """Move times of the shortened audio back to the original timeline."""
+    samples = np.asarray(times, dtype=np.float64) * SAMPLE_RATE
+    index = np.searchsorted(timeline[:, 0], samples, side=side) - 1
+    index = np.clip(index, 0, len(timeline) - 1)
+    return (samples + timeline[index, 1] - timeline[index, 0]) / SAMPLE_RATE
+
+
+def remap_segments(segments, timeline):
+    if not segments:
+        return segments
+    starts = remap_times([s['start'] for s in segments], timeline)
+    # A segment ending where a region ends stays in that region
+    ends = remap_times([s['end'] for s in segments], timeline, side='left')
+    return [dict(s, start=float(start), end=float(end))
+            for s, start, end in zip(segments, starts, ends)]
+
+
+def load_audio(audio_file):
+    """Audio file as a float32 array of 16 kHz mono samples."""
+    if audio_file.endswith('.pcm'):
+        # Already 16 kHz mono s16le, as written by lambda_extract_audio
+        return np.fromfile(audio_file, np.int16).astype(np.float32) / 32768.0
+    process = start_decoder(audio_file, stderr=subprocess.PIPE)
+    output, stderr = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"Failed to load audio: {stderr.decode()}")
+    return np.frombuffer(output, np.int16).astype(np.float32) / 32768.0
+
+
+def decode_command(audio_file):
+    """ffmpeg command writing the 16 kHz mono s16le samples of audio_file to
+    stdout, as whisper.load_audio does."""
+    threads = len(DECODE_CPUS) if DECODE_CPUS != INFERENCE_CPUS else 0
+    return ['ffmpeg', '-nostdin', '-loglevel', 'error', '-threads', str(threads),
+            '-i', audio_file, '-f', 's16le', '-ac', '1', '-acodec', 'pcm_s16le',
+            '-ar', str(SAMPLE_RATE), '-']
+
+
+def start_decoder(audio_file, **kwargs):
+    """ffmpeg process piping the samples of audio_file, see decode_command.
+
+    It runs on DECODE_CPUS when they are set apart from the inference. It is
+    pinned once started, as a preexec_fn is not safe in a process with threads.
+    """
+    process = subprocess.Popen(decode_command(audio_file), stdout=subprocess.PIPE,
+                               **kwargs)
+    if DECODE_CPUS != INFERENCE_CPUS:
+        cpus.pin(DECODE_CPUS, process.pid)
+    return process
+
+
+@contextlib.contextmanager
+def pcm_stream(audio_file):
+    """Binary stream of the 16 kHz mono s16le samples of audio_file.
+
+    PCM files are read as they are, anything else through an ffmpeg pipe,
+    which is killed if the stream is left before its end. ffmpeg logs to a
+    temporary file, since a pipe that is not read would fill up with the
+    errors of a corrupt file and block it.
+    """
+    if audio_file.endswith('.pcm'):
+        with open(audio_file, 'rb') as f:
+            yield f
+        return
+    with tempfile.TemporaryFile() as log:
+        process = start_decoder(audio_file, stderr=log)
+        try:
+            yield process.stdout
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            process.stdout.close()
+            process.wait()
+        if process.returncode != 0:
+            log.seek(0)
+            stderr = log.read().decode(errors='replace')
+            raise RuntimeError(f"Failed to load audio: {stderr[-4096:]}")
+
+
+def stream_audio(audio_file, window_seconds=STREAM_WINDOW_SECONDS):
+    """Decode audio_file window by window, cutting at silences.
+
+    Yields the first sample index and the float32 samples of every window of
+    up to window_seconds, so that a 30 s window is a single Whisper segment.
+    Each window ends at the quietest point of its last fifth, and the samples
+    after it are carried over to the next one. Only one window is in memory.
+    """
+    window = int(window_seconds * SAMPLE_RATE)
+    search = window // 5
+    start = 0
+    carry = np.zeros(0, dtype=np.float32)
+    with pcm_stream(audio_file) as stream:
+        while True:
+            wanted = window - len(carry)
+            data = stream.read(2 * wanted)
+            samples = np.frombuffer(data[:len(data) // 2 * 2], np.int16)
+            audio = np.concatenate([carry, samples.astype(np.float32) / 32768.0])
+            if len(samples) < wanted:
+                if len(audio):
+                    yield start, audio
+                return
+            cut = find_silence(audio, window - search, window)
+            yield start, audio[:cut]
+            carry = audio[cut:]
+            start += cut
+
+
+def find_silence(audio, start, end, frame_seconds=0.1):
+    """Sample index of the quietest frame of audio[start:end]."""
+    frame = int(frame_seconds * SAMPLE_RATE)
+    n_frames = (end - start) // frame
+    if n_frames < 2:
+        return (start + end) // 2
+    frames = audio[start:start + n_frames * frame].reshape(n_frames, frame)
+    energy = np.square(frames).mean(axis=1)
+    return start + int(np.argmin(energy)) * frame + frame // 2
+
+
+def split_audio(audio, chunk_seconds=CHUNK_SECONDS,
+                overlap_seconds=CHUNK_OVERLAP_SECONDS):
+    """Split audio at silences close to every chunk_seconds.
+
+    Returns a list of (start, end, core_start, core_end) sample indexes. Each
+    window [start, end) is its core plus overlap_seconds on each side, and the
+    cores cover the audio without overlapping.
+    """
+    n_samples = len(audio)
+    chunk = int(chunk_seconds * SAMPLE_RATE)
+    overlap = int(overlap_seconds * SAMPLE_RATE)
+    search = chunk // 10
+
+    cuts = [0]
+    while n_samples - cuts[-1] > chunk + search:
+        target = cuts[-1] + chunk
+        cuts.append(find_silence(audio, target - search, target + search))
+    cuts.append(n_samples)
+
+    return [(max(0, core_start - overlap), min(n_samples, core_end + overlap),
+             core_start, core_end)
+            for core_start, core_end in zip(cuts[:-1], cuts[1:])]
+
+
+def split_windows(audio, window_seconds=STREAM_WINDOW_SECONDS):
+    """(start, end) sample indexes of windows of up to window_seconds.
+
+    Each window ends at the quietest point of its last fifth, as in
+    stream_audio, so a 30 s window is a single Whisper segment.
+    """
+    window = int(window_seconds * SAMPLE_RATE)
+    search = window // 5
+    cuts = [0]
+    while len(audio) - cuts[-1] > window:
+        cuts.append(find_silence(audio, cuts[-1] + window - search, cuts[-1] + window))
+    cuts.append(len(audio))
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def stitch_segments(results, windows):
+    """Merge the segments of every window into the absolute timeline.
+
+    A segment belongs to the window whose core holds its midpoint, so text
+    transcribed twice in the overlaps is kept only once.
+    """
+    segments = []
+    for window_segments, (start, _, core_start, core_end) in zip(results, windows):
+        offset = start / SAMPLE_RATE
+        for segment in window_segments:
+            segment = dict(segment,
+                           start=segment['start'] + offset,
+                           end=segment['end'] + offset)
+            middle = (segment['start'] + segment['end']) / 2 * SAMPLE_RATE
+            if core_start <= middle < core_end:
+                segments.append(segment)
+    return {'segments': segments,
+            'text': ''.join(s['text'] for s in segments)}
+
+
+def transcribe_worker(conn, audio, windows, indexes, MODEL, threads):
+    import torch
+    torch.set_num_threads(threads)
+    for index in indexes:
+        start, end = windows[index][:2]
+        transcription = MODEL.transcribe(audio[start:end], **DECODE_OPTIONS)
+        segments = [{'start': s['start'], 'end': s['end'], 'text': s['text']}
+                    for s in transcription['segments']]
+        conn.send((index, segments))
+    conn.close()
+
+
+def transcribe_parallel(audio, MODEL, workers=TRANSCRIBE_WORKERS,
+                        chunk_seconds=None):
+    chunk_seconds = chunk_seconds or CHUNK_SECONDS
+    windows = split_audio(audio, chunk_seconds, CHUNK_OVERLAP_SECONDS)
+    workers = min(workers, len(windows))
+    logging.warning('Transcribing %d windows with %d workers',
+                    len(windows), workers)
+    if workers <= 1:
+        return MODEL.transcribe(audio, **DECODE_OPTIONS)
+
+    # Forked workers share the loaded model and the audio without copying.
+    # Lambda has no /dev/shm, so only Process and Pipe can be used
+    import torch
+    context = multiprocessing.get_context('fork')
+    threads = max(1, torch.get_num_threads() // workers)
+    processes = []
+    for worker in range(workers):
+        parent_conn, child_conn = context.Pipe(duplex=False)
+        process = context.Process(target=transcribe_worker,
+                                  args=(child_conn, audio, windows,
+                                        range(worker, len(windows), workers),
+                                        MODEL, threads))
+        process.start()
+        child_conn.close()
+        processes.append((process, parent_conn))
+
+    results = [None] * len(windows)
+    try:
+        for process, conn in processes:
+            while True:
+                try:
+                    index, segments = conn.recv()
+                except EOFError:
+                    break
+                results[index] = segments
+    finally:
+        for process, _ in processes:
+            process.join()
+
+    if any(r is None for r in results):
+        raise RuntimeError("A transcription worker failed")
+    return stitch_segments(results, windows)
+
+
 def remove_beginning_whitespace(text):
     # Remove space at the beginning
     return text.lstrip()
+
+
+def warm_up(MODEL, seconds=WARMUP_SECONDS):
+    """Run a synthetic tone through the model and return each phase duration.
+
+    The first call of every phase pays for lazy initialisation: the mel
+    filterbank and FFT plan, the oneDNN kernels of the encoder and the
+    decoder, and the first large allocations. The last phase goes through
+    the whole get_transcription path, with everything already initialised.
+    Its synthetic audio is left out of the metrics of the invocation.
+    """
+    import torch
+    import whisper
+
+    timings = {}
+    samples = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    audio = (0.1 * np.sin(2 * np.pi * 440 * samples)).astype(np.float32)
+
+    start = time.perf_counter()
+    mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(audio)),
+                                      MODEL.dims.n_mels).to(MODEL.device)
+    timings['mel'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with torch.no_grad():
+        MODEL.embed_audio(mel[None])
+    timings['encoder'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    options = whisper.DecodingOptions(language=DECODE_OPTIONS.get('language'),
+                                      sample_len=8, fp16=False)
+    with torch.no_grad():
+        whisper.decode(MODEL, mel, options)
+    timings['decoder'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with instrumentation.paused():
+        get_transcription(audio, MODEL, workers=1, vad=False)
+    timings['transcription'] = time.perf_counter() - start
+
+    timings = {phase: round(seconds, 3) for phase, seconds in timings.items()}
+    logging.warning("Warm up timings: %s", timings)
+    return timings
+
+
+# With routing, every job loads the model of its plan instead
+if MODEL_PRELOAD == 'init' and not ROUTE_MODELS:
+    get_loaded_model()
+elif MODEL_PRELOAD == 'background' and not ROUTE_MODELS:
+    load_model_in_background()
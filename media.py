@@ -0,0 +1,32 @@
+"""ffprobe of the media files of every lambda.
+
+probe() runs ffprobe once on a path or URL and returns its JSON, with the
+container under 'format' and every stream under 'streams'. ffprobe only reads
+the headers it needs, so a URL costs a few ranged GETs. The lambdas pick what
+they need from it.
+"""
+import json
+import logging
+import subprocess
+
+
+def probe(source):
+    """ffprobe's JSON of source, empty if it could not be probed."""
+    command = ["ffprobe", "-v", "error", "-print_format", "json",
+               "-show_streams", "-show_format", source]
+    try:
+        output = subprocess.run(command, check=True, capture_output=True, text=True)
+        return json.loads(output.stdout)
+    except (OSError, subprocess.CalledProcessError, ValueError) as e:
+        logging.warning("Media could not be probed: %s", e)
+        return {}
+
+
+def streams(info, codec_type):
+    return [s for s in info.get('streams', []) if s.get('codec_type') == codec_type]
+
+
+def duration(source):
+    """Seconds of source from its headers, None if unknown."""
+    seconds = probe(source).get('format', {}).get('duration')
+    return float(seconds) if seconds else None
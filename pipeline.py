@@ -0,0 +1,160 @@
+"""Subtitle local videos with the three stages chained in one process.
+
+The same functions as the lambdas are used, but nothing goes through S3 on
+the way. The 16 kHz audio is piped from ffmpeg straight into Whisper, the
+subtitles are written next to the outputs and burned from there. Only the
+final text, SRT and subtitled video are written to --output and, with
+--bucket, uploaded with the keys the lambdas use.
+
+Videos are processed by --workers forked processes that share the model
+loaded by lambda_transcriptor (the 'model' environment variable, as in the
+lambda), each with its share of the CPUs.
+
+    python pipeline.py videos/ --output subtitled/ --workers 2
+    python pipeline.py video.mp4 --bucket my-bucket --mode soft
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import cpus
+import lambda_add_subtitles
+import lambda_extract_audio
+import s3_io
+
+
+VIDEO_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.mkv', '.webm', '.avi')
+
+
+def find_videos(paths):
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            videos += sorted(os.path.join(path, name) for name in os.listdir(path)
+                             if os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS)
+        else:
+            videos.append(path)
+    return videos
+
+
+def read_audio(video_file):
+    """16 kHz mono float32 samples of the audio of video_file, through a pipe."""
+    command = ['ffmpeg', '-loglevel', 'error', '-i', video_file,
+               *lambda_extract_audio.AUDIO_FORMATS['pcm'], 'pipe:1']
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE).stdout
+    return np.frombuffer(output, np.int16).astype(np.float32) / 32768.0
+
+
+def process_video(video_file, output_dir, mode='burn',
+                  profile=lambda_add_subtitles.ENCODING_PROFILE, bucket=None):
+    """Extract, transcribe and subtitle video_file. Returns the stage timings."""
+    import lambda_transcriptor
+
+    name, extension = os.path.splitext(os.path.basename(video_file))
+    timings = {}
+
+    start = time.perf_counter()
+    audio = read_audio(video_file)
+    timings['extract_audio'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    transcription = lambda_transcriptor.get_transcription(
+        audio, lambda_transcriptor.get_loaded_model())
+    timings['transcription'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    text_file = lambda_transcriptor.save_text(
+        transcription['text'], os.path.join(output_dir, f"{name}.txt"))
+    srt_file = lambda_transcriptor.save_transcription(
+        transcription['segments'], os.path.join(output_dir, f"{name}.srt"))
+    timings['save_transcription'] = time.perf_counter() - start
+
+    # Absolute paths, so the lambda's tmp_folder is not used
+    start = time.perf_counter()
+    output_file = os.path.abspath(os.path.join(output_dir, f"{name}_sub{extension}"))
+    if mode == 'soft':
+        lambda_add_subtitles.mux_subtitles(os.path.abspath(video_file),
+                                           os.path.abspath(srt_file), output_file)
+    else:
+        lambda_add_subtitles.add_subtitles(os.path.abspath(video_file),
+                                           os.path.abspath(srt_file), output_file,
+                                           profile)
+    timings['add_subtitles'] = time.perf_counter() - start
+
+    outputs = {'text': text_file, 'subtitles': srt_file, 'video': output_file}
+    if bucket is not None:
+        start = time.perf_counter()
+        keys = {'text': f"processed/text/{name}.txt",
+                'subtitles': f"processed/srt/{name}.srt",
+                'video': f"video_sub/{name}_sub{extension}"}
+        for output, key in keys.items():
+            lambda_add_subtitles.s3.upload_file(outputs[output], bucket, key,
+                                                Config=s3_io.TRANSFER_CONFIG)
+        outputs = keys
+        timings['upload'] = time.perf_counter() - start
+
+    return {'video': video_file,
+            'audio_seconds': round(len(audio) / lambda_transcriptor.SAMPLE_RATE, 3),
+            'outputs': outputs,
+            'seconds': {stage: round(seconds, 3) for stage, seconds in timings.items()}}
+
+
+def init_worker(threads):
+    import torch
+    torch.set_num_threads(threads)
+
+
+def safe_process_video(video_file, *args, **kwargs):
+    try:
+        return process_video(video_file, *args, **kwargs)
+    except Exception as e:
+        logging.error("Video %s failed, %s", video_file, str(e))
+        return {'video': video_file, 'error': str(e)}
+
+
+def process_videos(videos, output_dir, workers=1, **options):
+    """Process videos with workers processes, results in the same order."""
+    os.makedirs(output_dir, exist_ok=True)
+    # Loaded before forking, so every worker shares the same weights
+    import lambda_transcriptor
+    lambda_transcriptor.get_loaded_model()
+
+    if workers <= 1 or len(videos) <= 1:
+        return [safe_process_video(video, output_dir, **options) for video in videos]
+    threads = max(1, cpus.available() // workers)
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context('fork'),
+                             initializer=init_worker, initargs=(threads,)) as executor:
+        futures = [executor.submit(safe_process_video, video, output_dir, **options)
+                   for video in videos]
+        return [future.result() for future in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('inputs', nargs='+', help='Videos or folders of videos')
+    parser.add_argument('--output', default='subtitled',
+                        help='Folder for the text, SRT and subtitled video')
+    parser.add_argument('--bucket', help='Also upload the outputs to this bucket')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Videos processed at the same time')
+    parser.add_argument('--mode', choices=['burn', 'soft'], default='burn')
+    parser.add_argument('--profile', choices=list(lambda_add_subtitles.ENCODING_PROFILES),
+                        default=lambda_add_subtitles.ENCODING_PROFILE)
+    args = parser.parse_args()
+
+    results = process_videos(find_videos(args.inputs), args.output, args.workers,
+                             mode=args.mode, profile=args.profile, bucket=args.bucket)
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Drain an SQS queue of transcription jobs into batched transcriptor calls.
+
+Every message body is a job, {"IID": ..., "audio": ...}. Messages are grouped
+until there are batch_size of them, or batch_window_seconds have passed since
+the first one arrived. Each batch is sent to the transcriptor as one 'jobs'
+event. Messages are deleted once the transcriptor has answered, since the
+errors of single jobs are already in their status manifests. When the whole
+invocation fails, the messages are left in the queue to be retried.
+
+    python queue_driver.py --queue-url URL                # invoke the lambda
+    python queue_driver.py --queue-url URL --local        # run it in-process
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import time
+
+import s3_io
+
+
+QUEUE_URL = os.environ.get('queue_url')
+BATCH_SIZE = int(os.environ.get('batch_size', 8))
+BATCH_WINDOW_SECONDS = float(os.environ.get('batch_window_seconds', 2))
+TRANSCRIPTOR_FUNCTION = os.environ.get('transcriptor_function', 'transcriptor-lambda')
+
+
+def collect_batch(sqs, queue_url, batch_size=BATCH_SIZE,
+                  window_seconds=BATCH_WINDOW_SECONDS, wait_seconds=20):
+    """Receive up to batch_size messages within window_seconds of the first one.
+
+    Waits up to wait_seconds for the first message, and returns an empty list
+    when the queue stays empty.
+    """
+    messages = []
+    deadline = None
+    while len(messages) < batch_size:
+        if deadline is None:
+            wait = wait_seconds
+        else:
+            wait = math.ceil(max(0.0, deadline - time.monotonic()))
+        response = sqs.receive_message(
+            QueueUrl=queue_url,
+            MaxNumberOfMessages=min(10, batch_size - len(messages)),
+            WaitTimeSeconds=min(20, int(wait)))
+        received = response.get('Messages', [])
+        if received and deadline is None:
+            deadline = time.monotonic() + window_seconds
+        messages.extend(received)
+        # Past the window, only the messages already waiting are added
+        if not received and (deadline is None or wait == 0):
+            break
+    return messages
+
+
+def run_batch(sqs, queue_url, messages, handler):
+    jobs = []
+    for message in messages:
+        try:
+            jobs.append(json.loads(message['Body']))
+        except ValueError:
+            logging.error("Message %s is not a JSON job", message['MessageId'])
+            jobs.append(None)
+
+    response = handler({'body': {'jobs': jobs}}, None)
+    logging.warning("Batch of %d jobs: %s", len(jobs),
+                    [job.get('statusCode') for job in response['body']['jobs']])
+
+    for first in range(0, len(messages), 10):
+        sqs.delete_message_batch(
+            QueueUrl=queue_url,
+            Entries=[{'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']}
+                     for i, message in enumerate(messages[first:first + 10])])
+    return response
+
+
+def drain(sqs, queue_url, handler, batch_size=BATCH_SIZE,
+          window_seconds=BATCH_WINDOW_SECONDS, wait_seconds=20):
+    """Process batches until the queue is empty. Returns the number of jobs."""
+    n_jobs = 0
+    while True:
+        messages = collect_batch(sqs, queue_url, batch_size, window_seconds,
+                                 wait_seconds)
+        if not messages:
+            return n_jobs
+        try:
+            run_batch(sqs, queue_url, messages, handler)
+            n_jobs += len(messages)
+        except Exception as e:
+            # They become visible again after the visibility timeout
+            logging.error("Batch of %d jobs failed, %s", len(messages), str(e))
+
+
+def invoke_transcriptor(event, context, function_name=TRANSCRIPTOR_FUNCTION):
+    client = s3_io.client('lambda')
+    response = client.invoke(FunctionName=function_name,
+                             InvocationType='RequestResponse',
+                             Payload=json.dumps(event))
+    if response.get('FunctionError'):
+        raise RuntimeError(response['Payload'].read().decode())
+    return json.loads(response['Payload'].read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--queue-url', default=QUEUE_URL, required=QUEUE_URL is None)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--window', type=float, default=BATCH_WINDOW_SECONDS,
+                        help='Seconds to wait for a batch to fill up')
+    parser.add_argument('--wait', type=int, default=20,
+                        help='Seconds to wait for the first message of a batch')
+    parser.add_argument('--local', action='store_true',
+                        help='Run lambda_transcriptor in this process')
+    args = parser.parse_args()
+
+    handler = invoke_transcriptor
+    if args.local:
+        import lambda_transcriptor
+        handler = lambda_transcriptor.lambda_handler
+    n_jobs = drain(s3_io.client('sqs'), args.queue_url, handler,
+                   args.batch_size, args.window, args.wait)
+    logging.warning("Queue drained, %d jobs processed", n_jobs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""AWS clients and S3 transfer settings shared by the lambdas.
+
+Clients are created once per process (and region) and reused by every
+invocation, with a connection pool large enough for the parallel parts of a
+multipart transfer. TRANSFER_CONFIG is passed to every download_file,
+upload_file and upload_fileobj call.
+"""
+import os
+import threading
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+MB = 1024 * 1024
+
+MAX_POOL_CONNECTIONS = int(os.environ.get('s3_max_pool_connections', 32))
+# Part size of multipart transfers, files under it go in a single request
+CHUNK_MB = int(os.environ.get('s3_chunk_mb', 16))
+# Fraction of the function memory the parts in flight may take
+TRANSFER_MEMORY_FRACTION = float(os.environ.get('s3_transfer_memory_fraction', 0.125))
+
+CLIENT_CONFIG = Config(max_pool_connections=MAX_POOL_CONNECTIONS,
+                       tcp_keepalive=True,
+                       retries={'max_attempts': 5, 'mode': 'standard'})
+
+
+def max_concurrency(memory_mb=None, chunk_mb=CHUNK_MB):
+    """Parts transferred at once, so that their buffers fit in the memory budget."""
+    if 's3_max_concurrency' in os.environ:
+        return int(os.environ['s3_max_concurrency'])
+    if memory_mb is None:
+        memory_mb = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', 2048))
+    budget = int(memory_mb * TRANSFER_MEMORY_FRACTION / chunk_mb)
+    return max(2, min(MAX_POOL_CONNECTIONS, budget))
+
+
+def transfer_config(memory_mb=None, chunk_mb=CHUNK_MB):
+    return TransferConfig(multipart_threshold=chunk_mb * MB,
+                          multipart_chunksize=chunk_mb * MB,
+                          max_concurrency=max_concurrency(memory_mb, chunk_mb),
+                          use_threads=True)
+
+
+TRANSFER_CONFIG = transfer_config()
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def client(service='s3', region_name=None):
+    """The client of service for this process, created on first use."""
+    key = (service, region_name)
+    with _lock:
+        if key not in _clients:
+            _clients[key] = boto3.client(service, region_name=region_name,
+                                         config=CLIENT_CONFIG)
+        return _clients[key]
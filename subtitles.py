@@ -0,0 +1,82 @@
+"""SRT and WebVTT documents of Whisper segments, built in one pass.
+
+The timestamps of all the segments are computed at once with NumPy, in
+integer milliseconds, and written as fixed-width ASCII. The document is then
+formatted with a single call and returned as a string, ready to be encoded
+and uploaded from memory.
+"""
+import numpy as np
+
+# Separator of the milliseconds in each format
+SEPARATORS = {'srt': ',', 'vtt': '.'}
+CONTENT_TYPES = {'srt': 'application/x-subrip; charset=utf-8',
+                 'vtt': 'text/vtt; charset=utf-8'}
+
+
+def milliseconds(seconds):
+    """seconds rounded to integer milliseconds, negative times clipped to 0."""
+    seconds = np.asarray(seconds, dtype=np.float64)
+    return np.maximum(np.rint(seconds * 1000), 0).astype(np.int64)
+
+
+def timestamp_bytes(seconds, separator=','):
+    """(n, width) uint8 array with the ASCII 'HH:MM:SS,mmm' of every time.
+
+    Hours take two digits, or more when a time is over 99 hours, so every row
+    has the same width.
+    """
+    hours, ms = np.divmod(milliseconds(seconds), 3600000)
+    minutes, ms = np.divmod(ms, 60000)
+    secs, ms = np.divmod(ms, 1000)
+    hour_digits = max(2, len(str(int(hours.max())))) if len(hours) else 2
+
+    stamps = np.empty((len(ms), hour_digits + 10), dtype=np.uint8)
+    column = 0
+    for values, digits in ((hours, hour_digits), (minutes, 2), (secs, 2), (ms, 3)):
+        for digit in range(digits):
+            stamps[:, column + digits - 1 - digit] = values // 10 ** digit % 10
+        column += digits + 1
+    stamps += ord('0')
+    stamps[:, hour_digits] = stamps[:, hour_digits + 3] = ord(':')
+    stamps[:, hour_digits + 6] = ord(separator)
+    return stamps
+
+
+def timestamps(seconds, separator=','):
+    """List of 'HH:MM:SS,mmm' strings of seconds."""
+    stamps = timestamp_bytes(seconds, separator)
+    return stamps.view(f'S{stamps.shape[1]}').ravel().astype(str).tolist()
+
+
+def timing_lines(start, end, separator=','):
+    """List of 'start --> end' lines, built in a single array."""
+    n = len(start)
+    stamps = timestamp_bytes(np.concatenate([start, end]), separator)
+    width = stamps.shape[1]
+    lines = np.empty((n, 2 * width + 5), dtype=np.uint8)
+    lines[:, :width] = stamps[:n]
+    lines[:, width:width + 5] = np.frombuffer(b' --> ', dtype=np.uint8)
+    lines[:, width + 5:] = stamps[n:]
+    return lines.view(f'S{lines.shape[1]}').ravel().astype(str).tolist()
+
+
+def serialize(segments, format='srt', first_index=1):
+    """SRT or WebVTT ('vtt') document of segments, dicts with start, end and text.
+
+    SRT cues are numbered from first_index, to continue a document.
+    """
+    n = len(segments)
+    start = np.fromiter((segment['start'] for segment in segments),
+                        dtype=np.float64, count=n)
+    end = np.fromiter((segment['end'] for segment in segments),
+                      dtype=np.float64, count=n)
+    lines = timing_lines(start, end, SEPARATORS[format])
+    texts = [segment['text'] for segment in segments]
+    if format == 'vtt':
+        fields = [None] * (2 * n)
+        fields[0::2], fields[1::2] = lines, texts
+        return 'WEBVTT\n\n' + ('%s\n%s\n\n' * n) % tuple(fields)
+    fields = [None] * (3 * n)
+    fields[0::3] = range(first_index, first_index + n)
+    fields[1::3], fields[2::3] = lines, texts
+    return ('%d\n%s\n%s\n\n' * n) % tuple(fields)
@@ -1,4 +1,8 @@
 import unittest
+import contextlib
+import shutil
+import subprocess
+import tempfile
 from unittest.mock import patch
 import json
 import os
@@ -7,8 +11,21 @@ from moto import mock_aws
 
 
 import lambda_add_subtitles
+import s3_io
+
+REQUEST_FOLDER = os.path.join('/tmp', 'requests', 'test')
+
+
+def request_folder(name):
+    return contextlib.nullcontext(REQUEST_FOLDER)
+
+
+def head_object(Bucket, Key):
+    return {'ContentLength': 1024}
+
 
 class TestSubtitleLambdaHandler(unittest.TestCase):
+    @patch('workspace.request_folder', request_folder)
     @mock_aws
     @patch('lambda_add_subtitles.add_subtitles')
     @patch('os.path.join', side_effect=os.path.join)
@@ -56,15 +73,17 @@ class TestSubtitleLambdaHandler(unittest.TestCase):
                     
                     # Verify the expected calls
                     mock_add_subtitles.assert_called_once_with(
-                        'test_video.mp4', 
-                        'test_video.srt', 
-                        'test_video_sub.mp4'
+                        os.path.join(REQUEST_FOLDER, 'test_video.mp4'),
+                        os.path.join(REQUEST_FOLDER, 'test_video.srt'),
+                        os.path.join(REQUEST_FOLDER, 'test_video_sub.mp4'),
+                        'balanced'
                     )
                     
                     mock_upload.assert_called_once_with(
-                        os.path.join('/tmp', 'test_video_sub.mp4'),
+                        os.path.join(REQUEST_FOLDER, 'test_video_sub.mp4'),
                         bucket_name,
-                        'video_sub/test_video_sub.mp4'
+                        'video_sub/test_video_sub.mp4',
+                        Config=s3_io.TRANSFER_CONFIG
                     )
                     
                     mock_url.assert_called_once_with(
@@ -72,6 +91,7 @@ class TestSubtitleLambdaHandler(unittest.TestCase):
                         Params={"Bucket": bucket_name, "Key": 'video_sub/test_video_sub.mp4'}
                     )
 
+    @patch('workspace.request_folder', request_folder)
     @mock_aws
     @patch('lambda_add_subtitles.add_subtitles')
     @patch('os.path.join', side_effect=os.path.join)
@@ -121,6 +141,7 @@ class TestSubtitleLambdaHandler(unittest.TestCase):
                     mock_upload.assert_called_once()
                     mock_url.assert_called_once()
 
+    @patch('workspace.request_folder', request_folder)
     @mock_aws
     @patch('lambda_add_subtitles.add_subtitles')
     @patch('os.path.join', side_effect=os.path.join)
@@ -170,6 +191,7 @@ class TestSubtitleLambdaHandler(unittest.TestCase):
                         mock_add_subtitles.assert_called_once()
                         mock_upload.assert_called_once()
 
+    @patch('lambda_add_subtitles.s3.head_object', head_object)
     def test_download_file(self):
         with mock_aws():
             # Setup S3 bucket and file
@@ -196,10 +218,12 @@ class TestSubtitleLambdaHandler(unittest.TestCase):
                 mock_download.assert_called_once_with(
                     bucket_name, 
                     'videos/test_file.mp4', 
-                    os.path.join('/tmp', 'test_file.mp4')
+                    os.path.join('/tmp', 'test_file.mp4'),
+                    Config=s3_io.TRANSFER_CONFIG
                 )
 
-    def test_add_subtitles(self):
+    @patch('lambda_add_subtitles.probe_video', return_value={})
+    def test_add_subtitles(self, mock_probe_video):
         video_file = 'test_video.mp4'
         subtitle_file = 'test_subtitle.srt'
         output_file = 'test_video_sub.mp4'
@@ -223,7 +247,265 @@ class TestSubtitleLambdaHandler(unittest.TestCase):
             self.assertEqual(args[3], os.path.join('/tmp', video_file))
             self.assertEqual(args[4], '-vf')
             self.assertTrue(f'subtitles={os.path.join("/tmp", subtitle_file)}' in args[5])
-            self.assertEqual(args[6], os.path.join('/tmp', output_file))
+            self.assertEqual(args[-1], os.path.join('/tmp', output_file))
+
+    @patch('workspace.request_folder', request_folder)
+    @patch('lambda_add_subtitles.mux_subtitles')
+    @patch('lambda_add_subtitles.add_subtitles')
+    @patch('os.makedirs')
+    def test_lambda_handler_soft_mode(self, mock_makedirs, mock_add_subtitles, mock_mux_subtitles):
+        mock_mux_subtitles.return_value = 'clip_sub.mkv'
+        
+        with patch('lambda_add_subtitles.download_file', side_effect=['clip.mkv', 'clip.srt']), \
+                patch('lambda_add_subtitles.s3.upload_file'), \
+                patch('lambda_add_subtitles.s3.generate_presigned_url') as mock_url:
+            mock_url.return_value = 'https://fake-presigned-url.com/video'
+            event = {
+                'body': {
+                    'video': {'key': 'videos/clip.mkv'},
+                    'srt': {'key': 'subtitles/clip.srt'},
+                    'mode': 'soft'
+                }
+            }
+            
+            response = lambda_add_subtitles.lambda_handler(event, {})
+        
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(response['body']['key'], 'video_sub/clip_sub.mkv')
+        mock_mux_subtitles.assert_called_once_with(
+            *(os.path.join(REQUEST_FOLDER, f) for f in ('clip.mkv', 'clip.srt', 'clip_sub.mkv')))
+        mock_add_subtitles.assert_not_called()
+
+    @patch('lambda_add_subtitles.download_file')
+    def test_lambda_handler_soft_mode_unsupported_container(self, mock_download_file):
+        event = {
+            'body': {
+                'video': {'key': 'videos/clip.avi'},
+                'srt': {'key': 'subtitles/clip.srt'},
+                'mode': 'soft'
+            }
+        }
+        
+        response = lambda_add_subtitles.lambda_handler(event, {})
+        
+        self.assertEqual(response['statusCode'], 400)
+        mock_download_file.assert_not_called()
+
+    def test_mux_subtitles(self):
+        for extension, codec in [('.mp4', 'mov_text'), ('.MOV', 'mov_text'),
+                                 ('.mkv', 'srt'), ('.webm', 'webvtt')]:
+            with patch('subprocess.run') as mock_subprocess:
+                result = lambda_add_subtitles.mux_subtitles(
+                    'video' + extension, 'video.srt', 'video_sub' + extension)
+            
+            self.assertEqual(result, 'video_sub' + extension)
+            args = mock_subprocess.call_args[0][0]
+            self.assertEqual(args[args.index('-c') + 1], 'copy')
+            self.assertEqual(args[args.index('-c:s') + 1], codec)
+            self.assertNotIn('-vf', args)
+            self.assertEqual(args[-1], os.path.join('/tmp', 'video_sub' + extension))
+
+
+SRT = """1
+00:00:00,500 --> 00:00:04,500
+Uno
+
+2
+00:00:09,000 --> 00:00:11,000
+Cruza el
+corte
+
+3
+00:00:18,000 --> 00:00:19,500
+Final
+
+"""
+
+
+class TestParallelBurnIn(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        with open(os.path.join(self.folder, 'video.srt'), 'w') as f:
+            f.write(SRT)
+
+    def test_parse_and_write_srt(self):
+        srt_file = os.path.join(self.folder, 'video.srt')
+        cues = lambda_add_subtitles.parse_srt(srt_file)
+        self.assertEqual(cues, [(0.5, 4.5, 'Uno'),
+                                (9.0, 11.0, 'Cruza el\ncorte'),
+                                (18.0, 19.5, 'Final')])
+        
+        copy_file = os.path.join(self.folder, 'copy.srt')
+        lambda_add_subtitles.write_srt(cues, copy_file)
+        with open(copy_file) as f:
+            self.assertEqual(f.read(), SRT)
+
+    def test_write_srt_rounds_to_milliseconds(self):
+        srt_file = os.path.join(self.folder, 'rounded.srt')
+        lambda_add_subtitles.write_srt([(3723.005, 3723.5, 'a'), (59.9996, 61, 'b')],
+                                       srt_file)
+        with open(srt_file) as f:
+            self.assertEqual(f.read(), "1\n01:02:03,005 --> 01:02:03,500\na\n\n"
+                                       "2\n00:01:00,000 --> 00:01:01,000\nb\n\n")
+
+    def test_slice_cues(self):
+        cues = lambda_add_subtitles.parse_srt(os.path.join(self.folder, 'video.srt'))
+        self.assertEqual(lambda_add_subtitles.slice_cues(cues, 4.0, 10.0),
+                         [(0.0, 0.5, 'Uno'), (5.0, 6.0, 'Cruza el\ncorte')])
+        self.assertEqual(lambda_add_subtitles.slice_cues(cues, 12.0, 16.0), [])
+
+    def test_add_subtitles_parallel(self):
+        segments_folder = os.path.join(self.folder, 'video_sub_segments')
+        segments = [(os.path.join(segments_folder, f'segment_{i:04}.mp4'), start, end)
+                    for i, (start, end) in enumerate([(0, 8), (8, 14), (14, 20)])]
+        
+        with patch.object(lambda_add_subtitles, 'tmp_folder', self.folder), \
+                patch('lambda_add_subtitles.probe_video', return_value={}), \
+                patch('lambda_add_subtitles.split_video', return_value=segments), \
+                patch('subprocess.run') as mock_subprocess:
+            result = lambda_add_subtitles.add_subtitles_parallel(
+                'video.mp4', 'video.srt', 'video_sub.mp4', workers=2)
+        
+        self.assertEqual(result, 'video_sub.mp4')
+        commands = [c[0][0] for c in mock_subprocess.call_args_list]
+        burn_commands = sorted(commands[:-1])
+        self.assertEqual(len(burn_commands), 3)
+        for command, (segment_path, _, _) in zip(burn_commands, segments):
+            self.assertEqual(command[command.index('-i') + 1], segment_path)
+            self.assertIn('-an', command)
+        # The segment between 14 and 20 seconds holds only part of a cue
+        self.assertIn('-vf', burn_commands[2])
+        
+        concat_command = commands[-1]
+        self.assertEqual(concat_command[concat_command.index('-f') + 1], 'concat')
+        self.assertIn(os.path.join(self.folder, 'video.mp4'), concat_command)
+        self.assertEqual(concat_command[-1], os.path.join(self.folder, 'video_sub.mp4'))
+        self.assertFalse(os.path.exists(segments_folder))
+
+    @patch('workspace.request_folder', request_folder)
+    @patch('lambda_add_subtitles.add_subtitles_parallel')
+    @patch('lambda_add_subtitles.add_subtitles')
+    def test_lambda_handler_uses_parallel_burn_in(self, mock_add_subtitles, mock_parallel):
+        mock_parallel.return_value = 'clip_sub.mp4'
+        event = {'body': {'video': {'key': 'videos/clip.mp4'},
+                          'srt': {'key': 'subtitles/clip.srt'}}}
+        
+        with patch.object(lambda_add_subtitles, 'BURN_WORKERS', 4), \
+                patch('lambda_add_subtitles.download_file', side_effect=['clip.mp4', 'clip.srt']), \
+                patch('lambda_add_subtitles.s3.upload_file'), \
+                patch('lambda_add_subtitles.s3.generate_presigned_url'), \
+                patch('os.makedirs'):
+            response = lambda_add_subtitles.lambda_handler(event, {})
+        
+        self.assertEqual(response['statusCode'], 200)
+        mock_parallel.assert_called_once_with(
+            *(os.path.join(REQUEST_FOLDER, f) for f in ('clip.mp4', 'clip.srt', 'clip_sub.mp4')),
+            profile='balanced')
+        mock_add_subtitles.assert_not_called()
+
+    @unittest.skipUnless(shutil.which('ffmpeg'), 'ffmpeg is not installed')
+    def test_add_subtitles_parallel_with_ffmpeg(self):
+        video_path = os.path.join(self.folder, 'video.mp4')
+        subprocess.run(['ffmpeg', '-loglevel', 'error', '-y',
+                        '-f', 'lavfi', '-i', 'testsrc2=size=160x120:rate=25',
+                        '-f', 'lavfi', '-i', 'sine=frequency=440',
+                        '-t', '20', '-g', '50', '-shortest', video_path],
+                       check=True)
+        
+        with patch.object(lambda_add_subtitles, 'tmp_folder', self.folder):
+            lambda_add_subtitles.add_subtitles_parallel(
+                'video.mp4', 'video.srt', 'video_sub.mp4', workers=2,
+                segment_seconds=5)
+        
+        probe = subprocess.run(['ffmpeg', '-i', os.path.join(self.folder, 'video_sub.mp4')],
+                               capture_output=True, text=True)
+        self.assertIn('Duration: 00:00:20.0', probe.stderr)
+        self.assertIn('Audio', probe.stderr)
+
+
+FFPROBE_OUTPUT = json.dumps({
+    'streams': [{'codec_type': 'video', 'width': 1280, 'height': 720},
+                {'codec_type': 'audio', 'bit_rate': '128000'}],
+    'format': {'bit_rate': '2128000'}
+})
+
+
+class TestEncodingProfiles(unittest.TestCase):
+    def test_probe_video(self):
+        with patch('subprocess.run') as mock_subprocess:
+            mock_subprocess.return_value.stdout = FFPROBE_OUTPUT
+            info = lambda_add_subtitles.probe_video('/tmp/video.mkv')
+        
+        self.assertEqual(mock_subprocess.call_args[0][0][0], 'ffprobe')
+        self.assertEqual(info, {'width': 1280, 'height': 720, 'bitrate': 2000000})
+
+    def test_probe_video_without_ffprobe(self):
+        with patch('subprocess.run', side_effect=FileNotFoundError('ffprobe')):
+            self.assertEqual(lambda_add_subtitles.probe_video('/tmp/video.mp4'), {})
+
+    def test_encoder_args(self):
+        args = lambda_add_subtitles.encoder_args('fast', {'bitrate': 2000000}, 4)
+        self.assertEqual(args, ['-c:v', 'libx264', '-preset', 'veryfast',
+                                '-crf', '26', '-threads', '4',
+                                '-maxrate', '2000000', '-bufsize', '4000000'])
+        args = lambda_add_subtitles.encoder_args('quality', {}, 1)
+        self.assertEqual(args[args.index('-preset') + 1], 'slow')
+        self.assertNotIn('-maxrate', args)
+
+    def test_webm_is_encoded_with_vp9(self):
+        args = lambda_add_subtitles.encoder_args('fast', {'bitrate': 2000000}, 4, '.WEBM')
+        self.assertEqual(args[args.index('-c:v') + 1], 'libvpx-vp9')
+        self.assertEqual(args[args.index('-crf') + 1], '36')
+        self.assertEqual(args[args.index('-b:v') + 1], '2000000')
+        args = lambda_add_subtitles.encoder_args('quality', {}, 1, '.webm')
+        self.assertEqual(args[args.index('-b:v') + 1], '0')
+
+    @unittest.skipUnless(shutil.which('ffmpeg'), 'ffmpeg is not installed')
+    def test_burn_webm_with_ffmpeg(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        with open(os.path.join(folder, 'video.srt'), 'w') as f:
+            f.write(SRT)
+        subprocess.run(['ffmpeg', '-loglevel', 'error', '-y',
+                        '-f', 'lavfi', '-i', 'testsrc2=size=160x120:rate=10',
+                        '-f', 'lavfi', '-i', 'sine=frequency=440',
+                        '-t', '4', '-c:v', 'libvpx-vp9', '-c:a', 'libopus', '-shortest',
+                        os.path.join(folder, 'video.webm')], check=True)
+
+        with patch.object(lambda_add_subtitles, 'tmp_folder', folder):
+            lambda_add_subtitles.add_subtitles('video.webm', 'video.srt',
+                                               'video_sub.webm', 'fast')
+
+        probe = subprocess.run(['ffmpeg', '-i', os.path.join(folder, 'video_sub.webm')],
+                               capture_output=True, text=True)
+        self.assertIn('Video: vp9', probe.stderr)
+
+    @patch('lambda_add_subtitles.cpu_count', return_value=6)
+    @patch('lambda_add_subtitles.probe_video', return_value={'bitrate': 1000000})
+    def test_add_subtitles_with_profile(self, mock_probe_video, mock_cpu_count):
+        with patch('subprocess.run') as mock_subprocess:
+            lambda_add_subtitles.add_subtitles('video.mp4', 'video.srt',
+                                               'video_sub.mp4', 'quality')
+        
+        args = mock_subprocess.call_args[0][0]
+        self.assertEqual(args[args.index('-preset') + 1], 'slow')
+        self.assertEqual(args[args.index('-crf') + 1], '20')
+        self.assertEqual(args[args.index('-threads') + 1], '6')
+        self.assertEqual(args[args.index('-maxrate') + 1], '1000000')
+        self.assertEqual(args[args.index('-c:a') + 1], 'copy')
+        mock_probe_video.assert_called_once_with(os.path.join('/tmp', 'video.mp4'))
+
+    @patch('lambda_add_subtitles.download_file')
+    def test_lambda_handler_with_unknown_profile(self, mock_download_file):
+        event = {'body': {'video': {'key': 'videos/clip.mp4'},
+                          'srt': {'key': 'subtitles/clip.srt'},
+                          'profile': 'ultra'}}
+        
+        response = lambda_add_subtitles.lambda_handler(event, {})
+        
+        self.assertEqual(response['statusCode'], 400)
+        mock_download_file.assert_not_called()
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
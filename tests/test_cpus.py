@@ -0,0 +1,113 @@
+import unittest
+from unittest.mock import patch
+import json
+import os
+import shutil
+import tempfile
+
+import cpus
+
+
+class TestQuota(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def write(self, path, content):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_cgroup_v2(self):
+        self.write('cpu.max', '200000 100000\n')
+        self.assertEqual(cpus.quota(self.root), 2.0)
+
+    def test_cgroup_v1(self):
+        self.write('cpu/cpu.cfs_quota_us', '150000\n')
+        self.write('cpu/cpu.cfs_period_us', '100000\n')
+        self.assertEqual(cpus.quota(self.root), 1.5)
+
+    def test_no_quota(self):
+        self.write('cpu.max', 'max 100000\n')
+        self.assertIsNone(cpus.quota(self.root))
+        self.assertIsNone(cpus.quota(os.path.join(self.root, 'missing')))
+
+
+@patch.dict(os.environ, clear=True)
+@patch('cpus.affinity', return_value=list(range(8)))
+class TestThreadSettings(unittest.TestCase):
+    def test_quota_caps_the_affinity(self, mock_affinity):
+        with patch('cpus.quota', return_value=2.0):
+            self.assertEqual(cpus.available(), 2)
+            self.assertEqual(cpus.thread_settings(),
+                             {'threads': 2, 'interop_threads': 1})
+        with patch('cpus.quota', return_value=None):
+            self.assertEqual(cpus.available(), 8)
+
+    @patch('cpus.quota', return_value=4.0)
+    def test_decode_cpus_are_set_apart(self, mock_quota, mock_affinity):
+        self.assertEqual(cpus.split(1), ([0, 1, 2], [3]))
+        self.assertEqual(cpus.split(0), ([0, 1, 2, 3], [0, 1, 2, 3]))
+        # At least one CPU is left to the inference
+        self.assertEqual(cpus.split(4), ([0, 1, 2, 3], [0, 1, 2, 3]))
+
+    @patch('cpus.quota', return_value=None)
+    def test_tuned_tiers_and_overrides(self, mock_quota, mock_affinity):
+        os.environ['thread_settings'] = json.dumps(
+            {'1769': {'threads': 1, 'interop_threads': 1},
+             '3538': {'threads': 3, 'interop_threads': 2}})
+        self.assertEqual(cpus.thread_settings(memory=1024)['threads'], 8)
+        self.assertEqual(cpus.thread_settings(memory=3008)['threads'], 1)
+        self.assertEqual(cpus.thread_settings(memory=10240),
+                         {'threads': 3, 'interop_threads': 2})
+
+        os.environ['torch_threads'] = '2'
+        self.assertEqual(cpus.thread_settings(memory=10240)['threads'], 2)
+
+    @patch('cpus.quota', return_value=None)
+    def test_invalid_values_fall_back(self, mock_quota, mock_affinity):
+        os.environ.update({'cpus': 'two', 'thread_settings': '{1769: 1}',
+                           'torch_threads': '2.5'})
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(cpus.thread_settings(memory=3008),
+                             {'threads': 8, 'interop_threads': 1})
+
+    @patch('cpus.quota', return_value=None)
+    def test_environment_keeps_explicit_values(self, mock_quota, mock_affinity):
+        os.environ['MKL_NUM_THREADS'] = '1'
+        cpus.configure_environment(4)
+        self.assertEqual(os.environ['OMP_NUM_THREADS'], '4')
+        self.assertEqual(os.environ['MKL_NUM_THREADS'], '1')
+
+
+
+class TestPinning(unittest.TestCase):
+    def test_every_thread_is_pinned(self):
+        task_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, task_dir)
+        for tid in ('100', '101', '102'):
+            os.mkdir(os.path.join(task_dir, tid))
+        with patch('os.sched_setaffinity',
+                   side_effect=[None, ProcessLookupError(), None],
+                   create=True) as mock_setaffinity:
+            cpus.pin_process([0, 1], task_dir)
+        self.assertEqual(sorted(c.args[0] for c in mock_setaffinity.call_args_list),
+                         [100, 101, 102])
+        self.assertTrue(all(c.args[1] == [0, 1] for c in mock_setaffinity.call_args_list))
+
+    def test_subprocess_is_pinned_by_pid(self):
+        with patch('os.sched_setaffinity', create=True) as mock_setaffinity, \
+                patch('os.listdir', return_value=['4321']) as mock_listdir:
+            cpus.pin([3], 4321)
+        mock_listdir.assert_called_once_with('/proc/4321/task')
+        mock_setaffinity.assert_called_once_with(4321, [3])
+
+    def test_without_proc_the_calling_thread_is_pinned(self):
+        with patch('os.sched_setaffinity', create=True) as mock_setaffinity:
+            cpus.pin_process([0], '/nonexistent/task')
+        mock_setaffinity.assert_called_once_with(0, [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
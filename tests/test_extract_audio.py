@@ -1,16 +1,33 @@
 import unittest
 from unittest.mock import patch
+import contextlib
+import io
 import json
 import os
+import subprocess
 import boto3
 from moto import mock_aws
 
 
 import lambda_extract_audio
+import s3_io
+
+REQUEST_FOLDER = os.path.join('/tmp', 'requests', 'test')
+
+
+def request_folder(name):
+    return contextlib.nullcontext(REQUEST_FOLDER)
+
+
+def head_object(Bucket, Key):
+    return {'ContentLength': 1024}
+
 
 class TestLambdaHandler(unittest.TestCase):
     @mock_aws
     @patch('lambda_extract_audio.extract_audio')
+    @patch('workspace.request_folder', request_folder)
+    @patch('lambda_extract_audio.s3.head_object', head_object)
     @patch('os.path.join', side_effect=os.path.join)
     @patch('os.makedirs')
     def test_lambda_handler_with_json_body(self, mock_makedirs, mock_join, mock_extract_audio):
@@ -52,22 +69,26 @@ class TestLambdaHandler(unittest.TestCase):
                 mock_download.assert_called_once_with(
                     bucket_name, 
                     test_video_key, 
-                    os.path.join('/tmp/', 'test_video.mp4')
+                    os.path.join(REQUEST_FOLDER, 'test_video.mp4'),
+                    Config=s3_io.TRANSFER_CONFIG
                 )
                 
                 mock_extract_audio.assert_called_once_with(
-                    os.path.join('/tmp/', 'test_video.mp4'),
-                    os.path.join('/tmp/', 'test_video.mp3')
+                    os.path.join(REQUEST_FOLDER, 'test_video.mp4'),
+                    os.path.join(REQUEST_FOLDER, 'test_video.mp3')
                 )
                 
                 mock_upload.assert_called_once_with(
-                    os.path.join('/tmp/', 'test_video.mp3'),
+                    os.path.join(REQUEST_FOLDER, 'test_video.mp3'),
                     bucket_name,
-                    f'audio/{test_uid}/test_video.mp3'
+                    f'audio/{test_uid}/test_video.mp3',
+                    Config=s3_io.TRANSFER_CONFIG
                 )
 
     @mock_aws
     @patch('lambda_extract_audio.extract_audio')
+    @patch('workspace.request_folder', request_folder)
+    @patch('lambda_extract_audio.s3.head_object', head_object)
     @patch('os.path.join', side_effect=os.path.join)
     @patch('os.makedirs')
     def test_lambda_handler_with_dict_body(self, mock_makedirs, mock_join, mock_extract_audio):
@@ -110,6 +131,8 @@ class TestLambdaHandler(unittest.TestCase):
 
     @mock_aws
     @patch('lambda_extract_audio.extract_audio')
+    @patch('workspace.request_folder', request_folder)
+    @patch('lambda_extract_audio.s3.head_object', head_object)
     @patch('os.path.join', side_effect=os.path.join)
     @patch('os.makedirs')
     def test_lambda_handler_with_default_bucket(self, mock_makedirs, mock_join, mock_extract_audio):
@@ -148,8 +171,187 @@ class TestLambdaHandler(unittest.TestCase):
                 mock_download.assert_called_once_with(
                     default_bucket, 
                     test_video_key, 
-                    os.path.join('/tmp/', 'test_video.mp4')
+                    os.path.join(REQUEST_FOLDER, 'test_video.mp4'),
+                    Config=s3_io.TRANSFER_CONFIG
                 )
+    @mock_aws
+    @patch('lambda_extract_audio.extract_audio')
+    @patch('workspace.request_folder', request_folder)
+    @patch('lambda_extract_audio.s3.head_object', head_object)
+    @patch('os.makedirs')
+    def test_lambda_handler_with_pcm_format(self, mock_makedirs, mock_extract_audio):
+        bucket_name = 'cperalesg-video-subtitler'
+        
+        with patch('lambda_extract_audio.s3.download_file') as mock_download, \
+                patch('lambda_extract_audio.s3.upload_file') as mock_upload:
+            event = {
+                'body': {
+                    'key': 'videos/test_video.mp4',
+                    'uid': 'test123',
+                    'format': 'pcm'
+                }
+            }
+            
+            response = lambda_extract_audio.lambda_handler(event, {})
+            
+            self.assertEqual(response['statusCode'], 200)
+            self.assertEqual(response['body']['key'], 'audio/test123/test_video.pcm')
+            mock_extract_audio.assert_called_once_with(
+                os.path.join(REQUEST_FOLDER, 'test_video.mp4'),
+                os.path.join(REQUEST_FOLDER, 'test_video.pcm')
+            )
+            mock_upload.assert_called_once_with(
+                os.path.join(REQUEST_FOLDER, 'test_video.pcm'),
+                bucket_name,
+                'audio/test123/test_video.pcm',
+                Config=s3_io.TRANSFER_CONFIG
+            )
+
+    @patch('lambda_extract_audio.download_video')
+    def test_lambda_handler_with_unknown_format(self, mock_download_video):
+        event = {'body': {'key': 'videos/test_video.mp4', 'format': 'wav'}}
+        
+        response = lambda_extract_audio.lambda_handler(event, {})
+        
+        self.assertEqual(response['statusCode'], 400)
+        mock_download_video.assert_not_called()
+
+    def test_extract_audio_commands(self):
+        with patch('subprocess.run') as mock_subprocess:
+            lambda_extract_audio.extract_audio('video.mp4', 'audio.mp3')
+            lambda_extract_audio.extract_audio('video.mp4', 'audio.pcm')
+        
+        mp3_command = mock_subprocess.call_args_list[0][0][0]
+        self.assertEqual(mp3_command, ['ffmpeg', '-i', 'video.mp4', '-q:a', '0',
+                                       '-map', 'a', '-f', 'mp3', '-y', 'audio.mp3'])
+        pcm_command = mock_subprocess.call_args_list[1][0][0]
+        self.assertEqual(pcm_command[:3], ['ffmpeg', '-i', 'video.mp4'])
+        self.assertEqual(pcm_command[-2:], ['-y', 'audio.pcm'])
+        for option in (['-ac', '1'], ['-ar', '16000'], ['-f', 's16le']):
+            index = pcm_command.index(option[0])
+            self.assertEqual(pcm_command[index:index + 2], option)
+
+    @mock_aws
+    @patch('lambda_extract_audio.download_video')
+    @patch('subprocess.Popen')
+    def test_lambda_handler_streaming(self, mock_popen, mock_download_video):
+        s3_client = boto3.client('s3', region_name='us-east-1')
+        bucket_name = 'cperalesg-video-subtitler'
+        s3_client.create_bucket(Bucket=bucket_name)
+        mock_popen.return_value.stdout = io.BytesIO(b'audio bytes')
+        mock_popen.return_value.wait.return_value = 0
+        
+        event = {
+            'body': {
+                'key': 'videos/test_video.mp4',
+                'uid': 'test123',
+                'stream': True
+            }
+        }
+        with patch('lambda_extract_audio.s3', s3_client):
+            response = lambda_extract_audio.lambda_handler(event, {})
+        
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(response['body']['key'], 'audio/test123/test_video.mp3')
+        mock_download_video.assert_not_called()
+        
+        command = mock_popen.call_args[0][0]
+        self.assertEqual(command[0], 'ffmpeg')
+        self.assertIn('videos/test_video.mp4', command[command.index('-i') + 1])
+        self.assertEqual(command[-3:], ['-f', 'mp3', 'pipe:1'])
+        
+        audio = s3_client.get_object(Bucket=bucket_name,
+                                     Key='audio/test123/test_video.mp3')
+        self.assertEqual(audio['Body'].read(), b'audio bytes')
+
+    @mock_aws
+    @patch('subprocess.Popen')
+    def test_stream_audio_ffmpeg_error(self, mock_popen):
+        s3_client = boto3.client('s3', region_name='us-east-1')
+        bucket_name = 'test-bucket'
+        s3_client.create_bucket(Bucket=bucket_name)
+        mock_popen.return_value.stdout = io.BytesIO(b'partial')
+        mock_popen.return_value.wait.return_value = 1
+        
+        with patch('lambda_extract_audio.s3', s3_client):
+            with self.assertRaises(subprocess.CalledProcessError):
+                lambda_extract_audio.stream_audio(bucket_name, 'videos/test.mp4',
+                                                  'audio/test.mp3')
+        
+        objects = s3_client.list_objects_v2(Bucket=bucket_name)
+        self.assertEqual(objects.get('KeyCount'), 0)
+
+
+FFPROBE_OUTPUT = json.dumps({
+    'streams': [{'codec_type': 'video', 'codec_name': 'h264'},
+                {'codec_type': 'audio', 'codec_name': 'aac'}],
+    'format': {'format_name': 'mov,mp4,m4a,3gp,3g2,mj2', 'duration': '125.5',
+               'size': '2048'}})
+
+
+class TestPreflight(unittest.TestCase):
+    def test_probe_media(self):
+        with patch('subprocess.run') as mock_subprocess:
+            mock_subprocess.return_value.stdout = FFPROBE_OUTPUT
+            metadata = lambda_extract_audio.probe_media('https://bucket/video.mp4')
+
+        self.assertEqual(mock_subprocess.call_args[0][0][0], 'ffprobe')
+        self.assertEqual(metadata, {'duration': 125.5, 'size': 2048,
+                                    'format': 'mov,mp4,m4a,3gp,3g2,mj2',
+                                    'video_codec': 'h264', 'audio_codec': 'aac',
+                                    'audio_streams': 1, 'has_audio': True})
+
+    def test_probe_media_without_ffprobe(self):
+        with patch('subprocess.run', side_effect=FileNotFoundError('ffprobe')):
+            self.assertEqual(lambda_extract_audio.probe_media('video.mp4'), {})
+
+    @patch('lambda_extract_audio.download_video')
+    def test_videos_without_audio_are_rejected(self, mock_download_video):
+        metadata = {'duration': 10.0, 'has_audio': False}
+        event = {'body': {'key': 'videos/test_video.mp4'}}
+        with patch('lambda_extract_audio.preflight', return_value=metadata):
+            response = lambda_extract_audio.lambda_handler(event, {})
+
+        self.assertEqual(response['statusCode'], 400)
+        self.assertEqual(response['body']['metadata'], metadata)
+        mock_download_video.assert_not_called()
+
+    @patch('lambda_extract_audio.download_video')
+    def test_long_videos_are_rejected(self, mock_download_video):
+        metadata = {'duration': 7200.0, 'has_audio': True}
+        event = {'body': {'key': 'videos/test_video.mp4'}}
+        with patch('lambda_extract_audio.preflight', return_value=metadata), \
+                patch.object(lambda_extract_audio, 'MAX_DURATION_SECONDS', 3600):
+            response = lambda_extract_audio.lambda_handler(event, {})
+
+        self.assertEqual(response['statusCode'], 400)
+        mock_download_video.assert_not_called()
+
+    @mock_aws
+    @patch('subprocess.Popen')
+    def test_metadata_is_written_next_to_the_audio(self, mock_popen):
+        s3_client = boto3.client('s3', region_name='us-east-1')
+        bucket_name = 'cperalesg-video-subtitler'
+        s3_client.create_bucket(Bucket=bucket_name)
+        mock_popen.return_value.stdout = io.BytesIO(b'audio bytes')
+        mock_popen.return_value.wait.return_value = 0
+
+        event = {'body': {'key': 'videos/test_video.mp4', 'uid': 'test123',
+                          'stream': True}}
+        with patch('lambda_extract_audio.s3', s3_client), \
+                patch('subprocess.run') as mock_subprocess:
+            mock_subprocess.return_value.stdout = FFPROBE_OUTPUT
+            response = lambda_extract_audio.lambda_handler(event, {})
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(response['body']['metadata']['duration'], 125.5)
+        # ffprobe reads the video from S3, nothing is downloaded first
+        self.assertIn('videos/test_video.mp4', mock_subprocess.call_args[0][0][-1])
+        metadata = s3_client.get_object(Bucket=bucket_name,
+                                        Key='audio/test123/test_video.json')
+        self.assertEqual(json.loads(metadata['Body'].read()),
+                         response['body']['metadata'])
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,6 +1,7 @@
 import unittest
 from unittest.mock import patch, MagicMock
 import json
+import time
 import boto3
 from botocore.exceptions import ClientError
 from moto import mock_aws
@@ -9,8 +10,9 @@ from moto import mock_aws
 import lambda_get_subtitles
 
 class TestTranscriptionLambdaHandler(unittest.TestCase):
-    @patch('lambda_get_subtitles.boto3.client')
-    def test_start_function(self, mock_boto3_client):
+    @patch('lambda_get_subtitles.write_status')
+    @patch('lambda_get_subtitles.s3_io.client')
+    def test_start_function(self, mock_boto3_client, mock_write_status):
         # Setup mock Lambda client
         mock_lambda_client = MagicMock()
         mock_boto3_client.return_value = mock_lambda_client
@@ -38,10 +40,13 @@ class TestTranscriptionLambdaHandler(unittest.TestCase):
             InvocationType='Event',
             Payload=json.dumps(event)
         )
+        mock_write_status.assert_called_once()
+        self.assertEqual(mock_write_status.call_args[0], ('test-bucket', '12345', 'queued'))
     
     @mock_aws
+    @patch('lambda_get_subtitles.get_status', return_value=(None, None, None))
     @patch('lambda_get_subtitles.check_file_exists')
-    def test_poll_function_with_srt_exists(self, mock_check_file_exists):
+    def test_poll_function_with_srt_exists(self, mock_check_file_exists, mock_get_status):
         # Setup mock S3
         s3_client = boto3.client('s3', region_name='us-east-1')
         bucket_name = 'test-bucket'
@@ -90,8 +95,9 @@ class TestTranscriptionLambdaHandler(unittest.TestCase):
             self.assertEqual(mock_url.call_count, 2)
     
     @mock_aws
+    @patch('lambda_get_subtitles.get_status', return_value=(None, None, None))
     @patch('lambda_get_subtitles.check_file_exists')
-    def test_poll_function_with_error_file(self, mock_check_file_exists):
+    def test_poll_function_with_error_file(self, mock_check_file_exists, mock_get_status):
         # Setup mock S3
         s3_client = boto3.client('s3', region_name='us-east-1')
         bucket_name = 'test-bucket'
@@ -128,8 +134,9 @@ class TestTranscriptionLambdaHandler(unittest.TestCase):
         )
     
     @mock_aws
+    @patch('lambda_get_subtitles.get_status', return_value=(None, None, None))
     @patch('lambda_get_subtitles.check_file_exists')
-    def test_poll_function_still_waiting(self, mock_check_file_exists):
+    def test_poll_function_still_waiting(self, mock_check_file_exists, mock_get_status):
         # Setup mock S3
         s3_client = boto3.client('s3', region_name='us-east-1')
         bucket_name = 'test-bucket'
@@ -214,8 +221,9 @@ class TestTranscriptionLambdaHandler(unittest.TestCase):
                     lambda_get_subtitles.check_file_exists(bucket_name, file_key)
     
     @mock_aws
+    @patch('lambda_get_subtitles.get_status', return_value=(None, None, None))
     @patch('lambda_get_subtitles.check_file_exists')
-    def test_poll_function_with_dict_body(self, mock_check_file_exists):
+    def test_poll_function_with_dict_body(self, mock_check_file_exists, mock_get_status):
         # Setup mock S3
         s3_client = boto3.client('s3', region_name='us-east-1')
         bucket_name = 'test-bucket'
@@ -250,5 +258,127 @@ class TestTranscriptionLambdaHandler(unittest.TestCase):
             # Verify check_file_exists call
             mock_check_file_exists.assert_called_once()
 
+
+@mock_aws
+class TestStatusManifest(unittest.TestCase):
+    def setUp(self):
+        self.bucket_name = 'test-bucket'
+        self.s3_client = boto3.client('s3', region_name='us-east-1')
+        self.s3_client.create_bucket(Bucket=self.bucket_name)
+        patcher = patch('lambda_get_subtitles.s3', self.s3_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def put_status(self, iid, state, **fields):
+        status = dict(fields, IID=iid, state=state)
+        self.s3_client.put_object(Bucket=self.bucket_name,
+                                  Key=f'processed/status/{iid}.json',
+                                  Body=json.dumps(status))
+
+    def poll(self, body):
+        event = {'rawPath': '/poll', 'body': json.dumps(dict(body, bucket=self.bucket_name))}
+        return lambda_get_subtitles.lambda_handler(event, {})
+
+    @patch('lambda_get_subtitles.check_file_exists')
+    def test_done_uses_manifest_keys(self, mock_check_file_exists):
+        self.put_status('12345', 'done', progress=1.0,
+                        text={'key': 'processed/text/12345.txt', 'bucket': self.bucket_name},
+                        subtitles={'key': 'processed/srt/12345.srt', 'bucket': self.bucket_name})
+
+        response = self.poll({'IID': '12345'})
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(response['body']['text']['key'], 'processed/text/12345.txt')
+        self.assertIn('processed/srt/12345.srt', response['body']['subtitles']['url'])
+        self.assertEqual(response['body']['status']['progress'], 1.0)
+        mock_check_file_exists.assert_not_called()
+
+    @patch('lambda_get_subtitles.check_file_exists')
+    def test_running_and_error_states(self, mock_check_file_exists):
+        self.put_status('running', 'running', progress=0.25)
+        self.put_status('failed', 'error', error='boom')
+
+        running = self.poll({'IID': 'running'})
+        failed = self.poll({'IID': 'failed'})
+
+        self.assertEqual(running['statusCode'], 202)
+        self.assertEqual(running['body']['status']['progress'], 0.25)
+        self.assertEqual(failed['statusCode'], 500)
+        self.assertEqual(failed['body']['status']['error'], 'boom')
+        mock_check_file_exists.assert_not_called()
+
+    def test_running_with_partial_subtitles(self):
+        self.put_status('12345', 'running', progress=0.4,
+                        partial={'key': 'processed/partial/12345.srt',
+                                 'bucket': self.bucket_name, 'segments': 12})
+
+        response = self.poll({'IID': '12345'})
+
+        self.assertEqual(response['statusCode'], 202)
+        self.assertEqual(response['body']['partial']['segments'], 12)
+        self.assertIn('processed/partial/12345.srt', response['body']['partial']['url'])
+
+    def test_dead_jobs_are_errors(self):
+        self.put_status('queued', 'queued', progress=0.0)
+        self.s3_client.put_object(Bucket=self.bucket_name,
+                                  Key='processed/error/queued.error', Body=b'')
+        self.put_status('killed', 'running', progress=0.5)
+        etag = self.poll({'IID': 'killed'})['body']['etag']
+
+        self.assertEqual(self.poll({'IID': 'queued'})['statusCode'], 500)
+        later = time.time() + lambda_get_subtitles.JOB_TIMEOUT_SECONDS + 1
+        with patch('time.time', return_value=later):
+            self.assertEqual(self.poll({'IID': 'killed'})['statusCode'], 500)
+            # Also when the manifest did not change since the last poll
+            self.assertEqual(self.poll({'IID': 'killed', 'etag': etag})['statusCode'], 500)
+
+    def test_conditional_poll(self):
+        self.put_status('12345', 'running', progress=0.25)
+        etag = self.poll({'IID': '12345'})['body']['etag']
+
+        response = self.poll({'IID': '12345', 'etag': etag})
+        self.assertEqual(response['statusCode'], 304)
+        self.assertEqual(response['body']['etag'], etag)
+
+        self.put_status('12345', 'running', progress=0.5)
+        response = self.poll({'IID': '12345', 'etag': etag})
+        self.assertEqual(response['statusCode'], 202)
+        self.assertNotEqual(response['body']['etag'], etag)
+
+    @patch('lambda_get_subtitles.check_file_exists', return_value=False)
+    def test_batched_poll(self, mock_check_file_exists):
+        self.put_status('a', 'running', progress=0.5)
+        self.put_status('b', 'error')
+
+        response = self.poll({'IIDs': ['a', 'b', 'legacy']})
+
+        self.assertEqual(response['statusCode'], 200)
+        results = response['body']['results']
+        self.assertEqual([results[iid]['statusCode'] for iid in ('a', 'b', 'legacy')],
+                         [202, 500, 202])
+        # Only the IID without manifest falls back to the output checks
+        self.assertEqual(mock_check_file_exists.call_count, 2)
+
+    def test_batched_poll_limit(self):
+        with patch.object(lambda_get_subtitles, 'MAX_POLL_IIDS', 2):
+            response = self.poll({'IIDs': ['a', 'b', 'c']})
+        self.assertEqual(response['statusCode'], 400)
+
+    def test_batched_poll_types(self):
+        for body in ({'IIDs': 3}, {'IIDs': 'a'}, {'IIDs': [['a']]},
+                     {'IIDs': ['a'], 'etags': ['etag']}, {'IIDs': ['a'], 'etags': {'a': 3}},
+                     {'IID': 'a', 'etag': 3}):
+            self.assertEqual(self.poll(body)['statusCode'], 400, body)
+
+    def test_start_writes_queued_status(self):
+        event = {'rawPath': '/start',
+                 'body': json.dumps({'bucket': self.bucket_name, 'IID': '12345'})}
+        with patch('lambda_get_subtitles.s3_io.client'):
+            lambda_get_subtitles.lambda_handler(event, {})
+        response = self.poll({'IID': '12345'})
+        self.assertEqual(response['statusCode'], 202)
+        self.assertEqual(response['body']['status']['state'], 'queued')
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,81 @@
+import unittest
+from unittest.mock import patch
+import json
+import time
+
+import instrumentation
+
+
+def emitted_records(mock_print):
+    return [json.loads(call.args[0]) for call in mock_print.call_args_list]
+
+
+class TestInstrumentation(unittest.TestCase):
+    @patch('instrumentation.print', create=True)
+    def test_one_emf_line_per_invocation(self, mock_print):
+        @instrumentation.instrument('test')
+        def handler(event, context):
+            with instrumentation.timer('download'):
+                time.sleep(0.01)
+            instrumentation.add('bytes_downloaded', 100, 'Bytes')
+            instrumentation.add('bytes_downloaded', 50, 'Bytes')
+            instrumentation.set_property('mode', 'burn')
+            return {'statusCode': 200}
+
+        self.assertEqual(handler({}, None), {'statusCode': 200})
+
+        record, = emitted_records(mock_print)
+        self.assertEqual(record['Function'], 'test')
+        self.assertEqual(record['status_code'], 200)
+        self.assertEqual(record['mode'], 'burn')
+        self.assertEqual(record['bytes_downloaded'], 150)
+        self.assertGreaterEqual(record['download'], 10)
+        self.assertGreater(record['peak_rss'], 0)
+        directive, = record['_aws']['CloudWatchMetrics']
+        self.assertEqual(directive['Dimensions'], [['Function']])
+        units = {metric['Name']: metric['Unit'] for metric in directive['Metrics']}
+        self.assertEqual(units['download'], 'Milliseconds')
+        self.assertEqual(units['bytes_downloaded'], 'Bytes')
+        self.assertIn('duration', units)
+        # Every metric in the directive is a top level member
+        self.assertTrue(all(name in record for name in units))
+
+    @patch('instrumentation.print', create=True)
+    def test_emitted_when_the_handler_fails(self, mock_print):
+        @instrumentation.instrument('test')
+        def handler(event, context):
+            instrumentation.add('audio_seconds', 60, 'Seconds')
+            instrumentation.add('inference', 30000, 'Milliseconds')
+            raise RuntimeError('boom')
+
+        with self.assertRaises(RuntimeError):
+            handler({}, None)
+
+        record, = emitted_records(mock_print)
+        self.assertIsNone(record['status_code'])
+        self.assertEqual(record['audio_seconds_per_second'], 2)
+
+    @patch('instrumentation.print', create=True)
+    def test_paused_metrics_are_dropped(self, mock_print):
+        @instrumentation.instrument('test')
+        def handler(event, context):
+            with instrumentation.paused():
+                instrumentation.add('audio_seconds', 2, 'Seconds')
+            instrumentation.add('audio_seconds', 60, 'Seconds')
+            return {'statusCode': 200}
+
+        handler({}, None)
+
+        record, = emitted_records(mock_print)
+        self.assertEqual(record['audio_seconds'], 60)
+
+    def test_no_op_outside_handlers(self):
+        with instrumentation.timer('download'):
+            instrumentation.add('bytes_downloaded', 100, 'Bytes')
+        self.assertIsNone(instrumentation._current)
+        self.assertFalse(instrumentation.cold_start())
+        self.assertEqual(instrumentation.file_size('/nonexistent/file'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from unittest.mock import patch
+import json
+import shutil
+import subprocess
+import tempfile
+import os
+
+import media
+
+
+class TestProbe(unittest.TestCase):
+    def test_probe(self):
+        info = {'streams': [{'codec_type': 'video'}, {'codec_type': 'audio'},
+                            {'codec_type': 'audio'}],
+                'format': {'duration': '12.5'}}
+        with patch('subprocess.run') as mock_subprocess:
+            mock_subprocess.return_value.stdout = json.dumps(info)
+            self.assertEqual(media.probe('video.mp4'), info)
+            self.assertEqual(media.duration('video.mp4'), 12.5)
+        self.assertEqual(mock_subprocess.call_args[0][0][0], 'ffprobe')
+        self.assertEqual(len(media.streams(info, 'audio')), 2)
+
+    def test_unprobed_media(self):
+        with patch('subprocess.run', side_effect=FileNotFoundError('ffprobe')):
+            self.assertEqual(media.probe('video.mp4'), {})
+            self.assertIsNone(media.duration('video.mp4'))
+        with patch('subprocess.run', side_effect=subprocess.CalledProcessError(1, 'ffprobe')):
+            self.assertEqual(media.probe('video.mp4'), {})
+
+    @unittest.skipUnless(shutil.which('ffprobe'), 'ffprobe is not installed')
+    def test_duration_with_ffprobe(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, 'audio.mp3')
+        subprocess.run(['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi',
+                        '-i', 'sine=frequency=440:sample_rate=16000', '-t', '5',
+                        path], check=True)
+        self.assertAlmostEqual(media.duration(path), 5, delta=0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+from unittest.mock import patch
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import boto3
+import torch
+from moto import mock_aws
+from whisper.model import ModelDimensions, Whisper
+
+import pipeline
+
+
+MODEL_KEY = 'tiny-pipeline.pt'
+DIMS = ModelDimensions(n_mels=80, n_audio_ctx=1500, n_audio_state=64,
+                       n_audio_head=2, n_audio_layer=1, n_vocab=51865,
+                       n_text_ctx=448, n_text_state=64, n_text_head=2,
+                       n_text_layer=1)
+
+# The transcriptor loads its model at import time
+buffer = io.BytesIO()
+torch.save({"dims": DIMS.__dict__,
+            "model_state_dict": Whisper(DIMS).half().state_dict()}, buffer)
+with mock_aws(), patch.dict(os.environ, {'model': MODEL_KEY, 'model_cache_dir': '',
+                                         'warmup': 'false', 'model_preload': 'init'}):
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='cperalesg-whisper-model')
+    s3_client.put_object(Bucket='cperalesg-whisper-model', Key=MODEL_KEY,
+                         Body=buffer.getvalue())
+    import lambda_transcriptor
+
+
+def fake_transcription(audio, model):
+    seconds = len(audio) / lambda_transcriptor.SAMPLE_RATE
+    return {'segments': [{'start': 0.0, 'end': seconds, 'text': 'Hola'}],
+            'text': 'Hola'}
+
+
+class TestFindVideos(unittest.TestCase):
+    def test_folders_and_files(self):
+        folder = tempfile.mkdtemp()
+        for name in ('b.mp4', 'a.MKV', 'notes.txt'):
+            open(os.path.join(folder, name), 'w').close()
+
+        videos = pipeline.find_videos([folder, 'other/c.mov'])
+
+        self.assertEqual(videos, [os.path.join(folder, 'a.MKV'),
+                                  os.path.join(folder, 'b.mp4'), 'other/c.mov'])
+
+
+@unittest.skipUnless(shutil.which('ffmpeg'), 'ffmpeg is needed')
+@patch('lambda_add_subtitles.probe_video', return_value={})
+@patch('lambda_transcriptor.get_transcription', side_effect=fake_transcription)
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.videos = []
+        for i, seconds in enumerate((2, 3)):
+            video = os.path.join(self.folder, f'video_{i}.mp4')
+            subprocess.run(['ffmpeg', '-loglevel', 'error', '-y',
+                            '-f', 'lavfi', '-i', 'testsrc2=size=160x120:rate=10',
+                            '-f', 'lavfi', '-i', 'sine=frequency=440',
+                            '-t', str(seconds), '-c:v', 'libx264', '-c:a', 'aac',
+                            '-shortest', video], check=True)
+            self.videos.append(video)
+        self.output = os.path.join(self.folder, 'output')
+
+    def test_audio_is_piped(self, mock_transcription, mock_probe):
+        audio = pipeline.read_audio(self.videos[0])
+        self.assertAlmostEqual(len(audio) / 16000, 2, delta=0.1)
+        self.assertLess(abs(audio).max(), 1)
+
+    def test_outputs_are_local(self, mock_transcription, mock_probe):
+        with patch('lambda_add_subtitles.s3') as mock_s3:
+            result, = pipeline.process_videos(self.videos[:1], self.output)
+
+        mock_s3.upload_file.assert_not_called()
+        self.assertEqual(sorted(os.listdir(self.output)),
+                         ['video_0.srt', 'video_0.txt', 'video_0_sub.mp4'])
+        self.assertEqual(set(result['seconds']),
+                         {'extract_audio', 'transcription', 'save_transcription',
+                          'add_subtitles'})
+        self.assertAlmostEqual(result['audio_seconds'], 2, delta=0.1)
+
+    @mock_aws
+    def test_final_outputs_are_uploaded(self, mock_transcription, mock_probe):
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='output-bucket')
+
+        with patch('lambda_add_subtitles.s3', s3):
+            result, = pipeline.process_videos(self.videos[:1], self.output,
+                                              mode='soft', bucket='output-bucket')
+
+        keys = [o['Key'] for o in s3.list_objects_v2(Bucket='output-bucket')['Contents']]
+        self.assertEqual(sorted(keys), ['processed/srt/video_0.srt',
+                                        'processed/text/video_0.txt',
+                                        'video_sub/video_0_sub.mp4'])
+        self.assertEqual(result['outputs']['video'], 'video_sub/video_0_sub.mp4')
+
+    def test_concurrent_workers(self, mock_transcription, mock_probe):
+        videos = self.videos + [os.path.join(self.folder, 'missing.mp4')]
+        results = pipeline.process_videos(videos, self.output, workers=2, mode='soft')
+
+        self.assertEqual([r['video'] for r in results], videos)
+        self.assertEqual([round(r['audio_seconds']) for r in results[:2]], [2, 3])
+        self.assertIn('error', results[2])
+        self.assertTrue(os.path.exists(os.path.join(self.output, 'video_1_sub.mp4')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import json
+import boto3
+from moto import mock_aws
+
+import queue_driver
+
+
+def fake_handler(batches):
+    def handler(event, context):
+        jobs = event['body']['jobs']
+        batches.append(jobs)
+        return {'statusCode': 200,
+                'body': {'jobs': [{'statusCode': 200, 'IID': job['IID']}
+                                  for job in jobs]}}
+    return handler
+
+
+@mock_aws
+class TestQueueDriver(unittest.TestCase):
+    def setUp(self):
+        self.sqs = boto3.client('sqs', region_name='us-east-1')
+        self.queue_url = self.sqs.create_queue(QueueName='transcriptions')['QueueUrl']
+
+    def send(self, n_jobs):
+        for i in range(n_jobs):
+            self.sqs.send_message(QueueUrl=self.queue_url,
+                                  MessageBody=json.dumps({'IID': str(i),
+                                                          'audio': f'audio/{i}.pcm'}))
+
+    def messages_in_queue(self):
+        attributes = self.sqs.get_queue_attributes(
+            QueueUrl=self.queue_url,
+            AttributeNames=['ApproximateNumberOfMessages',
+                            'ApproximateNumberOfMessagesNotVisible'])['Attributes']
+        return sum(int(value) for value in attributes.values())
+
+    def test_drain_in_batches(self):
+        self.send(25)
+        batches = []
+
+        n_jobs = queue_driver.drain(self.sqs, self.queue_url, fake_handler(batches),
+                                    batch_size=12, window_seconds=0, wait_seconds=0)
+
+        self.assertEqual(n_jobs, 25)
+        self.assertEqual([len(batch) for batch in batches], [12, 12, 1])
+        self.assertEqual(sorted(int(job['IID']) for batch in batches for job in batch),
+                         list(range(25)))
+        self.assertEqual(self.messages_in_queue(), 0)
+
+    def test_empty_queue(self):
+        batches = []
+        n_jobs = queue_driver.drain(self.sqs, self.queue_url, fake_handler(batches),
+                                    wait_seconds=0)
+        self.assertEqual(n_jobs, 0)
+        self.assertEqual(batches, [])
+
+    def test_failed_batch_stays_in_queue(self):
+        self.send(3)
+
+        def handler(event, context):
+            raise RuntimeError('Transcriptor out of memory')
+
+        messages = queue_driver.collect_batch(self.sqs, self.queue_url, batch_size=5,
+                                              window_seconds=0, wait_seconds=0)
+        self.assertEqual(len(messages), 3)
+        with self.assertRaises(RuntimeError):
+            queue_driver.run_batch(self.sqs, self.queue_url, messages, handler)
+        self.assertEqual(self.messages_in_queue(), 3)
+
+    def test_invalid_message_is_sent_as_invalid_job(self):
+        self.sqs.send_message(QueueUrl=self.queue_url, MessageBody='not json')
+        events = []
+
+        def handler(event, context):
+            events.append(event)
+            return {'statusCode': 200,
+                    'body': {'jobs': [{'statusCode': 400} for _ in event['body']['jobs']]}}
+
+        queue_driver.drain(self.sqs, self.queue_url, handler, wait_seconds=0,
+                           window_seconds=0)
+        self.assertEqual(events[0]['body']['jobs'], [None])
+        self.assertEqual(self.messages_in_queue(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
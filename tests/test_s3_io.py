@@ -0,0 +1,47 @@
+import unittest
+from unittest.mock import patch
+import os
+
+import s3_io
+
+
+class TestTransferConfig(unittest.TestCase):
+    def test_concurrency_fits_the_memory(self):
+        with patch.dict(os.environ, {}, clear=True):
+            # An eighth of the memory in 16 MB parts
+            self.assertEqual(s3_io.max_concurrency(memory_mb=1024, chunk_mb=16), 8)
+            self.assertEqual(s3_io.max_concurrency(memory_mb=128, chunk_mb=16), 2)
+            self.assertEqual(s3_io.max_concurrency(memory_mb=10240, chunk_mb=16),
+                             s3_io.MAX_POOL_CONNECTIONS)
+
+    def test_lambda_memory_size(self):
+        with patch.dict(os.environ, {'AWS_LAMBDA_FUNCTION_MEMORY_SIZE': '3008'}, clear=True):
+            self.assertEqual(s3_io.max_concurrency(chunk_mb=16), 23)
+
+    def test_concurrency_from_environment(self):
+        with patch.dict(os.environ, {'s3_max_concurrency': '4'}):
+            self.assertEqual(s3_io.max_concurrency(memory_mb=10240), 4)
+
+    def test_part_size(self):
+        config = s3_io.transfer_config(memory_mb=2048, chunk_mb=8)
+        self.assertEqual(config.multipart_chunksize, 8 * s3_io.MB)
+        self.assertEqual(config.multipart_threshold, 8 * s3_io.MB)
+        self.assertEqual(config.max_concurrency, 32)
+
+
+class TestClients(unittest.TestCase):
+    def test_clients_are_reused(self):
+        client = s3_io.client('s3', region_name='eu-west-1')
+        self.assertIs(s3_io.client('s3', region_name='eu-west-1'), client)
+        self.assertIsNot(s3_io.client('lambda', region_name='eu-west-1'), client)
+
+    def test_pool_fits_the_transfers(self):
+        client = s3_io.client('s3', region_name='eu-west-1')
+        self.assertEqual(client.meta.config.max_pool_connections,
+                         s3_io.MAX_POOL_CONNECTIONS)
+        self.assertGreaterEqual(s3_io.MAX_POOL_CONNECTIONS,
+                                s3_io.TRANSFER_CONFIG.max_concurrency)
+
+
+if __name__ == '__main__':
+    unittest.main()
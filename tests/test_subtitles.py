@@ -0,0 +1,49 @@
+import unittest
+
+import subtitles
+
+
+SEGMENTS = [{'start': 0.0, 'end': 1.5, 'text': 'Hola'},
+            {'start': 61.005, 'end': 3723.2, 'text': '100% subtitulado'}]
+
+
+class TestTimestamps(unittest.TestCase):
+    def test_milliseconds_are_padded(self):
+        self.assertEqual(subtitles.timestamps([0.005, 0.05, 1.5, 3723.0456]),
+                         ['00:00:00,005', '00:00:00,050', '00:00:01,500',
+                          '01:02:03,046'])
+
+    def test_rounding_carries_over(self):
+        self.assertEqual(subtitles.timestamps([59.9996, 3599.9999]),
+                         ['00:01:00,000', '01:00:00,000'])
+
+    def test_negative_times_are_clipped(self):
+        self.assertEqual(subtitles.timestamps([-0.2]), ['00:00:00,000'])
+
+    def test_hours_over_99_widen_every_row(self):
+        self.assertEqual(subtitles.timestamps([1.0, 360000.0], separator='.'),
+                         ['000:00:01.000', '100:00:00.000'])
+
+
+class TestSerialize(unittest.TestCase):
+    def test_srt(self):
+        self.assertEqual(subtitles.serialize(SEGMENTS),
+                         '1\n00:00:00,000 --> 00:00:01,500\nHola\n\n'
+                         '2\n00:01:01,005 --> 01:02:03,200\n100% subtitulado\n\n')
+
+    def test_srt_continues_numbering(self):
+        self.assertTrue(subtitles.serialize(SEGMENTS[1:], first_index=7).startswith('7\n'))
+
+    def test_vtt(self):
+        self.assertEqual(subtitles.serialize(SEGMENTS, 'vtt'),
+                         'WEBVTT\n\n'
+                         '00:00:00.000 --> 00:00:01.500\nHola\n\n'
+                         '00:01:01.005 --> 01:02:03.200\n100% subtitulado\n\n')
+
+    def test_no_segments(self):
+        self.assertEqual(subtitles.serialize([]), '')
+        self.assertEqual(subtitles.serialize([], 'vtt'), 'WEBVTT\n\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
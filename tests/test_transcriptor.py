@@ -0,0 +1,1068 @@
+import unittest
+from unittest.mock import patch
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+import numpy as np
+import torch
+import whisper
+from moto import mock_aws
+from whisper.model import ModelDimensions, Whisper
+
+
+MODEL_BUCKET = 'cperalesg-whisper-model'
+MODEL_KEY = 'tiny-test.pt'
+DIMS = ModelDimensions(n_mels=80, n_audio_ctx=1500, n_audio_state=64,
+                       n_audio_head=2, n_audio_layer=1, n_vocab=51865,
+                       n_text_ctx=448, n_text_state=64, n_text_head=2,
+                       n_text_layer=1)
+
+
+def checkpoint_bytes(dims=DIMS):
+    # Stored in fp16 like the official Whisper checkpoints
+    model = Whisper(dims).half()
+    buffer = io.BytesIO()
+    torch.save({"dims": dims.__dict__,
+                "model_state_dict": model.state_dict()}, buffer)
+    return buffer.getvalue()
+
+
+CHECKPOINT = checkpoint_bytes()
+CACHE_DIR = tempfile.mkdtemp()
+
+# The transcriptor loads its model at import time
+with mock_aws(), patch.dict(os.environ, {'model': MODEL_KEY,
+                                         'model_cache_dir': CACHE_DIR,
+                                         'model_preload': 'init'}):
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket=MODEL_BUCKET)
+    s3_client.put_object(Bucket=MODEL_BUCKET, Key=MODEL_KEY, Body=CHECKPOINT)
+    import lambda_transcriptor
+
+
+@mock_aws
+class TestModelCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.s3_client = boto3.client('s3', region_name='us-east-1')
+        self.s3_client.create_bucket(Bucket=MODEL_BUCKET)
+        self.s3_client.put_object(Bucket=MODEL_BUCKET, Key=MODEL_KEY,
+                                  Body=CHECKPOINT)
+
+    def test_model_is_cached_with_etag(self):
+        path = lambda_transcriptor.get_cached_model_path(
+            self.s3_client, MODEL_BUCKET, MODEL_KEY, cache_dir=self.cache_dir)
+
+        etag = self.s3_client.head_object(Bucket=MODEL_BUCKET,
+                                          Key=MODEL_KEY)['ETag'].strip('"')
+        self.assertEqual(path, os.path.join(self.cache_dir,
+                                            f'tiny-test-{etag}.pt'))
+        self.assertTrue(os.path.exists(path))
+        self.assertTrue(os.path.exists(path + '.json'))
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+        # Second call hits the cache without downloading again
+        with patch.object(self.s3_client, 'download_file') as mock_download:
+            cached_path = lambda_transcriptor.get_cached_model_path(
+                self.s3_client, MODEL_BUCKET, MODEL_KEY,
+                cache_dir=self.cache_dir)
+            mock_download.assert_not_called()
+        self.assertEqual(cached_path, path)
+
+    def test_new_upload_replaces_cached_model(self):
+        old_path = lambda_transcriptor.get_cached_model_path(
+            self.s3_client, MODEL_BUCKET, MODEL_KEY, cache_dir=self.cache_dir)
+
+        self.s3_client.put_object(Bucket=MODEL_BUCKET, Key=MODEL_KEY,
+                                  Body=checkpoint_bytes())
+        new_path = lambda_transcriptor.get_cached_model_path(
+            self.s3_client, MODEL_BUCKET, MODEL_KEY, cache_dir=self.cache_dir)
+
+        self.assertNotEqual(old_path, new_path)
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(new_path))
+
+    def test_other_models_are_not_removed_as_stale(self):
+        other_etag = 'f' * 32
+        # Other checkpoints whose names start like tiny-test
+        kept = ['tiny-' + other_etag + '.pt', 'tiny-' + other_etag + '.pt.json',
+                'tiny-test-v2-' + other_etag + '.pt']
+        for name in kept:
+            open(os.path.join(self.cache_dir, name), 'w').close()
+        old = ['tiny-test-' + other_etag + '.int8.pt',
+               'tiny-test-' + 'a' * 32 + '-3.pt.json']
+        for name in old:
+            open(os.path.join(self.cache_dir, name), 'w').close()
+
+        path = lambda_transcriptor.get_cached_model_path(
+            self.s3_client, MODEL_BUCKET, MODEL_KEY, cache_dir=self.cache_dir)
+
+        self.assertEqual(sorted(os.listdir(self.cache_dir)),
+                         sorted(kept + [os.path.basename(path),
+                                        os.path.basename(path) + '.json']))
+
+    def test_full_disk_falls_back_to_memory(self):
+        with patch('lambda_transcriptor.get_cached_model_path',
+                   side_effect=IOError('1 MB do not fit in /tmp')):
+            model = lambda_transcriptor.load_model_from_s3(
+                s3_bucket=MODEL_BUCKET, model_name=MODEL_KEY, context='local')
+
+        self.assertEqual(model.dims, DIMS)
+
+    def test_failed_conversion_leaves_no_files(self):
+        with patch('lambda_transcriptor.prepare_model_file',
+                   side_effect=OSError(28, 'No space left on device')):
+            with self.assertRaises(OSError):
+                lambda_transcriptor.get_cached_model_path(
+                    self.s3_client, MODEL_BUCKET, MODEL_KEY, cache_dir=self.cache_dir)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_truncated_cache_is_downloaded_again(self):
+        path = lambda_transcriptor.get_cached_model_path(
+            self.s3_client, MODEL_BUCKET, MODEL_KEY, cache_dir=self.cache_dir)
+        with open(path, 'r+b') as f:
+            f.truncate(10)
+
+        path = lambda_transcriptor.get_cached_model_path(
+            self.s3_client, MODEL_BUCKET, MODEL_KEY, cache_dir=self.cache_dir)
+        model = lambda_transcriptor.load_model_file(path)
+        self.assertEqual(model.dims, DIMS)
+
+    def test_int8_model_is_cached_quantized(self):
+        fp32_path = lambda_transcriptor.get_cached_model_path(
+            self.s3_client, MODEL_BUCKET, MODEL_KEY, cache_dir=self.cache_dir)
+        int8_path = lambda_transcriptor.get_cached_model_path(
+            self.s3_client, MODEL_BUCKET, MODEL_KEY, cache_dir=self.cache_dir,
+            model_format='int8')
+
+        self.assertTrue(int8_path.endswith('.int8.pt'))
+        self.assertTrue(os.path.exists(fp32_path))
+        self.assertLess(os.path.getsize(int8_path), os.path.getsize(fp32_path))
+        model = lambda_transcriptor.load_model_file(int8_path)
+        self.assertIsInstance(model.decoder.blocks[0].mlp[0],
+                              torch.ao.nn.quantized.dynamic.Linear)
+
+    def test_load_model_file_matches_checkpoint(self):
+        path = os.path.join(self.cache_dir, 'model.pt')
+        with open(path + '.download', 'wb') as f:
+            f.write(CHECKPOINT)
+        lambda_transcriptor.prepare_model_file(path + '.download', path)
+
+        model = lambda_transcriptor.load_model_file(path)
+        reference = lambda_transcriptor.load_model_bytes(CHECKPOINT)
+
+        for (name, tensor), (_, expected) in zip(model.state_dict().items(),
+                                                 reference.state_dict().items()):
+            self.assertEqual(tensor.dtype, torch.float32, name)
+            self.assertTrue(torch.equal(tensor, expected), name)
+        self.assertTrue(torch.equal(model.decoder.mask, reference.decoder.mask))
+        self.assertTrue(torch.equal(model.alignment_heads.to_dense(),
+                                    reference.alignment_heads.to_dense()))
+        self.assertFalse(any(t.is_meta for t in model.buffers()))
+
+
+class TestQuantization(unittest.TestCase):
+    def test_quantized_model_stays_close_to_fp32(self):
+        model = lambda_transcriptor.load_model_bytes(CHECKPOINT)
+        mel = torch.randn(1, DIMS.n_mels, 3000)
+        with torch.no_grad():
+            expected = model.encoder(mel)
+            quantized = lambda_transcriptor.quantize_model(
+                lambda_transcriptor.load_model_bytes(CHECKPOINT))
+            features = quantized.encoder(mel)
+
+        linear_layers = [m for m in quantized.modules()
+                         if isinstance(m, torch.ao.nn.quantized.dynamic.Linear)]
+        # query, key, value and out of every attention plus the two MLP layers
+        self.assertEqual(len(linear_layers),
+                         (DIMS.n_audio_layer + 2 * DIMS.n_text_layer) * 4
+                         + (DIMS.n_audio_layer + DIMS.n_text_layer) * 2)
+        similarity = torch.nn.functional.cosine_similarity(
+            features.flatten(), expected.flatten(), dim=0)
+        self.assertGreater(similarity.item(), 0.99)
+
+
+class TestLoadAudio(unittest.TestCase):
+    def test_pcm_audio_is_read_without_ffmpeg(self):
+        samples = np.array([0, 16384, -32768, 32767], dtype=np.int16)
+        with tempfile.NamedTemporaryFile(suffix='.pcm') as f:
+            samples.tofile(f.name)
+            with patch('whisper.load_audio') as mock_load_audio:
+                audio = lambda_transcriptor.load_audio(f.name)
+        mock_load_audio.assert_not_called()
+        self.assertEqual(audio.dtype, np.float32)
+        np.testing.assert_allclose(audio, [0, 0.5, -1, 32767 / 32768])
+
+    def test_ffmpeg_is_pinned_once_started(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        audio_file = os.path.join(folder, 'clip.wav')
+        with wave.open(audio_file, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(lambda_transcriptor.SAMPLE_RATE)
+            f.writeframes(np.zeros(1600, dtype=np.int16).tobytes())
+        processes = []
+        real_popen = subprocess.Popen
+
+        def popen(*args, **kwargs):
+            processes.append(real_popen(*args, **kwargs))
+            return processes[-1]
+
+        with patch.object(lambda_transcriptor, 'INFERENCE_CPUS', [0]), \
+                patch.object(lambda_transcriptor, 'DECODE_CPUS', [1]), \
+                patch('lambda_transcriptor.subprocess.Popen', side_effect=popen) as mock_popen, \
+                patch('cpus.pin') as mock_pin:
+            audio = lambda_transcriptor.load_audio(audio_file)
+        self.assertEqual(len(audio), 1600)
+        self.assertNotIn('preexec_fn', mock_popen.call_args.kwargs)
+        mock_pin.assert_called_once_with([1], processes[0].pid)
+
+
+TRANSCRIPTION = {'segments': [{'start': 0.0, 'end': 1.5, 'text': 'Hola'}],
+                 'text': 'Hola'}
+
+
+@mock_aws
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.bucket = lambda_transcriptor.AWS_BUCKET_NAME
+        self.s3_client = boto3.client('s3', region_name='us-east-1')
+        self.s3_client.create_bucket(Bucket=self.bucket)
+        self.s3_client.put_object(Bucket=self.bucket, Key='audio/clip.mp3',
+                                  Body=b'audio bytes')
+
+    def read(self, key):
+        return self.s3_client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+    @patch('lambda_transcriptor.get_transcription', return_value=TRANSCRIPTION)
+    def test_identical_audio_is_not_transcribed_again(self, mock_transcription):
+        first = lambda_transcriptor.lambda_handler(
+            {'body': {'IID': 'first', 'audio': 'audio/clip.mp3'}}, {})
+        mock_transcription.assert_called_once()
+        cached = self.s3_client.list_objects_v2(Bucket=self.bucket,
+                                                Prefix='processed/cache/')
+        self.assertEqual(cached['KeyCount'], 2)
+
+        # Same audio under another key
+        self.s3_client.put_object(Bucket=self.bucket, Key='audio/copy.mp3',
+                                  Body=b'audio bytes')
+        second = lambda_transcriptor.lambda_handler(
+            {'body': {'IID': 'second', 'audio': 'audio/copy.mp3'}}, {})
+
+        mock_transcription.assert_called_once()
+        self.assertEqual(second['statusCode'], 200)
+        self.assertEqual(second['body']['subtitles']['key'], 'processed/srt/second.srt')
+        self.assertEqual(self.read('processed/srt/second.srt'),
+                         self.read(first['body']['subtitles']['key']))
+        self.assertEqual(self.read('processed/text/second.txt'), b'Hola')
+
+    @patch('lambda_transcriptor.get_transcription', return_value=TRANSCRIPTION)
+    def test_outputs_are_uploaded_from_memory(self, mock_transcription):
+        with patch.object(lambda_transcriptor.s3_client, 'upload_file') as mock_upload:
+            lambda_transcriptor.lambda_handler(
+                {'body': {'IID': 'first', 'audio': 'audio/clip.mp3'}}, {})
+        mock_upload.assert_not_called()
+        srt = self.s3_client.get_object(Bucket=self.bucket,
+                                        Key='processed/srt/first.srt')
+        self.assertEqual(srt['Body'].read(), b'1\n00:00:00,000 --> 00:00:01,500\nHola\n\n')
+        self.assertTrue(srt['ContentType'].startswith('application/x-subrip'))
+
+    @patch('lambda_transcriptor.get_transcription', return_value=TRANSCRIPTION)
+    def test_model_loads_during_the_download(self, mock_transcription):
+        calls = []
+        receive_audio = lambda_transcriptor.receive_audio
+        with patch('lambda_transcriptor.prefetch_model',
+                   side_effect=lambda name: calls.append(('prefetch', name))), \
+                patch('lambda_transcriptor.receive_audio',
+                      side_effect=lambda *args: calls.append(('download',))
+                      or receive_audio(*args)):
+            lambda_transcriptor.lambda_handler(
+                {'body': {'IID': 'first', 'audio': 'audio/clip.mp3'}}, {})
+        self.assertEqual(calls, [('prefetch', lambda_transcriptor.MODEL_NAME),
+                                 ('download',)])
+
+    def status(self, iid):
+        return json.loads(self.read(f'processed/status/{iid}.json'))
+
+    @patch('lambda_transcriptor.get_transcription')
+    def test_status_manifest(self, mock_transcription):
+        states = []
+        mock_transcription.side_effect = lambda *args, **kwargs: (
+            states.append(self.status('first')['state']) or TRANSCRIPTION)
+        lambda_transcriptor.lambda_handler(
+            {'body': {'IID': 'first', 'audio': 'audio/clip.mp3'}}, {})
+        lambda_transcriptor.lambda_handler(
+            {'body': {'IID': 'second', 'audio': 'audio/clip.mp3'}}, {})
+
+        self.assertEqual(states, ['running'])
+        first, second = self.status('first'), self.status('second')
+        self.assertEqual(first['state'], 'done')
+        self.assertEqual(first['progress'], 1.0)
+        self.assertEqual(first['subtitles']['key'], 'processed/srt/first.srt')
+        self.assertIn('transcription_seconds', first)
+        self.assertTrue(second['cached'])
+        self.assertEqual(second['text']['key'], 'processed/text/second.txt')
+
+    @patch('lambda_transcriptor.get_transcription', side_effect=RuntimeError('boom'))
+    def test_status_manifest_on_error(self, mock_transcription):
+        with self.assertRaises(RuntimeError):
+            lambda_transcriptor.lambda_handler(
+                {'body': {'IID': 'first', 'audio': 'audio/clip.mp3'}}, {})
+        self.assertEqual(self.status('first')['state'], 'error')
+        self.assertEqual(self.status('first')['error'], 'boom')
+
+        lambda_transcriptor.lambda_handler(
+            {'body': {'IID': 'missing', 'audio': 'audio/missing.mp3'}}, {})
+        self.assertEqual(self.status('missing')['state'], 'error')
+
+    @patch('lambda_transcriptor.get_transcription', return_value=TRANSCRIPTION)
+    def test_status_manifest_when_publishing_fails(self, mock_transcription):
+        with patch('lambda_transcriptor.put_objects', side_effect=RuntimeError('no upload')):
+            with self.assertRaises(RuntimeError):
+                lambda_transcriptor.lambda_handler(
+                    {'body': {'IID': 'first', 'audio': 'audio/clip.mp3'}}, {})
+        self.assertEqual(self.status('first')['state'], 'error')
+        self.assertEqual(self.status('first')['error'], 'no upload')
+
+    @patch('lambda_transcriptor.get_transcription', return_value=TRANSCRIPTION)
+    def test_cache_depends_on_options(self, mock_transcription):
+        lambda_transcriptor.lambda_handler(
+            {'body': {'IID': 'first', 'audio': 'audio/clip.mp3'}}, {})
+        with patch.dict(lambda_transcriptor.DECODE_OPTIONS, language='es'):
+            lambda_transcriptor.lambda_handler(
+                {'body': {'IID': 'second', 'audio': 'audio/clip.mp3'}}, {})
+        self.assertEqual(mock_transcription.call_count, 2)
+
+    def test_windowed_decoding_has_its_own_cache_key(self):
+        whole = lambda_transcriptor.transcription_options()
+        with patch.object(lambda_transcriptor, 'PARTIAL_RESULTS', True):
+            windowed = lambda_transcriptor.transcription_options()
+        self.assertNotEqual(whole, windowed)
+        self.assertTrue(windowed['partial_results'])
+
+    def test_batched_decoding_has_its_own_cache_key(self):
+        single = lambda_transcriptor.transcription_options()
+        with patch.object(lambda_transcriptor, 'STREAM_AUDIO', True):
+            batched = lambda_transcriptor.transcription_options(batched=True)
+        self.assertNotEqual(single, batched)
+        self.assertTrue(batched['batched'])
+        self.assertNotIn('stream_window_seconds', batched)
+
+    @patch('lambda_transcriptor.get_transcription', return_value=TRANSCRIPTION)
+    def test_cache_can_be_disabled(self, mock_transcription):
+        with patch.object(lambda_transcriptor, 'RESULT_CACHE', False):
+            for iid in ('first', 'second'):
+                lambda_transcriptor.lambda_handler(
+                    {'body': {'IID': iid, 'audio': 'audio/clip.mp3'}}, {})
+        self.assertEqual(mock_transcription.call_count, 2)
+        cached = self.s3_client.list_objects_v2(Bucket=self.bucket,
+                                                Prefix='processed/cache/')
+        self.assertEqual(cached['KeyCount'], 0)
+
+
+class TestRouting(unittest.TestCase):
+    MODELS = ['medium.pt', 'small.pt', 'tiny.pt']
+
+    def plan(self, duration, max_workers=1):
+        with patch.dict(lambda_transcriptor.MODEL_SPEEDS,
+                        {'tiny': 10.0, 'small': 2.0, 'medium': 1.0}):
+            return lambda_transcriptor.plan_transcription(
+                duration, self.MODELS, target=60, max_workers=max_workers)
+
+    def test_most_accurate_model_within_target(self):
+        self.assertEqual(self.plan(30)['model'], 'medium.pt')
+        self.assertEqual(self.plan(100)['model'], 'small.pt')
+        self.assertEqual(self.plan(500), {'model': 'tiny.pt', 'workers': 1,
+                                          'chunk_seconds': lambda_transcriptor.CHUNK_SECONDS})
+
+    def test_workers_before_smaller_models(self):
+        plan = self.plan(200, max_workers=4)
+        self.assertEqual(plan, {'model': 'medium.pt', 'workers': 4, 'chunk_seconds': 50})
+
+    def test_fastest_model_if_none_makes_it(self):
+        plan = self.plan(36000, max_workers=2)
+        self.assertEqual((plan['model'], plan['workers']), ('tiny.pt', 2))
+
+    def test_routing_disabled(self):
+        self.assertEqual(lambda_transcriptor.plan_transcription(500, []),
+                         lambda_transcriptor.default_plan())
+
+    def test_model_speed_from_name(self):
+        speeds = lambda_transcriptor.MODEL_SPEEDS
+        self.assertEqual(lambda_transcriptor.model_speed('models/medium.en.pt'),
+                         speeds['medium'])
+        self.assertEqual(lambda_transcriptor.model_speed('large-v3.pt'), speeds['large'])
+        with self.assertRaises(ValueError):
+            lambda_transcriptor.model_speed('whisper.pt')
+
+
+class TestSettings(unittest.TestCase):
+    @patch.dict(os.environ, {'chunk_seconds': '60', 'batch_size': '8 clips',
+                             'model_speeds': '{"tiny": 20'})
+    def test_invalid_values_fall_back_to_the_default(self):
+        self.assertEqual(lambda_transcriptor.setting('chunk_seconds', 600.0), 60.0)
+        self.assertEqual(lambda_transcriptor.setting('missing', 600.0), 600.0)
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(lambda_transcriptor.setting('batch_size', 8, int), 8)
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(lambda_transcriptor.setting('model_speeds', {}, json.loads), {})
+
+
+@mock_aws
+class TestRoutedJobs(unittest.TestCase):
+    def setUp(self):
+        self.bucket = lambda_transcriptor.AWS_BUCKET_NAME
+        self.s3_client = boto3.client('s3', region_name='us-east-1')
+        self.s3_client.create_bucket(Bucket=self.bucket)
+        # One second of 16 kHz s16le audio
+        self.s3_client.put_object(Bucket=self.bucket, Key='audio/clip.pcm',
+                                  Body=b'\0\0' * lambda_transcriptor.SAMPLE_RATE)
+        patcher = patch.object(lambda_transcriptor, 'ROUTE_MODELS',
+                               ['medium.pt', 'tiny.pt'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.models = {'medium.pt': 'medium model', 'tiny.pt': 'tiny model'}
+
+    def transcribe(self, iid):
+        with patch.dict(lambda_transcriptor.MODELS, self.models), \
+                patch.object(lambda_transcriptor, 'TARGET_LATENCY_SECONDS', 60), \
+                patch('lambda_transcriptor.get_transcription',
+                      return_value=TRANSCRIPTION) as mock_transcription:
+            lambda_transcriptor.lambda_handler(
+                {'body': {'IID': iid, 'audio': 'audio/clip.pcm'}}, {})
+        return mock_transcription.call_args[0][1]
+
+    def test_preflight_duration_picks_the_model(self):
+        self.assertEqual(self.transcribe('short'), 'medium model')
+
+        self.s3_client.put_object(Bucket=self.bucket, Key='audio/clip.json',
+                                  Body=json.dumps({'duration': 3600.0}))
+        self.assertEqual(self.transcribe('long'), 'tiny model')
+
+        # Each model has its own cached results
+        cached = self.s3_client.list_objects_v2(Bucket=self.bucket,
+                                                Prefix='processed/cache/')
+        self.assertEqual(cached['KeyCount'], 4)
+
+
+    def test_duration_is_probed_without_decoding(self):
+        with patch('media.probe', return_value={'format': {'duration': '7200.5'}}), \
+                patch('lambda_transcriptor.stream_audio') as mock_stream_audio:
+            self.assertEqual(lambda_transcriptor.audio_duration('clip.mp3'), 7200.5)
+        mock_stream_audio.assert_not_called()
+
+        with patch('media.probe', return_value={}):
+            self.assertIsNone(lambda_transcriptor.audio_duration('clip.mp3'))
+            plan = lambda_transcriptor.plan_job({'audio': 'audio/clip.mp3'}, 'clip.mp3')
+        self.assertEqual(plan, lambda_transcriptor.default_plan())
+
+
+class FakeModel:
+    """Returns a one second segment for every second of audio."""
+    def transcribe(self, audio, **options):
+        n_seconds = len(audio) // lambda_transcriptor.SAMPLE_RATE
+        segments = [{'start': float(i), 'end': float(i + 1), 'text': ' x'}
+                    for i in range(n_seconds)]
+        return {'segments': segments,
+                'text': ''.join(s['text'] for s in segments)}
+
+
+def speech_with_pauses(seconds, pause_every):
+    # Noise with a one second pause every pause_every seconds
+    sample_rate = lambda_transcriptor.SAMPLE_RATE
+    audio = np.random.default_rng(0).uniform(-0.5, 0.5, seconds * sample_rate)
+    for pause in range(pause_every, seconds, pause_every):
+        audio[pause * sample_rate:(pause + 1) * sample_rate] = 0
+    return audio.astype(np.float32)
+
+
+class TestParallelTranscription(unittest.TestCase):
+    def test_split_audio_cuts_at_silence(self):
+        audio = speech_with_pauses(300, 55)
+        windows = lambda_transcriptor.split_audio(audio, chunk_seconds=60,
+                                                  overlap_seconds=5)
+
+        sample_rate = lambda_transcriptor.SAMPLE_RATE
+        self.assertEqual(windows[0][2], 0)
+        self.assertEqual(windows[-1][3], len(audio))
+        for previous, window in zip(windows[:-1], windows[1:]):
+            # Cores are contiguous and every cut falls inside a pause
+            self.assertEqual(previous[3], window[2])
+            self.assertEqual(audio[window[2]], 0)
+            self.assertEqual(window[0], window[2] - 5 * sample_rate)
+            self.assertEqual(previous[1], previous[3] + 5 * sample_rate)
+
+    def test_short_audio_is_a_single_window(self):
+        audio = np.zeros(10 * lambda_transcriptor.SAMPLE_RATE, dtype=np.float32)
+        windows = lambda_transcriptor.split_audio(audio, chunk_seconds=60)
+        self.assertEqual(windows, [(0, len(audio), 0, len(audio))])
+
+    def test_stitch_segments_has_no_duplicates(self):
+        audio = speech_with_pauses(300, 55)
+        windows = lambda_transcriptor.split_audio(audio, chunk_seconds=60,
+                                                  overlap_seconds=5)
+        results = [FakeModel().transcribe(audio[start:end])['segments']
+                   for start, end, _, _ in windows]
+
+        transcription = lambda_transcriptor.stitch_segments(results, windows)
+        middles = [(s['start'] + s['end']) / 2
+                   for s in transcription['segments']]
+        self.assertEqual(middles, sorted(middles))
+        self.assertTrue(all(b - a > 0.5 for a, b in zip(middles, middles[1:])))
+        self.assertAlmostEqual(len(middles), 300, delta=len(windows))
+        self.assertEqual(transcription['text'], ' x' * len(middles))
+
+    def test_parallel_matches_sequential_windows(self):
+        audio = speech_with_pauses(200, 45)
+        with patch.object(lambda_transcriptor, 'CHUNK_SECONDS', 50), \
+                patch.object(lambda_transcriptor, 'CHUNK_OVERLAP_SECONDS', 5):
+            transcription = lambda_transcriptor.get_transcription(
+                audio, FakeModel(), workers=3)
+            windows = lambda_transcriptor.split_audio(audio, 50, 5)
+
+        results = [FakeModel().transcribe(audio[start:end])['segments']
+                   for start, end, _, _ in windows]
+        expected = lambda_transcriptor.stitch_segments(results, windows)
+        self.assertEqual(len(transcription['segments']),
+                         len(expected['segments']))
+        for segment, expected_segment in zip(transcription['segments'],
+                                             expected['segments']):
+            self.assertAlmostEqual(segment['start'], expected_segment['start'])
+            self.assertEqual(segment['text'], 'x')
+        self.assertEqual(transcription['text'], expected['text'].lstrip())
+
+
+class TestWarmUp(unittest.TestCase):
+    def test_init_is_warmed_up(self):
+        response = lambda_transcriptor.lambda_handler({'body': {'warmup': True}}, {})
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(set(response['body']['timings']),
+                         {'model_load', 'mel', 'encoder', 'decoder', 'transcription'})
+
+    def test_warm_up_request_without_init_warm_up(self):
+        with patch.dict(lambda_transcriptor.INIT_TIMINGS, clear=True), \
+                patch('lambda_transcriptor.warm_up',
+                      return_value={'transcription': 0.5}) as mock_warm_up:
+            for _ in range(2):
+                response = lambda_transcriptor.lambda_handler(
+                    {'body': json.dumps({'warmup': True})}, {})
+
+        mock_warm_up.assert_called_once_with(lambda_transcriptor.MODEL)
+        self.assertEqual(response['body']['timings'], {'transcription': 0.5})
+
+    def test_warm_up_goes_through_get_transcription(self):
+        with patch('lambda_transcriptor.get_transcription') as mock_transcription:
+            timings = lambda_transcriptor.warm_up(lambda_transcriptor.MODEL, seconds=1)
+
+        audio = mock_transcription.call_args[0][0]
+        self.assertEqual(len(audio), lambda_transcriptor.SAMPLE_RATE)
+        self.assertTrue(all(seconds >= 0 for seconds in timings.values()))
+
+
+class TestModelLoading(unittest.TestCase):
+    def setUp(self):
+        for name, value in (('MODEL', None), ('_loader', None)):
+            patcher = patch.object(lambda_transcriptor, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.dict(lambda_transcriptor.INIT_TIMINGS, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.release = threading.Event()
+
+    def slow_model(self):
+        self.release.wait(5)
+        return 'model'
+
+    @patch('lambda_transcriptor.WARMUP', False)
+    def test_model_is_loaded_once(self):
+        with patch('lambda_transcriptor.get_model',
+                   side_effect=self.slow_model) as mock_get_model:
+            loader = lambda_transcriptor.load_model_in_background()
+            self.assertIs(lambda_transcriptor.load_model_in_background(), loader)
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                futures = [executor.submit(lambda_transcriptor.get_loaded_model)
+                           for _ in range(3)]
+                self.release.set()
+                models = [future.result() for future in futures]
+            loader.join()
+
+        mock_get_model.assert_called_once()
+        self.assertEqual(models, ['model'] * 3)
+        self.assertIn('model_load', lambda_transcriptor.INIT_TIMINGS)
+
+    @patch('lambda_transcriptor.WARMUP', False)
+    def test_cheap_requests_do_not_wait_for_the_model(self):
+        with patch('lambda_transcriptor.get_model', side_effect=self.slow_model):
+            loader = lambda_transcriptor.load_model_in_background()
+            invalid = lambda_transcriptor.lambda_handler({'body': {}}, {})
+            warmup = lambda_transcriptor.lambda_handler({'body': {'warmup': True}}, {})
+            self.release.set()
+            loader.join()
+
+        self.assertEqual(invalid['statusCode'], 400)
+        self.assertEqual(warmup['body']['model'], 'loading')
+        self.assertEqual(lambda_transcriptor.MODEL, 'model')
+
+    def test_failed_load_is_retried(self):
+        with patch('lambda_transcriptor.get_model',
+                   side_effect=[RuntimeError('no model'), FakeModel()]), \
+                patch('lambda_transcriptor.warm_up', return_value={}):
+            lambda_transcriptor.load_model_in_background().join()
+            self.assertIsNone(lambda_transcriptor.MODEL)
+            self.assertIsInstance(lambda_transcriptor.get_loaded_model(), FakeModel)
+
+    @patch('lambda_transcriptor.WARMUP', False)
+    def test_routed_model_does_not_wait_for_the_default_one(self):
+        with patch('lambda_transcriptor.get_model', side_effect=self.slow_model), \
+                patch('lambda_transcriptor.load_model_from_s3', return_value='tiny'), \
+                patch.dict(lambda_transcriptor.MODELS, clear=True):
+            loader = lambda_transcriptor.load_model_in_background()
+            start = time.perf_counter()
+            model = lambda_transcriptor.get_routed_model('tiny.pt')
+            seconds = time.perf_counter() - start
+            self.release.set()
+            loader.join()
+
+        self.assertEqual(model, 'tiny')
+        self.assertLess(seconds, 1)
+
+    def test_routing_does_not_preload_the_default_model(self):
+        code = ("import json, sys; import lambda_transcriptor as t; "
+                "print(json.dumps([t._loader is None, 'torch' in sys.modules]))")
+        env = dict(os.environ, model_preload='background', route_models='tiny.pt',
+                   AWS_DEFAULT_REGION='us-east-1')
+        output = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                                capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(__file__))).stdout
+        self.assertEqual(json.loads(output.splitlines()[-1]), [True, False])
+
+    def test_import_does_not_load_torch(self):
+        code = ("import json, sys; import lambda_transcriptor as t; "
+                "r = t.lambda_handler({'body': {}}, {}); "
+                "print(json.dumps([r['statusCode'], 'torch' in sys.modules]))")
+        env = dict(os.environ, model_preload='lazy', AWS_DEFAULT_REGION='us-east-1')
+        output = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                                capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(__file__))).stdout
+        self.assertEqual(json.loads(output.splitlines()[-1]), [400, False])
+
+
+def noise(seconds, seed=0):
+    rng = np.random.default_rng(seed)
+    samples = int(seconds * lambda_transcriptor.SAMPLE_RATE)
+    return rng.uniform(-0.3, 0.3, samples).astype(np.float32)
+
+
+class TestBatchedTranscription(unittest.TestCase):
+    def test_token_segments(self):
+        tokenizer = whisper.tokenizer.get_tokenizer(True)
+        begin = tokenizer.timestamp_begin
+        hello, world = tokenizer.encode(' Hello'), tokenizer.encode(' world')
+        tokens = ([begin] + hello + [begin + 100, begin + 100] + world
+                  + [begin + 250, begin + 250] + hello)
+
+        segments = lambda_transcriptor.token_segments(tokens, tokenizer, 6.0)
+
+        self.assertEqual(segments, [
+            {'start': 0.0, 'end': 2.0, 'text': ' Hello'},
+            {'start': 2.0, 'end': 5.0, 'text': ' world'},
+            {'start': 5.0, 'end': 6.0, 'text': ' Hello'}])
+
+    def test_batch_matches_single_clips(self):
+        audios = [noise(3, 0), noise(12, 1), noise(29, 2)]
+        model = lambda_transcriptor.MODEL
+
+        batched = lambda_transcriptor.transcribe_batch(audios, model, vad=False)
+        single = [lambda_transcriptor.transcribe_batch([audio], model, vad=False)[0]
+                  for audio in audios]
+
+        self.assertEqual(len(batched), 3)
+        self.assertEqual([t['text'] for t in batched], [t['text'] for t in single])
+        for transcription, audio in zip(batched, audios):
+            duration = len(audio) / lambda_transcriptor.SAMPLE_RATE
+            self.assertTrue(all(s['end'] <= duration for s in transcription['segments']))
+
+    def test_silent_clips_are_empty(self):
+        audios = [np.zeros(16000, dtype=np.float32), noise(3)]
+        transcriptions = lambda_transcriptor.transcribe_batch(
+            audios, lambda_transcriptor.MODEL, vad=True)
+        self.assertEqual(transcriptions[0], {'segments': [], 'text': ''})
+
+
+@mock_aws
+class TestTranscribeJobs(unittest.TestCase):
+    def setUp(self):
+        self.bucket = lambda_transcriptor.AWS_BUCKET_NAME
+        self.s3_client = boto3.client('s3', region_name='us-east-1')
+        self.s3_client.create_bucket(Bucket=self.bucket)
+
+    def put_audio(self, key, audio):
+        pcm = (audio * 32767).astype(np.int16).tobytes()
+        self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=pcm)
+
+    def status(self, iid):
+        body = self.s3_client.get_object(Bucket=self.bucket,
+                                         Key=f'processed/status/{iid}.json')['Body']
+        return json.loads(body.read())
+
+    def test_jobs_are_batched_and_fail_independently(self):
+        for i in range(3):
+            self.put_audio(f'audio/{i}.pcm', noise(5, i))
+        self.put_audio('audio/long.pcm', noise(40))
+        jobs = [{'IID': str(i), 'audio': f'audio/{i}.pcm'} for i in range(3)]
+        jobs += [{'IID': 'long', 'audio': 'audio/long.pcm'},
+                 {'IID': 'missing', 'audio': 'audio/missing.pcm'},
+                 {'audio': 'audio/0.pcm'}]
+
+        with patch.object(lambda_transcriptor, 'RESULT_CACHE', False), \
+                patch('lambda_transcriptor.transcribe_batch',
+                      wraps=lambda_transcriptor.transcribe_batch) as mock_batch, \
+                patch('lambda_transcriptor.get_transcription',
+                      return_value={'segments': [], 'text': 'long'}) as mock_single:
+            response = lambda_transcriptor.lambda_handler({'body': {'jobs': jobs}}, {})
+
+        results = response['body']['jobs']
+        self.assertEqual([r['statusCode'] for r in results], [200, 200, 200, 200, 500, 400])
+        self.assertEqual([r['IID'] for r in results[:5]], ['0', '1', '2', 'long', 'missing'])
+        mock_batch.assert_called_once()
+        self.assertEqual(len(mock_batch.call_args[0][0]), 3)
+        mock_single.assert_called_once()
+        for iid in ('0', '1', '2', 'long'):
+            self.assertEqual(self.status(iid)['state'], 'done')
+            self.s3_client.head_object(Bucket=self.bucket, Key=f'processed/srt/{iid}.srt')
+        self.assertEqual(self.status('0')['batch_size'], 3)
+        self.assertEqual(self.status('missing')['state'], 'error')
+        # Long audio is streamed from its file, not decoded up front
+        self.assertIsInstance(mock_single.call_args[0][0], str)
+
+    def test_batched_and_single_jobs_do_not_share_the_cache(self):
+        self.put_audio('audio/clip.pcm', noise(5))
+        single = {'segments': [], 'text': 'single'}
+        with patch('lambda_transcriptor.get_transcription',
+                   return_value=single) as mock_single, \
+                patch('lambda_transcriptor.transcribe_batch',
+                      side_effect=lambda audios, model: [
+                          {'segments': [], 'text': 'batched'} for _ in audios]) as mock_batch:
+            lambda_transcriptor.lambda_handler(
+                {'body': {'IID': 'single', 'audio': 'audio/clip.pcm'}}, {})
+            lambda_transcriptor.transcribe_jobs(
+                [{'IID': 'batched', 'audio': 'audio/clip.pcm'}], tempfile.mkdtemp())
+            lambda_transcriptor.transcribe_jobs(
+                [{'IID': 'again', 'audio': 'audio/clip.pcm'}], tempfile.mkdtemp())
+
+        mock_single.assert_called_once()
+        mock_batch.assert_called_once()
+        self.assertTrue(self.status('again')['cached'])
+
+    def test_batch_size(self):
+        for i in range(5):
+            self.put_audio(f'audio/{i}.pcm', noise(2, i))
+        jobs = [{'IID': str(i), 'audio': f'audio/{i}.pcm'} for i in range(5)]
+
+        with patch.object(lambda_transcriptor, 'RESULT_CACHE', False), \
+                patch('lambda_transcriptor.transcribe_batch',
+                      side_effect=lambda audios, model: [
+                          {'segments': [], 'text': ''} for _ in audios]) as mock_batch:
+            lambda_transcriptor.transcribe_jobs(jobs, tempfile.mkdtemp(), batch_size=2)
+
+        self.assertEqual([len(call.args[0]) for call in mock_batch.call_args_list],
+                         [2, 2, 1])
+
+    def test_failed_batch_only_fails_its_jobs(self):
+        for i in range(3):
+            self.put_audio(f'audio/{i}.pcm', noise(2, i))
+        jobs = [{'IID': str(i), 'audio': f'audio/{i}.pcm'} for i in range(3)]
+        outcomes = [RuntimeError('boom'), None]
+
+        def transcribe_batch(audios, model):
+            outcome = outcomes.pop(0)
+            if outcome is not None:
+                raise outcome
+            return [{'segments': [], 'text': ''} for _ in audios]
+
+        with patch.object(lambda_transcriptor, 'RESULT_CACHE', False), \
+                patch('lambda_transcriptor.transcribe_batch', side_effect=transcribe_batch):
+            response = lambda_transcriptor.transcribe_jobs(jobs, tempfile.mkdtemp(),
+                                                           batch_size=2)
+
+        self.assertEqual([r['statusCode'] for r in response['body']['jobs']],
+                         [500, 500, 200])
+        self.assertEqual(self.status('0')['error'], 'boom')
+
+
+class TestPartialResults(unittest.TestCase):
+    def test_windows_cover_the_audio(self):
+        audio = speech_with_pauses(100, 25)
+        model = FakeModel()
+        with patch.object(model, 'transcribe', wraps=model.transcribe) as mock_transcribe:
+            windows = list(lambda_transcriptor.iter_transcription(audio, model, 30))
+
+        self.assertEqual(len(windows), 4)
+        self.assertEqual([fraction for _, fraction in windows][-1], 1.0)
+
+        starts = [s['start'] for segments, _ in windows for s in segments]
+        self.assertEqual(starts, sorted(starts))
+        self.assertAlmostEqual(len(starts), 100, delta=len(windows))
+        # The text of each window is the prompt of the next one
+        prompts = [call.kwargs['initial_prompt'] for call in mock_transcribe.call_args_list]
+        self.assertIsNone(prompts[0])
+        self.assertTrue(all(prompt.startswith(' x') for prompt in prompts[1:]))
+
+    def test_windows_are_single_whisper_segments(self):
+        audio = noise(300)
+        windows = lambda_transcriptor.split_windows(audio, 30)
+
+        self.assertEqual(windows[0][0], 0)
+        self.assertEqual(windows[-1][1], len(audio))
+        for (start, end), (next_start, _) in zip(windows, windows[1:]):
+            self.assertEqual(end, next_start)
+        lengths = [(end - start) / lambda_transcriptor.SAMPLE_RATE for start, end in windows]
+        self.assertTrue(all(length <= 30 for length in lengths))
+        self.assertTrue(all(length >= 24 for length in lengths[:-1]))
+
+    def test_progress_matches_final_transcription(self):
+        audio = speech_with_pauses(100, 25)
+        calls = []
+        transcription = lambda_transcriptor.get_transcription(
+            audio, FakeModel(), workers=1,
+            progress=lambda segments, fraction: calls.append((segments, fraction)))
+
+        fractions = [fraction for _, fraction in calls]
+        self.assertEqual(fractions, sorted(fractions))
+        self.assertEqual(fractions[-1], 1.0)
+        self.assertEqual([s for segments, _ in calls for s in segments],
+                         transcription['segments'])
+
+    def test_progress_with_vad_uses_original_timeline(self):
+        audio = layout_audio([(40, 0.5), (30, 0), (40, 0.5)])
+        calls = []
+        transcription = lambda_transcriptor.get_transcription(
+            audio, FakeModel(), workers=1, vad=True,
+            progress=lambda segments, fraction: calls.append(segments))
+        self.assertEqual([s for segments in calls for s in segments],
+                         transcription['segments'])
+        self.assertGreater(transcription['segments'][-1]['end'], 100)
+
+
+def write_pcm(audio, path):
+    (audio * 32768).astype(np.int16).tofile(path)
+    return np.fromfile(path, np.int16).astype(np.float32) / 32768.0
+
+
+class TestStreamingTranscription(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.pcm = os.path.join(self.folder.name, 'audio.pcm')
+
+    def test_windows_are_cut_at_silences(self):
+        audio = write_pcm(speech_with_pauses(100, 29), self.pcm)
+        windows = list(lambda_transcriptor.stream_audio(self.pcm, 30))
+
+        sample_rate = lambda_transcriptor.SAMPLE_RATE
+        starts = [start for start, _ in windows]
+        self.assertEqual(starts[0], 0)
+        for (start, samples), next_start in zip(windows, starts[1:]):
+            self.assertEqual(start + len(samples), next_start)
+            self.assertLessEqual(len(samples), 30 * sample_rate)
+            # The cut is in the pause
+            self.assertTrue(np.all(audio[next_start - 500:next_start + 500] == 0))
+        np.testing.assert_array_equal(np.concatenate([w for _, w in windows]), audio)
+
+    def test_compressed_audio_is_decoded_through_a_pipe(self):
+        import wave
+        path = os.path.join(self.folder.name, 'audio.wav')
+        samples = (noise(10) * 32768).astype(np.int16)
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(lambda_transcriptor.SAMPLE_RATE)
+            f.writeframes(samples.tobytes())
+
+        windows = list(lambda_transcriptor.stream_audio(path, 4))
+        self.assertEqual(len(windows), 3)
+        np.testing.assert_array_equal(np.concatenate([w for _, w in windows]),
+                                      lambda_transcriptor.load_audio(path))
+
+    def test_decoding_errors_are_raised(self):
+        path = os.path.join(self.folder.name, 'audio.mp3')
+        with open(path, 'wb') as f:
+            f.write(b'not audio')
+        with self.assertRaises(RuntimeError):
+            list(lambda_transcriptor.stream_audio(path))
+
+    def test_corrupt_audio_does_not_block_ffmpeg(self):
+        path = os.path.join(self.folder.name, 'audio.mp3')
+        subprocess.run(['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi',
+                        '-i', 'sine=frequency=440:sample_rate=16000', '-t', '120',
+                        '-ac', '1', '-b:a', '32k', path], check=True)
+        with open(path, 'r+b') as f:
+            data = bytearray(f.read())
+            rng = np.random.default_rng(0)
+            # Enough bad frames for ffmpeg to log more than a pipe buffer
+            for i in rng.integers(1000, len(data), 30000):
+                data[i] = rng.integers(256)
+            f.seek(0)
+            f.write(data)
+
+        windows = []
+
+        def decode():
+            windows.extend(lambda_transcriptor.stream_audio(path))
+
+        thread = threading.Thread(target=decode, daemon=True)
+        thread.start()
+        thread.join(60)
+        self.assertFalse(thread.is_alive())
+        self.assertGreater(len(windows), 1)
+
+    def test_streamed_transcription(self):
+        write_pcm(speech_with_pauses(100, 25), self.pcm)
+        model = FakeModel()
+        calls = []
+        with patch('lambda_transcriptor.load_audio') as mock_load_audio, \
+                patch.object(model, 'transcribe', wraps=model.transcribe) as mock_transcribe:
+            transcription = lambda_transcriptor.get_transcription(
+                self.pcm, model, workers=2, vad=False, stream=True,
+                progress=lambda segments, fraction: calls.append(fraction))
+        mock_load_audio.assert_not_called()
+
+        self.assertEqual(calls, sorted(calls))
+        self.assertEqual(calls[-1], 1.0)
+        starts = [s['start'] for s in transcription['segments']]
+        self.assertEqual(starts, sorted(starts))
+        self.assertAlmostEqual(len(starts), 100, delta=len(calls))
+        prompts = [call.kwargs['initial_prompt'] for call in mock_transcribe.call_args_list]
+        self.assertIsNone(prompts[0])
+        self.assertTrue(all(prompt.startswith(' x') for prompt in prompts[1:]))
+
+    def test_streamed_transcription_with_vad(self):
+        # The second window is silent, it is only skipped once speech was heard
+        write_pcm(layout_audio([(10, 0.001), (10, 0.3), (60, 0.001), (10, 0.3)]),
+                  self.pcm)
+        transcription = lambda_transcriptor.get_transcription(
+            self.pcm, FakeModel(), workers=1, vad=True, stream=True)
+        starts = [s['start'] for s in transcription['segments']]
+        self.assertTrue(len(starts) >= 18)
+        for start in starts:
+            self.assertTrue(8 <= start < 21 or 78 <= start < 91, start)
+
+
+@mock_aws
+class TestPartialPublishing(unittest.TestCase):
+    def setUp(self):
+        self.bucket = lambda_transcriptor.AWS_BUCKET_NAME
+        self.s3_client = boto3.client('s3', region_name='us-east-1')
+        self.s3_client.create_bucket(Bucket=self.bucket)
+
+    def read(self, key):
+        return self.s3_client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+    def test_flushes_are_throttled(self):
+        partial = lambda_transcriptor.PartialResults(
+            'iid', 'processed/partial/iid.srt', 0, flush_seconds=10, flush_bytes=100)
+        segment = {'start': 0.0, 'end': 1.0, 'text': 'Hola'}
+        with patch('lambda_transcriptor.time.monotonic', return_value=partial.last_flush):
+            partial([segment] * 10, 0.1)
+        # Too early for a flush
+        self.assertNotIn('Contents', self.s3_client.list_objects_v2(Bucket=self.bucket))
+
+        with patch('lambda_transcriptor.time.monotonic', return_value=partial.last_flush + 10):
+            partial([segment], 0.2)
+        status = json.loads(self.read('processed/status/iid.json'))
+        self.assertEqual(status['progress'], 0.2)
+        self.assertEqual(status['partial']['segments'], 11)
+        srt = self.read('processed/partial/iid.srt').decode()
+        self.assertTrue(srt.startswith('1\n00:00:00,000 --> 00:00:01,000\nHola\n\n'))
+        self.assertIn('\n11\n', srt)
+
+        # Enough time, but not enough new bytes: only the progress is updated
+        with patch('lambda_transcriptor.time.monotonic', return_value=partial.last_flush + 10):
+            partial([segment], 0.3)
+        status = json.loads(self.read('processed/status/iid.json'))
+        self.assertEqual(status['progress'], 0.3)
+        self.assertEqual(status['partial']['segments'], 11)
+
+        partial.remove()
+        self.assertEqual(self.s3_client.list_objects_v2(
+            Bucket=self.bucket, Prefix='processed/partial/')['KeyCount'], 0)
+
+
+def layout_audio(layout):
+    # Noise with the given (seconds, amplitude) blocks, zero amplitude is silence
+    sample_rate = lambda_transcriptor.SAMPLE_RATE
+    rng = np.random.default_rng(0)
+    return np.concatenate([
+        rng.uniform(-amplitude, amplitude, int(seconds * sample_rate))
+        for seconds, amplitude in layout]).astype(np.float32)
+
+
+class TestVoiceActivityDetection(unittest.TestCase):
+    def test_detect_speech_regions(self):
+        audio = layout_audio([(5, 0.001), (10, 0.3), (20, 0.001),
+                              (5, 0.3), (0.5, 0.001), (5, 0.3), (5, 0.001)])
+        regions = lambda_transcriptor.detect_speech(audio, padding_seconds=0.3)
+
+        sample_rate = lambda_transcriptor.SAMPLE_RATE
+        seconds = [(start / sample_rate, end / sample_rate)
+                   for start, end in regions]
+        # The short pause between the last two bursts is kept
+        self.assertEqual(len(seconds), 2)
+        self.assertAlmostEqual(seconds[0][0], 4.7, delta=0.05)
+        self.assertAlmostEqual(seconds[0][1], 15.3, delta=0.05)
+        self.assertAlmostEqual(seconds[1][0], 34.7, delta=0.05)
+        self.assertAlmostEqual(seconds[1][1], 45.8, delta=0.05)
+
+    def test_steady_audio_is_kept(self):
+        audio = layout_audio([(20, 0.3)])
+        self.assertEqual(lambda_transcriptor.detect_speech(audio),
+                         [(0, len(audio))])
+
+    def test_remap_segments_to_original_timeline(self):
+        sample_rate = lambda_transcriptor.SAMPLE_RATE
+        audio = layout_audio([(10, 0.3), (20, 0.001), (10, 0.3)])
+        regions = [(0, 10 * sample_rate), (30 * sample_rate, 40 * sample_rate)]
+        short_audio, timeline = lambda_transcriptor.remove_silence(audio, regions)
+        self.assertEqual(len(short_audio), 20 * sample_rate)
+
+        segments = [{'start': 2.0, 'end': 10.0, 'text': 'a'},
+                    {'start': 10.0, 'end': 12.5, 'text': 'b'},
+                    {'start': 8.0, 'end': 11.0, 'text': 'c'}]
+        remapped = lambda_transcriptor.remap_segments(segments, timeline)
+        self.assertEqual([(s['start'], s['end']) for s in remapped],
+                         [(2.0, 10.0), (30.0, 32.5), (8.0, 31.0)])
+        self.assertEqual([s['text'] for s in remapped], ['a', 'b', 'c'])
+
+    def test_transcription_skips_silence(self):
+        audio = layout_audio([(30, 0.001), (10, 0.3), (60, 0.001), (10, 0.3)])
+        transcription = lambda_transcriptor.get_transcription(
+            audio, FakeModel(), workers=1, vad=True)
+
+        starts = [s['start'] for s in transcription['segments']]
+        self.assertTrue(len(starts) >= 20)
+        for start in starts:
+            self.assertTrue(29 <= start < 41 or 99 <= start < 111, start)
+
+    def test_silent_audio_is_not_transcribed(self):
+        audio = np.zeros(30 * lambda_transcriptor.SAMPLE_RATE, dtype=np.float32)
+        with patch.object(FakeModel, 'transcribe') as mock_transcribe:
+            transcription = lambda_transcriptor.get_transcription(
+                audio, FakeModel(), workers=1, vad=True)
+        mock_transcribe.assert_not_called()
+        self.assertEqual(transcription, {'segments': [], 'text': ''})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import os
+import shutil
+import tempfile
+
+import s3_io
+import workspace
+
+
+class TestRequestFolder(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.requests_dir = os.path.join(self.root, 'requests')
+        patcher = patch.object(workspace, 'REQUESTS_DIR', self.requests_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def test_folders_are_unique_and_removed(self):
+        with workspace.request_folder('test') as first, \
+                workspace.request_folder('test') as second:
+            self.assertNotEqual(first, second)
+            for folder in (first, second):
+                self.assertEqual(os.path.dirname(folder), self.requests_dir)
+                with open(os.path.join(folder, 'video.mp4'), 'w') as f:
+                    f.write('video')
+        self.assertEqual(os.listdir(self.requests_dir), [])
+
+    def test_folder_is_removed_on_errors(self):
+        with self.assertRaises(ValueError):
+            with workspace.request_folder('test') as folder:
+                raise ValueError()
+        self.assertFalse(os.path.exists(folder))
+
+    def test_clean_removes_leftovers(self):
+        os.makedirs(os.path.join(self.requests_dir, 'test-old'))
+        workspace.clean()
+        self.assertEqual(os.listdir(self.requests_dir), [])
+
+
+class TestEviction(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        self.files = []
+        for i, name in enumerate(('old.pt', 'used.pt', 'new.pt')):
+            path = os.path.join(self.cache_dir, name)
+            with open(path, 'wb') as f:
+                f.write(b'0' * 10)
+            os.utime(path, (1000 + i, 1000 + i))
+            self.files.append(path)
+        patcher = patch.object(workspace, '_protected', set())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def free_bytes(self, path):
+        # Every cached file takes the room of one MB
+        return (3 - len(os.listdir(self.cache_dir))) * workspace.MB
+
+    def ensure_space(self, nbytes):
+        with patch.object(workspace, 'free_bytes', self.free_bytes), \
+                patch.object(workspace, 'RESERVE_MB', 0):
+            return workspace.ensure_space(nbytes, self.cache_dir, self.cache_dir)
+
+    def test_nothing_evicted_if_it_fits(self):
+        self.ensure_space(0)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 3)
+
+    def test_least_recently_used_first(self):
+        workspace.touch(self.files[0])
+        self.ensure_space(workspace.MB)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ['new.pt', 'old.pt'])
+
+    def test_protected_files_are_kept(self):
+        workspace.protect(self.files[1])
+        self.ensure_space(2 * workspace.MB)
+        self.assertEqual(os.listdir(self.cache_dir), ['used.pt'])
+
+    def test_files_being_written_are_kept(self):
+        writing = ['new.pt.0123456789abcdef0123456789abcdef.download',
+                   'new.pt.0123456789abcdef0123456789abcdef.download.1a2b3c4d',
+                   'new.int8.pt.0123456789abcdef0123456789abcdef.part']
+        for name in writing:
+            path = os.path.join(self.cache_dir, name)
+            with open(path, 'wb') as f:
+                f.write(b'0' * 10)
+            os.utime(path, (0, 0))
+        self.assertEqual([path for _, path in workspace.cache_files(self.cache_dir)],
+                         self.files)
+
+    def test_raises_if_it_does_not_fit(self):
+        workspace.protect(self.files[1])
+        with self.assertRaises(IOError):
+            self.ensure_space(3 * workspace.MB)
+
+    def test_download_makes_room(self):
+        s3 = MagicMock()
+        s3.head_object.return_value = {'ContentLength': 1024}
+        with patch.object(workspace, 'ensure_space') as mock_ensure_space:
+            workspace.download(s3, 'bucket', 'videos/video.mp4', '/tmp/video.mp4')
+        mock_ensure_space.assert_called_once_with(1024)
+        s3.download_file.assert_called_once_with('bucket', 'videos/video.mp4',
+                                                 '/tmp/video.mp4',
+                                                 Config=s3_io.TRANSFER_CONFIG)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""Scratch space of the lambdas in the ephemeral storage (/tmp).
+
+Every request works in its own folder under requests/, removed with all its
+files when the request ends. Keys with the same basename never collide, and a
+warm container does not fill the storage. cache/ survives between invocations
+(the model checkpoints are kept there). Before a download, the least recently
+used cache files are removed until it fits, except the ones in use and the
+ones still being written.
+"""
+import contextlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+import s3_io
+
+MB = 1024 * 1024
+
+ROOT = os.environ.get('workspace_dir', '/tmp')
+REQUESTS_DIR = os.path.join(ROOT, 'requests')
+CACHE_DIR = os.path.join(ROOT, 'cache')
+# Free space left after every download, for the ffmpeg outputs
+RESERVE_MB = int(os.environ.get('workspace_reserve_mb', 64))
+
+# Cache files that are never evicted, like the memory-mapped model
+_protected = set()
+_lock = threading.Lock()
+# Files still being written, like the model downloads (*.download and the
+# temporary *.download.<8 hex> of s3transfer) and conversions (*.part)
+IN_FLIGHT = re.compile(r"\.(download|part)(\.[0-9a-fA-F]{8})?$")
+
+
+def clean():
+    """Remove the folders left by requests that did not finish."""
+    shutil.rmtree(REQUESTS_DIR, ignore_errors=True)
+    os.makedirs(REQUESTS_DIR, exist_ok=True)
+
+
+@contextlib.contextmanager
+def request_folder(name='request'):
+    """A new empty folder, removed when the block exits."""
+    os.makedirs(REQUESTS_DIR, exist_ok=True)
+    folder = tempfile.mkdtemp(prefix=f"{name}-", dir=REQUESTS_DIR)
+    try:
+        yield folder
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def touch(path):
+    """Mark a cache file as just used."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def protect(path):
+    with _lock:
+        _protected.add(os.path.abspath(path))
+    touch(path)
+
+
+def cache_files(cache_dir=CACHE_DIR):
+    """(last use, path) of every file in the cache, least recently used first.
+
+    Files still being written are left out.
+    """
+    files = []
+    for folder, _, names in os.walk(cache_dir):
+        for name in names:
+            if IN_FLIGHT.search(name):
+                continue
+            path = os.path.join(folder, name)
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+    return sorted(files)
+
+
+def free_bytes(path=ROOT):
+    return shutil.disk_usage(path).free
+
+
+def ensure_space(nbytes, path=ROOT, cache_dir=CACHE_DIR):
+    """Evict cache files until nbytes and the reserve fit in path."""
+    needed = nbytes + RESERVE_MB * MB
+    free = free_bytes(path)
+    if free >= needed:
+        return free
+    for _, cached in cache_files(cache_dir):
+        with _lock:
+            if os.path.abspath(cached) in _protected:
+                continue
+        logging.warning("Evicting %s from the cache, %d MB free", cached, free // MB)
+        try:
+            os.remove(cached)
+        except OSError:
+            continue
+        free = free_bytes(path)
+        if free >= needed:
+            return free
+    raise IOError(f"{nbytes // MB} MB do not fit in {path}, {free // MB} MB free")
+
+
+def download(s3, bucket, key, path):
+    """Download an object to path, making room for it first."""
+    size = s3.head_object(Bucket=bucket, Key=key)['ContentLength']
+    ensure_space(size)
+    s3.download_file(bucket, key, path, Config=s3_io.TRANSFER_CONFIG)
+    return path
+
+
+# Inside Lambda nothing else writes to /tmp, so what is left in requests/
+# comes from a previous run of the container that timed out or crashed.
+# Scripts like pipeline.py import the lambdas on machines with a shared /tmp
+if 'AWS_LAMBDA_FUNCTION_NAME' in os.environ:
+    clean()